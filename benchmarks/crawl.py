@@ -0,0 +1,215 @@
+"""Benchmark of full crawls through ``ScrapyZyteAPIDownloadHandler`` against
+the mock server.
+
+It runs a single crawl with the specified concurrency, body size, ratio of
+``browserHtml`` requests (the rest are ``httpResponseBody`` requests), API
+latency and API error rate, and reports:
+
+-   Throughput, in responses (successful or not) per second.
+
+-   Latency percentiles, from the moment a request reaches the downloader to
+    the moment its callback or errback is called.
+
+-   CPU time of the Scrapy process per request, which does not include the
+    mock server, that runs in a different process.
+
+-   Peak resident set size (RSS) of the Scrapy process.
+
+Use ``--set`` to run the crawl with different settings, and ``--json`` to get
+machine-readable results, e.g. to compare them between versions::
+
+    python benchmarks/crawl.py --json > before.json
+    python benchmarks/crawl.py --json --set ZYTE_API_STREAMING=True > after.json
+
+Usage::
+
+    python benchmarks/crawl.py [--requests N] [--concurrency N] [--size BYTES]
+        [--browser-html RATIO] [--latency SECONDS] [--error-rate RATIO]
+        [--error-status STATUS] [--seed SEED] [--set NAME=VALUE]... [--json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from random import Random
+
+from scrapy.utils.reactor import install_reactor
+
+install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
+
+from scrapy import Request, Spider, signals  # noqa: E402
+from scrapy.crawler import CrawlerRunner  # noqa: E402
+from twisted.internet import defer, reactor  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from tests import SETTINGS  # noqa: E402
+from tests.mockserver import MockServer, SizedResource  # noqa: E402
+
+
+class BenchSpider(Spider):
+    name = "bench"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(
+            spider.request_reached_downloader, signals.request_reached_downloader
+        )
+        spider.latencies = []
+        spider.errors = 0
+        return spider
+
+    def start_requests(self):
+        random = Random(self.args.seed)
+        for index in range(self.args.requests):
+            params = {"size": self.args.size}
+            if random.random() < self.args.browser_html:
+                params["browserHtml"] = True
+            else:
+                params["httpResponseBody"] = True
+            if self.args.latency:
+                params["delay"] = self.args.latency
+            if random.random() < self.args.error_rate:
+                params["status"] = self.args.error_status
+            yield Request(
+                f"https://example.com/{index}",
+                meta={"zyte_api": params},
+                errback=self.errback,
+                dont_filter=True,
+            )
+
+    def request_reached_downloader(self, request, spider):
+        request.meta["bench_start"] = time.perf_counter()
+
+    def parse(self, response):
+        self.latencies.append(time.perf_counter() - response.meta["bench_start"])
+
+    def errback(self, failure):
+        self.errors += 1
+        self.parse(failure.request)
+
+
+def percentile(values, percent):
+    """Return the *percent* percentile of the sorted *values*, using the
+    nearest-rank method."""
+    if not values:
+        return float("nan")
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+def peak_rss():
+    """Return the peak resident set size of this process, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@defer.inlineCallbacks
+def run(args, server):
+    settings = {
+        **SETTINGS,
+        "ZYTE_API_URL": server.urljoin("/"),
+        "CONCURRENT_REQUESTS": args.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+        "LOG_LEVEL": "CRITICAL",
+        **dict(setting.split("=", 1) for setting in args.set),
+    }
+    crawler = CrawlerRunner(settings).create_crawler(BenchSpider)
+    start, cpu_start = time.perf_counter(), time.process_time()
+    yield crawler.crawl(args=args)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    latencies = sorted(crawler.spider.latencies)
+    return {
+        "requests": args.requests,
+        "errors": crawler.spider.errors,
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "cpu_per_request": cpu / args.requests,
+        "peak_rss": peak_rss(),
+    }
+
+
+def print_results(results):
+    print(f"requests:           {results['requests']}")
+    print(f"errors:             {results['errors']}")
+    print(f"time (s):           {results['seconds']:.2f}")
+    print(f"requests/s:         {results['requests_per_second']:.1f}")
+    for percent in (50, 95, 99):
+        latency = results[f"latency_p{percent}"] * 1000
+        print(f"latency p{percent} (ms):   {latency:.1f}")
+    print(f"CPU/request (ms):   {results['cpu_per_request'] * 1000:.3f}")
+    print(f"peak RSS (MiB):     {results['peak_rss'] / 2**20:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--size", type=int, default=100 * 1024)
+    parser.add_argument(
+        "--browser-html",
+        type=float,
+        default=0.5,
+        help="ratio of browserHtml requests",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds the mock server waits before each response",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="ratio of requests that get an error response",
+    )
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        default=500,
+        help="HTTP status code of error responses",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Scrapy setting to use in the crawl",
+    )
+    parser.add_argument("--json", action="store_true", help="output JSON")
+    args = parser.parse_args()
+
+    results = {}
+
+    def store(value):
+        results.update(value)
+        reactor.stop()
+
+    with MockServer(SizedResource) as server:
+        d = run(args, server)
+        d.addCallback(store)
+        d.addErrback(lambda failure: (failure.printTraceback(), reactor.stop()))
+        reactor.run()
+
+    if not results:
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark of ``ZYTE_API_JSON_BACKEND`` against the mock server.
+
+It runs the same crawl with each installed JSON backend, and reports the
+requests per second and the CPU time of the Scrapy process per response.
+
+Usage::
+
+    python benchmarks/json_backend.py [--requests N] [--size BYTES]
+"""
+
+import argparse
+import os
+import sys
+import time
+from importlib import import_module
+
+from scrapy.utils.reactor import install_reactor
+
+install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
+
+from scrapy import Request, Spider  # noqa: E402
+from scrapy.crawler import CrawlerRunner  # noqa: E402
+from twisted.internet import defer, reactor  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from scrapy_zyte_api._json import JSON_BACKENDS  # noqa: E402
+from tests import SETTINGS  # noqa: E402
+from tests.mockserver import MockServer, SizedResource  # noqa: E402
+
+
+class BenchSpider(Spider):
+    name = "bench"
+
+    def start_requests(self):
+        for index in range(self.requests):
+            yield Request(
+                f"https://example.com/{index}",
+                meta={"zyte_api": {"browserHtml": True, "size": self.size}},
+            )
+
+    def parse(self, response):
+        pass
+
+
+def installed_backends():
+    for backend in JSON_BACKENDS:
+        try:
+            import_module(backend)
+        except ImportError:
+            continue
+        yield backend
+
+
+@defer.inlineCallbacks
+def run(args, server):
+    runner = CrawlerRunner(
+        {
+            **SETTINGS,
+            "ZYTE_API_URL": server.urljoin("/"),
+            "CONCURRENT_REQUESTS": 32,
+            "LOG_LEVEL": "ERROR",
+        }
+    )
+    header = "{:>8}  {:>10}  {:>16}".format(
+        "backend", "requests/s", "CPU/response (ms)"
+    )
+    print(header)
+    print("-" * len(header))
+    for backend in installed_backends():
+        start, cpu_start = time.perf_counter(), time.process_time()
+        yield runner.crawl(
+            BenchSpider,
+            requests=args.requests,
+            size=args.size,
+            settings={"ZYTE_API_JSON_BACKEND": backend},
+        )
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        print(
+            "{:>8}  {:>10.1f}  {:>16.3f}".format(
+                backend, args.requests / elapsed, cpu / args.requests * 1000
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=100 * 1024)
+    args = parser.parse_args()
+
+    with MockServer(SizedResource) as server:
+        d = run(args, server)
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
+
+
+if __name__ == "__main__":
+    main()
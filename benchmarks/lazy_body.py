@@ -0,0 +1,105 @@
+"""Benchmark of ``ZYTE_API_LAZY_BODY`` against the mock server.
+
+It runs a crawl where a downloader middleware drops 80% of the responses
+before they reach the spider, first with eagerly-decoded bodies and then with
+lazily-decoded ones, and reports the wall time and the CPU time of the Scrapy
+process for each crawl.
+
+Usage::
+
+    python benchmarks/lazy_body.py [--requests N] [--size BYTES]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from scrapy.utils.reactor import install_reactor
+
+install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
+
+from scrapy import Request, Spider  # noqa: E402
+from scrapy.crawler import CrawlerRunner  # noqa: E402
+from scrapy.exceptions import IgnoreRequest  # noqa: E402
+from twisted.internet import defer, reactor  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from tests import SETTINGS  # noqa: E402
+from tests.mockserver import MockServer, SizedResource  # noqa: E402
+
+DROP_RATIO = 0.8
+
+
+class DropMiddleware:
+    def process_response(self, request, response, spider):
+        if request.meta["index"] % 10 < DROP_RATIO * 10:
+            raise IgnoreRequest
+        return response
+
+
+class BenchSpider(Spider):
+    name = "bench"
+
+    def start_requests(self):
+        for index in range(self.requests):
+            yield Request(
+                f"https://example.com/{index}",
+                meta={
+                    "index": index,
+                    "zyte_api": {"httpResponseBody": True, "size": self.size},
+                },
+            )
+
+    def parse(self, response):
+        yield {"length": len(response.body)}
+
+
+@defer.inlineCallbacks
+def run(args, server):
+    runner = CrawlerRunner(
+        {
+            **SETTINGS,
+            "ZYTE_API_URL": server.urljoin("/"),
+            "CONCURRENT_REQUESTS": 32,
+            "DOWNLOADER_MIDDLEWARES": {f"{__name__}.DropMiddleware": 1000},
+            "LOG_LEVEL": "ERROR",
+        }
+    )
+    header = "{:>10}  {:>10}  {:>10}".format("lazy body", "wall (s)", "CPU (s)")
+    print(header)
+    print("-" * len(header))
+    for lazy_body in (False, True):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        yield runner.crawl(
+            BenchSpider,
+            requests=args.requests,
+            size=args.size,
+            settings={"ZYTE_API_LAZY_BODY": lazy_body},
+        )
+        print(
+            "{:>10}  {:>10.2f}  {:>10.2f}".format(
+                str(lazy_body),
+                time.perf_counter() - start,
+                time.process_time() - cpu_start,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    with MockServer(SizedResource) as server:
+        d = run(args, server)
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
+
+
+if __name__ == "__main__":
+    main()
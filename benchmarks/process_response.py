@@ -0,0 +1,104 @@
+"""Micro-benchmark of building responses from Zyte API responses with an
+``httpResponseBody``.
+
+It compares the current ``_process_response`` implementation, which decodes
+the body only once, with the previous one, which decoded it once to guess the
+response class and once more to build the response.
+
+Usage::
+
+    python benchmarks/process_response.py [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+from base64 import b64decode, b64encode
+
+from scrapy import Request
+from scrapy.http import TextResponse
+from scrapy.responsetypes import responsetypes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapy_zyte_api.responses import (  # noqa: E402
+    ZyteAPIResponse,
+    ZyteAPITextResponse,
+    _process_response,
+)
+
+SIZES = {
+    "10 KB": 10 * 1024,
+    "1 MB": 1024 * 1024,
+    "20 MB": 20 * 1024 * 1024,
+}
+URL = "https://example.com/feed"
+
+
+def decode_twice(api_response, request):
+    """Replica of the former implementation of ``_process_response`` for
+    ``httpResponseBody``."""
+    response_cls = responsetypes.from_args(
+        headers=api_response["httpResponseHeaders"],
+        url=api_response["url"],
+        body=b64decode(api_response["httpResponseBody"]),
+    )
+    if issubclass(response_cls, TextResponse):
+        return ZyteAPITextResponse.from_api_response(api_response, request=request)
+    return ZyteAPIResponse.from_api_response(api_response, request=request)
+
+
+def build_api_response(size):
+    line = b"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n"
+    body = b"<html><body>" + line * (size // len(line)) + b"</body></html>"
+    return {
+        "url": URL,
+        "httpResponseBody": b64encode(body).decode(),
+        "httpResponseHeaders": [
+            {"name": "Content-Type", "value": "text/html; charset=utf-8"}
+        ],
+    }
+
+
+def measure(func, api_response, request, repeat):
+    seconds = min(
+        timeit.repeat(lambda: func(api_response, request), number=1, repeat=repeat)
+    )
+    tracemalloc.start()
+    func(api_response, request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    request = Request(URL)
+    header = "{:>6}  {:>22}  {:>22}  {:>8}".format(
+        "size", "decode twice (ms / MiB)", "decode once (ms / MiB)", "speedup"
+    )
+    print(header)
+    print("-" * len(header))
+    for label, size in SIZES.items():
+        api_response = build_api_response(size)
+        before = measure(decode_twice, api_response, request, args.repeat)
+        after = measure(_process_response, api_response, request, args.repeat)
+        print(
+            "{:>6}  {:>10.2f} / {:>9.2f}  {:>10.2f} / {:>9.2f}  {:>7.2f}x".format(
+                label,
+                before[0] * 1000,
+                before[1] / 2**20,
+                after[0] * 1000,
+                after[1] / 2**20,
+                before[0] / after[0],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
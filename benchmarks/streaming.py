@@ -0,0 +1,114 @@
+"""Micro-benchmark of ``ZYTE_API_STREAMING``.
+
+It compares building a response from a Zyte API response with an
+``httpResponseBody`` received in 64 KiB chunks, buffering the whole JSON
+document before parsing it, as aiohttp does, with decoding
+``httpResponseBody`` while the chunks are received, keeping the decoded body
+in memory or spooling it to a temporary file.
+
+Usage::
+
+    python benchmarks/streaming.py [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from base64 import b64encode
+
+from scrapy import Request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapy_zyte_api._streaming import _StreamingParser  # noqa: E402
+from scrapy_zyte_api.responses import _DecodedBody, _process_response  # noqa: E402
+
+SIZES = {
+    "1 MB": 1024 * 1024,
+    "20 MB": 20 * 1024 * 1024,
+    "100 MB": 100 * 1024 * 1024,
+}
+CHUNK_SIZE = 64 * 1024
+URL = "https://example.com/file"
+
+
+def build_chunks(size):
+    line = b"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n"
+    body = b"<html><body>" + line * (size // len(line)) + b"</body></html>"
+    document = json.dumps(
+        {
+            "url": URL,
+            "httpResponseBody": b64encode(body).decode(),
+            "httpResponseHeaders": [
+                {"name": "Content-Type", "value": "text/html; charset=utf-8"}
+            ],
+        }
+    ).encode()
+    return [
+        document[index : index + CHUNK_SIZE]
+        for index in range(0, len(document), CHUNK_SIZE)
+    ]
+
+
+def buffered(chunks, request):
+    api_response = json.loads(b"".join(chunks).decode())
+    return _process_response(api_response, request)
+
+
+def streaming(max_memory_size):
+    def process(chunks, request):
+        parser = _StreamingParser(max_memory_size=max_memory_size)
+        for chunk in chunks:
+            parser.feed(chunk)
+        document, body_file = parser.close()
+        api_response = json.loads(document.decode())
+        assert body_file is not None
+        with body_file:
+            body = body_file.read()
+        api_response["httpResponseBody"] = _DecodedBody(body, len(body))
+        return _process_response(api_response, request)
+
+    return process
+
+
+def measure(func, chunks, request, repeat):
+    seconds = min(timeit.repeat(lambda: func(chunks, request), number=1, repeat=repeat))
+    tracemalloc.start()
+    func(chunks, request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    request = Request(URL)
+    implementations = {
+        "buffered": buffered,
+        "streaming, in memory": streaming(2**31),
+        "streaming, temp file": streaming(1024 * 1024),
+    }
+    header = "{:>6}  {:>20}  {:>10}  {:>14}".format(
+        "size", "implementation", "time (ms)", "peak mem (MiB)"
+    )
+    print(header)
+    print("-" * len(header))
+    for label, size in SIZES.items():
+        chunks = build_chunks(size)
+        for name, func in implementations.items():
+            seconds, peak = measure(func, chunks, request, args.repeat)
+            print(
+                "{:>6}  {:>20}  {:>10.2f}  {:>14.2f}".format(
+                    label, name, seconds * 1000, peak / 2**20
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,7 @@
+from scrapy_zyte_api.exceptions import ZyteAPIError  # NOQA
+from scrapy_zyte_api.fingerprinter import (  # NOQA
+    ScrapyZyteAPIDupeFilter,
+    ScrapyZyteAPIRequestFingerprinter,
+)
 from scrapy_zyte_api.handler import ScrapyZyteAPIDownloadHandler  # NOQA
+from scrapy_zyte_api.middlewares import ZyteAPIRetryMiddleware  # NOQA
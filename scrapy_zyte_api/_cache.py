@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import sqlite3
+from base64 import b64encode
+from threading import Lock
+from time import time
+from typing import Any, Callable, Dict, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+from .responses import _HTTP_RESPONSE_BODY, _DecodedBody
+
+# Zyte API request parameters that do not affect the response.
+_IGNORED_PARAMS = ("jobId",)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def _cache_key(api_data: Dict[str, Any]) -> str:
+    """Return a key for *api_data* that does not depend on the order of its
+    parameters.
+
+    The standard library JSON encoder is used regardless of
+    ``ZYTE_API_JSON_BACKEND``, so that keys do not change with it."""
+    params = {
+        key: value for key, value in api_data.items() if key not in _IGNORED_PARAMS
+    }
+    canonical = json.dumps(
+        params, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def _dump_api_response(
+    api_response: Dict[str, Any], dumps: Callable[[Any], str]
+) -> bytes:
+    """Return *api_response* serialized as JSON, as received from Zyte API.
+
+    If ``httpResponseBody`` was decoded while the response was received, it
+    is encoded again."""
+    body = api_response.get(_HTTP_RESPONSE_BODY)
+    if isinstance(body, _DecodedBody):
+        if isinstance(body.value, bytes):
+            data = body.value
+        else:
+            data = body.value.read()
+            body.value.seek(0)
+        api_response = {**api_response, _HTTP_RESPONSE_BODY: b64encode(data).decode()}
+    return dumps(api_response).encode()
+
+
+class _ResponseCache:
+    """Stores Zyte API responses, serialized as JSON, in a SQLite database in
+    the *path* directory.
+
+    Responses older than *expiration* seconds are not returned, and are
+    removed. An *expiration* of ``0`` means that responses never expire.
+
+    If the size of the stored responses exceeds *max_size* bytes, the least
+    recently used responses are removed. A *max_size* of ``0`` means no
+    limit.
+
+    Responses may be got and set from any thread, one thread at a time, so
+    that the handler can keep SQLite off the reactor thread.
+    """
+
+    def __init__(
+        self,
+        *,
+        path: str,
+        expiration: int,
+        max_size: int,
+        stats: StatsCollector,
+    ):
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(path, "responses.sqlite"), check_same_thread=False
+        )
+        # Losing the last responses stored on a power loss is fine for a
+        # cache, in exchange for cheaper commits.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = Lock()
+        self._expiration = expiration
+        self._max_size = max_size
+        self._stats = stats
+        self._remove_expired()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def _remove_expired(self) -> None:
+        if self._expiration > 0:
+            with self._db:
+                cursor = self._db.execute(
+                    "DELETE FROM responses WHERE created < ?",
+                    (time() - self._expiration,),
+                )
+            if cursor.rowcount:
+                self._stats.inc_value("scrapy-zyte-api/cache/expired", cursor.rowcount)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = self._db.execute(
+            "SELECT data, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self._stats.inc_value("scrapy-zyte-api/cache/miss")
+            return None
+        data, created = row
+        now = time()
+        if 0 < self._expiration < now - created:
+            self._delete(key, len(data))
+            self._stats.inc_value("scrapy-zyte-api/cache/expired")
+            self._stats.inc_value("scrapy-zyte-api/cache/miss")
+            return None
+        with self._db:
+            self._db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        self._stats.inc_value("scrapy-zyte-api/cache/hit")
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._set(key, data)
+
+    def _set(self, key: str, data: bytes) -> None:
+        if 0 < self._max_size < len(data):
+            return
+        now = time()
+        with self._db:
+            row = self._db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+        self._size += len(data) - (row[0] if row else 0)
+        self._stats.inc_value("scrapy-zyte-api/cache/store")
+        self._evict()
+
+    def _delete(self, key: str, size: int) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._size -= size
+
+    def _evict(self) -> None:
+        if self._max_size <= 0 or self._size <= self._max_size:
+            return
+        cursor = self._db.execute("SELECT key, size FROM responses ORDER BY accessed")
+        evicted = []
+        for key, size in cursor:
+            if self._size <= self._max_size:
+                break
+            evicted.append((key,))
+            self._size -= size
+        cursor.close()
+        with self._db:
+            self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._stats.inc_value("scrapy-zyte-api/cache/evicted", len(evicted))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
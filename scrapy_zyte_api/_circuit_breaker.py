@@ -0,0 +1,118 @@
+from collections import deque
+from time import perf_counter
+from typing import Callable, Deque, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+# States of _CircuitBreaker.
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class _CircuitOpen(Exception):
+    """An attempt to send a Zyte API request was not allowed by
+    :class:`_CircuitBreaker`, and may be allowed after *retry_after*
+    seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class _CircuitBreaker:
+    """Stops Zyte API requests from being sent while most of them fail.
+
+    When at least *failure_rate* of the last *window* attempts failed, the
+    circuit opens: attempts are not allowed for *cooldown* seconds. Then the
+    circuit is half-open: up to *probes* attempts at a time are allowed, and
+    the circuit closes again as soon as one of them succeeds, or opens again
+    as soon as one of them fails.
+
+    *on_state_change* is called with the new state whenever it changes.
+    """
+
+    def __init__(
+        self,
+        *,
+        window: int,
+        failure_rate: float,
+        cooldown: float,
+        probes: int,
+        stats: StatsCollector,
+        on_state_change: Optional[Callable[[str], None]] = None,
+    ):
+        if window < 1 or probes < 1:
+            raise ValueError(
+                f"The circuit breaker window ({window}) and probes ({probes}) "
+                f"must be at least 1."
+            )
+        self.state = CIRCUIT_CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._failures = 0
+        self._failure_rate = failure_rate
+        self._cooldown = cooldown
+        self._opened_at = 0.0
+        self._probes = probes
+        self._probes_in_flight = 0
+        self._stats = stats
+        self._on_state_change = on_state_change
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self._stats.inc_value(f"scrapy-zyte-api/circuit_breaker/{state}")
+        if self._on_state_change is not None:
+            self._on_state_change(state)
+
+    def _open(self) -> None:
+        self._opened_at = perf_counter()
+        self._set_state(CIRCUIT_OPEN)
+
+    def check(self) -> bool:
+        """Raise :exc:`_CircuitOpen` if an attempt is not allowed now, or
+        return whether it is allowed as a probe.
+
+        The outcome of allowed attempts must be reported with
+        :meth:`record`."""
+        if self.state == CIRCUIT_CLOSED:
+            return False
+        if self.state == CIRCUIT_OPEN:
+            remaining = self._opened_at + self._cooldown - perf_counter()
+            if remaining > 0:
+                self._stats.inc_value("scrapy-zyte-api/circuit_breaker/rejected")
+                raise _CircuitOpen(remaining)
+            self._probes_in_flight = 0
+            self._set_state(CIRCUIT_HALF_OPEN)
+        if self._probes_in_flight >= self._probes:
+            self._stats.inc_value("scrapy-zyte-api/circuit_breaker/rejected")
+            raise _CircuitOpen(0.0)
+        self._probes_in_flight += 1
+        return True
+
+    def record(self, failed: Optional[bool], *, probe: bool) -> None:
+        """Report the outcome of an attempt allowed by :meth:`check`:
+        whether it *failed*, or ``None`` if it was cancelled."""
+        if probe:
+            if self.state != CIRCUIT_HALF_OPEN:
+                return
+            self._probes_in_flight -= 1
+            if failed:
+                self._open()
+            elif failed is not None:
+                self._outcomes.clear()
+                self._failures = 0
+                self._set_state(CIRCUIT_CLOSED)
+            return
+        # Outcomes of attempts sent before the circuit opened do not count.
+        if failed is None or self.state != CIRCUIT_CLOSED:
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if len(
+            self._outcomes
+        ) == self._outcomes.maxlen and self._failures >= self._failure_rate * len(
+            self._outcomes
+        ):
+            self._open()
@@ -0,0 +1,80 @@
+import asyncio
+from copy import copy
+from typing import Any, Awaitable, Callable, Dict
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.statscollectors import StatsCollector
+
+
+class _Pending:
+    __slots__ = ("future", "followers")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.followers = 0
+
+
+class _Coalescer:
+    """Makes concurrent calls with the same key share the result of a single
+    call, the one that comes first.
+
+    If that call fails, the calls that share its result raise
+    :exc:`~scrapy.exceptions.IgnoreRequest`, or a copy of the exception of
+    that call if it is an instance of it. If it is cancelled, one of them is
+    made instead.
+    """
+
+    def __init__(self, *, stats: StatsCollector):
+        self._stats = stats
+        self._pending: Dict[str, _Pending] = {}
+
+    async def run(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        share: Callable[[Any], Any],
+    ) -> Any:
+        """Return the result of calling *func*, or of the ongoing call with
+        the same *key*.
+
+        *share* is called with the result of *func* if other calls share it,
+        and must return a version of it that can be used by all of them."""
+        while key in self._pending:
+            pending = self._pending[key]
+            pending.followers += 1
+            try:
+                result = await asyncio.shield(pending.future)
+            except asyncio.CancelledError:
+                if not pending.future.cancelled():
+                    raise
+            except IgnoreRequest as exception:
+                self._stats.inc_value("scrapy-zyte-api/coalesced")
+                # Exceptions must not be raised by several calls.
+                raise copy(exception)
+            except Exception:
+                self._stats.inc_value("scrapy-zyte-api/coalesced")
+                raise IgnoreRequest()
+            else:
+                self._stats.inc_value("scrapy-zyte-api/coalesced")
+                return result
+
+        pending = self._pending[key] = _Pending(
+            asyncio.get_running_loop().create_future()
+        )
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as exception:
+            pending.future.set_exception(exception)
+            # Do not log the exception if no call shares it.
+            pending.future.exception()
+            raise
+        else:
+            if pending.followers:
+                result = share(result)
+            pending.future.set_result(result)
+            return result
+        finally:
+            del self._pending[key]
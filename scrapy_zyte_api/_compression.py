@@ -0,0 +1,90 @@
+import gzip
+import zlib
+from typing import Optional, Tuple, Type
+
+from aiohttp import ClientPayloadError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_DECOMPRESSION_ERRORS: Tuple[Type[Exception], ...] = (zlib.error,)
+if brotli is not None:
+    _DECOMPRESSION_ERRORS += (brotli.error,)
+
+# Value of the Accept-Encoding header of Zyte API requests when
+# ZYTE_API_COMPRESSION is enabled.
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+# Compression level of request bodies, favoring speed, since request bodies
+# are compressed in the event loop.
+_REQUEST_COMPRESSION_LEVEL = 1
+
+
+class _Decompressor:
+    """Decompresses a response body with the *encoding* content encoding
+    chunk by chunk.
+
+    Decompressing a chunk returns all of its output, so there is nothing
+    left to flush at the end."""
+
+    def __init__(self, encoding: str):
+        self._brotli = None
+        if encoding == "br":
+            if brotli is None:
+                raise ClientPayloadError(
+                    "Received a brotli-compressed Zyte API response, but "
+                    "brotli is not installed."
+                )
+            self._brotli = brotli.Decompressor()
+        else:
+            # Detect the gzip or zlib (deflate) header.
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        # Data received so far while deflate data may turn out to be raw,
+        # without a zlib header, as some servers send it, or None.
+        self._deflate_data: Optional[bytes] = b"" if encoding == "deflate" else None
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            if self._brotli is not None:
+                return self._brotli.process(data)
+            if self._deflate_data is None:
+                return self._zlib.decompress(data)
+            return self._decompress_deflate(data)
+        except _DECOMPRESSION_ERRORS as error:
+            raise ClientPayloadError(
+                f"Could not decompress a Zyte API response: {error}"
+            ) from error
+
+    def _decompress_deflate(self, data: bytes) -> bytes:
+        assert self._deflate_data is not None
+        self._deflate_data += data
+        try:
+            output = self._zlib.decompress(data)
+        except zlib.error:
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            output = self._zlib.decompress(self._deflate_data)
+            self._deflate_data = None
+            return output
+        if output:
+            # The zlib header was valid.
+            self._deflate_data = None
+        return output
+
+
+def _get_decompressor(content_encoding: str) -> Optional[_Decompressor]:
+    """Return a decompressor for the *content_encoding* of a response, or
+    ``None`` if the response is not compressed."""
+    encoding = content_encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding not in ("gzip", "x-gzip", "deflate", "br"):
+        raise ClientPayloadError(
+            f"Unsupported Zyte API response content encoding: {content_encoding!r}"
+        )
+    return _Decompressor(encoding)
+
+
+def _compress_request_body(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=_REQUEST_COMPRESSION_LEVEL)
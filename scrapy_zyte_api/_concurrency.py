@@ -0,0 +1,146 @@
+import asyncio
+from collections import deque
+from time import perf_counter
+from typing import Deque, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+# HTTP status codes with which Zyte API signals that it is being sent more
+# requests than it can handle.
+_THROTTLING_STATUS_CODES = (429, 503)
+
+# Weights of the latest latency in the fast and slow exponentially weighted
+# moving averages of latency.
+_FAST_LATENCY_WEIGHT = 0.3
+_SLOW_LATENCY_WEIGHT = 0.02
+
+
+class _AdaptiveConcurrency:
+    """Limits the number of concurrent attempts to send Zyte API requests
+    with additive increase, multiplicative decrease (AIMD), as TCP congestion
+    control does.
+
+    The limit starts at *minimum* and, until the first throttling response,
+    grows by 1 with every successful attempt, doubling every round trip (slow
+    start). Afterwards, it grows by 1 every *limit* successful attempts, i.e.
+    by 1 every round trip.
+
+    It does not grow while errors other than throttling happen, or while
+    latency is *latency_factor* times higher than usual, as measured by
+    comparing a fast moving average of latency to a slow one.
+
+    On a throttling response, the limit is multiplied by *decrease_factor*,
+    at most once per round trip: throttling responses to attempts started
+    before the last decrease do not decrease the limit further.
+
+    The limit never goes below *minimum* or above *maximum*.
+    """
+
+    def __init__(
+        self,
+        *,
+        minimum: int,
+        maximum: int,
+        stats: StatsCollector,
+        decrease_factor: float = 0.5,
+        latency_factor: float = 2.0,
+    ):
+        if not 1 <= minimum <= maximum:
+            raise ValueError(
+                f"The adaptive concurrency floor ({minimum}) must be at least "
+                f"1 and not higher than the ceiling ({maximum})."
+            )
+        self.minimum = minimum
+        self.maximum = maximum
+        self._stats = stats
+        self._decrease_factor = decrease_factor
+        self._latency_factor = latency_factor
+        self._limit = float(minimum)
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._fast_latency: Optional[float] = None
+        self._slow_latency: Optional[float] = None
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._set_limit_stat()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self) -> None:
+        """Wait until an attempt can be sent without exceeding the limit."""
+        if not self._waiters and self._in_flight < self.limit:
+            self._in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # If the slot had already been handed over, give it back.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot is handed over, rather than left for the waiter to
+                # take, so that new requests cannot take it first.
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def record(self, status: Optional[int], *, start: float) -> None:
+        """Adapt the limit to the outcome of an attempt started at *start*,
+        as returned by :func:`time.perf_counter`, that got a response with
+        the *status* HTTP status code, or no response if *status* is
+        ``None``."""
+        if status in _THROTTLING_STATUS_CODES:
+            self._decrease(start)
+        elif status is not None and status < 400:
+            if self._is_latency_healthy(perf_counter() - start):
+                self._increase()
+        elif status is None or status >= 500:
+            self._stats.inc_value("scrapy-zyte-api/concurrency/holds")
+
+    def _is_latency_healthy(self, latency: float) -> bool:
+        if self._fast_latency is None or self._slow_latency is None:
+            self._fast_latency = self._slow_latency = latency
+            return True
+        self._fast_latency += _FAST_LATENCY_WEIGHT * (latency - self._fast_latency)
+        self._slow_latency += _SLOW_LATENCY_WEIGHT * (latency - self._slow_latency)
+        if self._fast_latency > self._latency_factor * self._slow_latency:
+            self._stats.inc_value("scrapy-zyte-api/concurrency/holds")
+            return False
+        return True
+
+    def _increase(self) -> None:
+        if self._limit >= self.maximum:
+            return
+        self._limit += 1 if self._slow_start else 1 / self._limit
+        self._limit = min(self._limit, float(self.maximum))
+        self._set_limit_stat()
+        self._wake_up()
+
+    def _decrease(self, start: float) -> None:
+        self._slow_start = False
+        if start < self._last_decrease:
+            return
+        self._last_decrease = perf_counter()
+        self._limit = max(self._limit * self._decrease_factor, float(self.minimum))
+        self._stats.inc_value("scrapy-zyte-api/concurrency/decreases")
+        self._set_limit_stat()
+
+    def _set_limit_stat(self) -> None:
+        self._stats.set_value("scrapy-zyte-api/concurrency/limit", self.limit)
+        self._stats.max_value("scrapy-zyte-api/concurrency/max_limit", self.limit)
@@ -0,0 +1,55 @@
+import json
+import logging
+from importlib import import_module
+from typing import Any, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class _JSONBackend(NamedTuple):
+    name: str
+    dumps: Callable[[Any], str]
+    loads: Callable[[str], Any]
+
+
+def _orjson_backend(orjson) -> _JSONBackend:
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    return _JSONBackend("orjson", dumps, orjson.loads)
+
+
+def _ujson_backend(ujson) -> _JSONBackend:
+    def dumps(obj: Any) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+    return _JSONBackend("ujson", dumps, ujson.loads)
+
+
+_STDLIB_BACKEND = _JSONBackend("json", json.dumps, json.loads)
+_BACKEND_FACTORIES = {
+    "orjson": _orjson_backend,
+    "ujson": _ujson_backend,
+}
+JSON_BACKENDS = ("json", *_BACKEND_FACTORIES)
+
+
+def _load_json_backend(name: str) -> _JSONBackend:
+    """Return the JSON backend with the specified *name*, or the standard
+    library backend if that backend is not installed."""
+    if name == _STDLIB_BACKEND.name:
+        return _STDLIB_BACKEND
+    if name not in _BACKEND_FACTORIES:
+        raise ValueError(
+            f"Invalid ZYTE_API_JSON_BACKEND value: {name!r}. Valid values are: "
+            f"{', '.join(repr(backend) for backend in JSON_BACKENDS)}."
+        )
+    try:
+        module = import_module(name)
+    except ImportError:
+        logger.warning(
+            f"ZYTE_API_JSON_BACKEND is {name!r}, but {name} is not installed. "
+            f"Falling back to the json module of the standard library."
+        )
+        return _STDLIB_BACKEND
+    return _BACKEND_FACTORIES[name](module)
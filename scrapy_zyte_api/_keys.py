@@ -0,0 +1,104 @@
+from hashlib import sha1
+from itertools import count
+from time import perf_counter
+from typing import List, Optional
+
+from scrapy.statscollectors import StatsCollector
+from zyte_api.aio.client import AsyncClient
+
+from ._session import _SessionPool
+
+# Values of the ZYTE_API_KEY_SELECTION setting.
+KEY_SELECTION_LEAST_IN_FLIGHT = "least-in-flight"
+KEY_SELECTION_ROUND_ROBIN = "round-robin"
+KEY_SELECTION_MODES = (KEY_SELECTION_LEAST_IN_FLIGHT, KEY_SELECTION_ROUND_ROBIN)
+
+# HTTP status codes of Zyte API errors caused by the API key rather than by
+# the request: invalid key, suspended account, and rate or quota limits
+# that persisted through retries.
+_KEY_ERROR_STATUS_CODES = (401, 402, 403, 429)
+
+
+class _PooledKey:
+    """A Zyte API key of :class:`_KeyPool`, with its own client and
+    sessions."""
+
+    def __init__(self, *, client: AsyncClient, sessions: _SessionPool):
+        self.client = client
+        self.sessions = sessions
+        # API keys are not to be leaked, e.g. in stats, and may share a
+        # prefix, so they are labelled by a short hash instead.
+        self.label = sha1(client.api_key.encode()).hexdigest()[:8]
+        self.in_flight = 0
+        self.errors = 0
+        self.ejected_until = 0.0
+
+
+class _KeyPool:
+    """Spreads Zyte API requests across several API keys, either to the key
+    with fewest requests in flight or in turns, depending on *selection*.
+
+    A key whose requests fail with *ejection_errors* key errors in a row is
+    not used for *ejection_time* seconds, unless all keys are in that
+    situation, in which case the key that was ejected first is used.
+    """
+
+    def __init__(
+        self,
+        keys: List[_PooledKey],
+        *,
+        selection: str,
+        ejection_errors: int,
+        ejection_time: float,
+        stats: StatsCollector,
+    ):
+        if selection not in KEY_SELECTION_MODES:
+            raise ValueError(
+                f"Invalid ZYTE_API_KEY_SELECTION value: {selection!r}. Valid "
+                f"values are: "
+                f"{', '.join(repr(mode) for mode in KEY_SELECTION_MODES)}."
+            )
+        self.keys = keys
+        self._selection = selection
+        self._ejection_errors = ejection_errors
+        self._ejection_time = ejection_time
+        self._stats = stats
+        self._turns = count()
+
+    def acquire(self) -> _PooledKey:
+        """Return the key to use for the next request, which must be given
+        back with :meth:`release` when the request is done."""
+        now = perf_counter()
+        keys = [key for key in self.keys if key.ejected_until <= now]
+        if not keys:
+            key = min(self.keys, key=lambda key: key.ejected_until)
+        elif self._selection == KEY_SELECTION_ROUND_ROBIN:
+            key = keys[next(self._turns) % len(keys)]
+        else:
+            # Ties are broken in turns, so that idle keys are all used.
+            offset = next(self._turns)
+            key = min(
+                (keys[(offset + index) % len(keys)] for index in range(len(keys))),
+                key=lambda key: key.in_flight,
+            )
+        key.in_flight += 1
+        self._stats.inc_value(f"scrapy-zyte-api/keys/{key.label}/requests")
+        return key
+
+    def release(
+        self, key: _PooledKey, *, failed: bool = False, status: Optional[int] = None
+    ) -> None:
+        """Give back *key*, used for a request that *failed*, with a response
+        with the *status* HTTP status code if not ``None``."""
+        key.in_flight -= 1
+        if not failed:
+            key.errors = 0
+            return
+        self._stats.inc_value(f"scrapy-zyte-api/keys/{key.label}/errors")
+        if status not in _KEY_ERROR_STATUS_CODES:
+            return
+        key.errors += 1
+        if key.errors >= self._ejection_errors:
+            key.errors = 0
+            key.ejected_until = perf_counter() + self._ejection_time
+            self._stats.inc_value(f"scrapy-zyte-api/keys/{key.label}/ejections")
@@ -0,0 +1,49 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+
+class _Offloader:
+    """Runs CPU-heavy work on payloads of at least *threshold* bytes in a
+    thread pool, so that it does not block the reactor thread.
+
+    A *threshold* of ``0`` disables offloading.
+    """
+
+    def __init__(self, *, threshold: int, max_workers: int, stats: StatsCollector):
+        self.threshold = threshold
+        self._max_workers = max_workers
+        self._stats = stats
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def should_offload(self, size: int) -> bool:
+        return 0 < self.threshold <= size
+
+    async def run(self, stage: str, func: Callable, *args: Any) -> Any:
+        """Return the result of calling *func* with *args* in the thread
+        pool, and record the number of calls and the time they take, waiting
+        for a thread included, for *stage* in stats."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="scrapy-zyte-api",
+            )
+        loop = asyncio.get_running_loop()
+        start = perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, partial(func, *args))
+        finally:
+            elapsed = perf_counter() - start
+            prefix = f"scrapy-zyte-api/offload/{stage}"
+            self._stats.inc_value(f"{prefix}/count")
+            self._stats.inc_value(f"{prefix}/time", elapsed)
+            self._stats.max_value(f"{prefix}/max_time", elapsed)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
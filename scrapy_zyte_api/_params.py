@@ -0,0 +1,31 @@
+from typing import Any, Mapping, Optional
+
+
+def _get_api_params(
+    meta_params: Any, default_params: Mapping[str, Any]
+) -> Optional[Mapping[str, Any]]:
+    """Return the Zyte API parameters of a request with *meta_params* as its
+    ``zyte_api`` request metadata key, merged with *default_params*, or
+    ``None`` if it is not a Zyte API request.
+
+    Neither *default_params* nor *meta_params* are modified, and they are
+    only merged into a new dictionary if both are set. The returned mapping
+    must not be modified.
+
+    Raise :exc:`TypeError` if *meta_params* is set to something other than
+    ``True`` or a mapping.
+    """
+    if not meta_params and meta_params != {}:
+        return None
+
+    if meta_params is True or meta_params == {}:
+        return default_params or None
+
+    if not isinstance(meta_params, Mapping):
+        raise TypeError(
+            f"zyte_api parameters in the request meta should be provided as "
+            f"dictionary, got {type(meta_params)} instead"
+        )
+    if not default_params:
+        return meta_params
+    return {**default_params, **meta_params}
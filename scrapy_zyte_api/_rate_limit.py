@@ -0,0 +1,105 @@
+import asyncio
+from time import perf_counter
+from typing import Dict, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+# Number of per-domain buckets above which full buckets, which are no
+# different from missing ones, are removed.
+_MAX_IDLE_DOMAIN_BUCKETS = 1000
+
+
+class _TokenBucket:
+    """Allows up to *rate* requests per second on average, and bursts of up
+    to *capacity* requests.
+
+    Tokens are reserved rather than waited for, i.e. the token count goes
+    below zero, so that requests get tokens in the order in which they ask
+    for them."""
+
+    def __init__(self, *, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = perf_counter()
+
+    def _refill(self) -> None:
+        now = perf_counter()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Reserve a token, and return the seconds to wait before using
+        it."""
+        self._refill()
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def cancel(self) -> None:
+        """Give back a reserved token that is not going to be used."""
+        self._tokens += 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+def _bucket(rate: float) -> Optional[_TokenBucket]:
+    if rate <= 0:
+        return None
+    # Allow bursts of up to 1 second worth of requests.
+    return _TokenBucket(rate=rate, capacity=max(1.0, rate))
+
+
+class _RateLimiter:
+    """Makes attempts to send Zyte API requests wait so as not to exceed
+    *rate* attempts per second overall, nor *per_domain_rate* attempts per
+    second per target domain.
+
+    A rate of ``0`` means no limit."""
+
+    def __init__(self, *, rate: float, per_domain_rate: float, stats: StatsCollector):
+        self._bucket = _bucket(rate)
+        self._per_domain_rate = per_domain_rate
+        self._domain_buckets: Dict[str, _TokenBucket] = {}
+        self._stats = stats
+
+    def _domain_bucket(self, domain: str) -> Optional[_TokenBucket]:
+        bucket = self._domain_buckets.get(domain)
+        if bucket is None:
+            bucket = _bucket(self._per_domain_rate)
+            if bucket is None:
+                return None
+            if len(self._domain_buckets) >= _MAX_IDLE_DOMAIN_BUCKETS:
+                self._domain_buckets = {
+                    key: value
+                    for key, value in self._domain_buckets.items()
+                    if not value.is_full()
+                }
+            self._domain_buckets[domain] = bucket
+        return bucket
+
+    async def wait(self, domain: str) -> None:
+        """Wait until an attempt to send a request for *domain* can be
+        sent."""
+        waited = 0.0
+        # Wait for the domain budget first, so that global tokens are not
+        # reserved by attempts that cannot be sent yet anyway.
+        for bucket in (self._domain_bucket(domain), self._bucket):
+            if bucket is None:
+                continue
+            delay = bucket.reserve()
+            if not delay:
+                continue
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                bucket.cancel()
+                raise
+            waited += delay
+        if waited:
+            self._stats.inc_value("scrapy-zyte-api/rate_limit/delayed")
+            self._stats.inc_value("scrapy-zyte-api/rate_limit/wait_time", waited)
+            self._stats.max_value("scrapy-zyte-api/rate_limit/max_wait_time", waited)
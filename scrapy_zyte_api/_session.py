@@ -0,0 +1,472 @@
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from types import SimpleNamespace
+from typing import (
+    IO,
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from aiohttp import (
+    ClientError,
+    ClientRequest,
+    ClientResponse,
+    ClientSession,
+    TCPConnector,
+    TraceConfig,
+    hdrs,
+)
+from aiohttp.payload import BytesPayload
+from scrapy import Request
+from zyte_api.aio.client import create_session
+
+from ._circuit_breaker import _CircuitBreaker
+from ._compression import ACCEPT_ENCODING, _compress_request_body, _get_decompressor
+from ._concurrency import _AdaptiveConcurrency
+from ._offload import _Offloader
+from ._spill import _Spiller
+from ._streaming import _StreamingParser
+from ._throttle import _get_retry_after, _ThrottleGate
+from .responses import _DecodedBody
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks in which responses are read when they are not read at
+# once.
+_CHUNK_SIZE = 64 * 1024
+
+# HTTP status codes and exceptions of attempts that count as failures for
+# the circuit breaker: errors of Zyte API itself and network errors, but
+# not rate limiting or errors of target websites.
+_CIRCUIT_BREAKER_STATUS_CODES = (500, 502, 503, 504)
+_CIRCUIT_BREAKER_EXCEPTIONS = (ClientError, asyncio.TimeoutError, OSError)
+
+
+# Bytes allowed in Zyte API responses on top of 4/3 of the maximum download
+# size, i.e. of its size in base64, for the rest of the JSON document.
+_ENVELOPE_OVERHEAD = 64 * 1024
+
+
+def _get_envelope_maxsize(maxsize: int) -> int:
+    """Return the size above which a Zyte API response cannot have a response
+    body of up to *maxsize* bytes, 0 meaning no limit."""
+    if maxsize <= 0:
+        return 0
+    return math.ceil(maxsize * 4 / 3) + _ENVELOPE_OVERHEAD
+
+
+class _MaxSizeExceeded(Exception):
+    """The size of a Zyte API response is too large for the maximum download
+    size of its request."""
+
+    def __init__(self, size: int, maxsize: int, *, expected: bool = False):
+        super().__init__(size, maxsize, expected)
+        self.size = size
+        self.maxsize = maxsize
+        # Whether size comes from the Content-Length header, i.e. the
+        # response was not read.
+        self.expected = expected
+
+
+class _RequestContext:
+    """State of the Zyte API request being sent by the current asyncio task,
+    made available to the aiohttp internals used by
+    :meth:`zyte_api.aio.client.AsyncClient.request_raw`."""
+
+    def __init__(
+        self,
+        *,
+        offloader: Optional[_Offloader] = None,
+        json_loads: Callable[[str], Any] = json.loads,
+        streaming_max_memory_size: Optional[int] = None,
+        spiller: Optional[_Spiller] = None,
+        request: Optional[Request] = None,
+        maxsize: int = 0,
+        timings: Optional[List[Tuple[str, float]]] = None,
+        concurrency: Optional[_AdaptiveConcurrency] = None,
+        circuit_breaker: Optional[_CircuitBreaker] = None,
+        throttle_gate: Optional[_ThrottleGate] = None,
+        request_compression_min_size: int = 0,
+    ):
+        self.offloader = offloader
+        self.json_loads = json_loads
+        # If not None, httpResponseBody is decoded while the response is
+        # received, into a temporary file written to disk above this size.
+        self.streaming_max_memory_size = streaming_max_memory_size
+        self.spiller = spiller
+        self.request = request
+        # Maximum download size of the response body, 0 meaning no limit.
+        # The handler enforces it on the decoded response body, Zyte API
+        # responses are only dropped while received if too large for it.
+        self.maxsize = maxsize
+        # Request bodies of at least this size are compressed, 0 meaning
+        # never.
+        self.request_compression_min_size = request_compression_min_size
+        # If not None, (stage, seconds) pairs are appended to it, see
+        # _timings.TIMING_STAGES.
+        self.timings = timings
+        # If not None, throttling responses pause it.
+        self.throttle_gate = throttle_gate
+        # If not None, every attempt reports its outcome to it, and holds one
+        # of its slots, acquired by the handler, while concurrency_acquired.
+        self.concurrency = concurrency
+        self.concurrency_acquired = False
+        # If not None, every attempt must be allowed by it, checked by the
+        # handler, and reports its outcome to it. Whether the current attempt
+        # is a probe, or None if its outcome has been reported.
+        self.circuit_breaker = circuit_breaker
+        self.circuit_breaker_probe: Optional[bool] = None
+        # Start of the current attempt, and of its current stage.
+        self.attempt_start = 0.0
+        self.stage_start = 0.0
+        # Number of attempts, HTTP status codes of their responses, and bytes
+        # received through them, as sent by Zyte API and once decompressed.
+        self.attempts = 0
+        self.status_codes: List[int] = []
+        self.wire_bytes = 0
+        self.received_bytes = 0
+
+    def record(self, stage: str, seconds: float) -> None:
+        if self.timings is not None:
+            self.timings.append((stage, seconds))
+
+    def check_size(self, size: int, *, expected: bool = False) -> None:
+        """Raise :exc:`_MaxSizeExceeded` if *size*, the expected or received
+        size of the Zyte API response, is too large for its response body not
+        to exceed the maximum size."""
+        if 0 < _get_envelope_maxsize(self.maxsize) < size:
+            raise _MaxSizeExceeded(size, self.maxsize, expected=expected)
+
+
+_request_context: ContextVar[Optional[_RequestContext]] = ContextVar(
+    "_request_context", default=None
+)
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+class _ZyteAPIClientRequest(ClientRequest):
+    def update_body_from_data(self, body: Any) -> None:
+        context = _request_context.get()
+        if (
+            context is not None
+            and context.request_compression_min_size
+            and isinstance(body, BytesPayload)
+            and body.size is not None
+            and body.size >= context.request_compression_min_size
+            and hdrs.CONTENT_ENCODING not in self.headers
+        ):
+            body = BytesPayload(
+                _compress_request_body(body._value), content_type=body.content_type
+            )
+            self.headers[hdrs.CONTENT_ENCODING] = "gzip"
+        super().update_body_from_data(body)
+
+
+class _ZyteAPIClientResponse(ClientResponse):
+    async def read(self) -> bytes:
+        context = _request_context.get()
+        if self._body is not None:
+            return await super().read()
+        if context is None:
+            # Responses are decompressed here, not by aiohttp, regardless.
+            context = _RequestContext()
+        if not context.maxsize:
+            body = await super().read()
+            context.wire_bytes += len(body)
+            decompressor = _get_decompressor(
+                self.headers.get(hdrs.CONTENT_ENCODING, "")
+            )
+            if decompressor is not None:
+                self._body = body = decompressor.decompress(body)
+            context.received_bytes += len(body)
+        else:
+            try:
+                self._body = body = b"".join(
+                    [chunk async for chunk in self._iter_chunks(context)]
+                )
+            except BaseException:
+                self.close()
+                raise
+        context.record("api", perf_counter() - context.stage_start)
+        return body
+
+    async def _iter_chunks(self, context: _RequestContext) -> AsyncIterator[bytes]:
+        """Yield the response content in chunks, decompressed, enforcing the
+        size limits of *context* before they are read."""
+        context.check_size(self.content_length or 0, expected=True)
+        decompressor = _get_decompressor(self.headers.get(hdrs.CONTENT_ENCODING, ""))
+        size = 0
+        async for chunk in self.content.iter_chunked(_CHUNK_SIZE):
+            context.wire_bytes += len(chunk)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            size += len(chunk)
+            context.received_bytes += len(chunk)
+            context.check_size(size)
+            yield chunk
+
+    async def json(
+        self,
+        *,
+        encoding: Optional[str] = None,
+        loads: Optional[Callable[[str], Any]] = None,
+        content_type: Optional[str] = "application/json",
+    ) -> Any:
+        context = _request_context.get()
+        offloader = context.offloader if context else None
+        if loads is None:
+            loads = context.json_loads if context else json.loads
+        if (
+            context is not None
+            and context.streaming_max_memory_size is not None
+            and (
+                content_type is None
+                or content_type in self.headers.get(hdrs.CONTENT_TYPE, "").lower()
+            )
+        ):
+            return await self._streaming_json(loads, context)
+        size = len(await self.read())
+        start = perf_counter()
+        if offloader is None or not offloader.should_offload(size):
+            data = await super().json(
+                encoding=encoding, loads=loads, content_type=content_type
+            )
+        else:
+            # Let aiohttp validate and decode the response, and parse the
+            # resulting JSON document in a thread.
+            text = await super().json(
+                encoding=encoding, loads=_identity, content_type=content_type
+            )
+            data = None if text is None else await offloader.run("json", loads, text)
+        if context is not None:
+            context.record("json", perf_counter() - start)
+        return data
+
+    async def _streaming_json(
+        self, loads: Callable[[str], Any], context: _RequestContext
+    ) -> Any:
+        assert context.streaming_max_memory_size is not None
+        parser = _StreamingParser(max_memory_size=context.streaming_max_memory_size)
+        # Time spent decoding, rather than waiting for the response.
+        decoding_time = 0.0
+        try:
+            async for chunk in self._iter_chunks(context):
+                start = perf_counter()
+                parser.feed(chunk)
+                decoding_time += perf_counter() - start
+        except BaseException:
+            self.close()
+            raise
+        context.record("api", perf_counter() - context.stage_start - decoding_time)
+        start = perf_counter()
+        document, body_file = parser.close()
+        if body_file is not None:
+            context.record("base64", decoding_time)
+        else:
+            # The whole decoding time was spent parsing JSON.
+            start -= decoding_time
+        text = document.decode()
+        offloader = context.offloader
+        if offloader is not None and offloader.should_offload(len(text)):
+            data = await offloader.run("json", loads, text)
+        else:
+            data = loads(text)
+        context.record("json", perf_counter() - start)
+        if body_file is not None:
+            size = body_file.seek(0, os.SEEK_END)
+            spiller = context.spiller
+            if spiller is not None and spiller.should_spill(size):
+                # _process_response() may map the file the body was decoded
+                # into, which is already on disk if larger than
+                # max_memory_size.
+                body_file.seek(0)
+                body: Union[bytes, IO[bytes]] = body_file
+            else:
+                with body_file:
+                    body_file.seek(0)
+                    body = body_file.read()
+            data["httpResponseBody"] = _DecodedBody(body, size)
+        return data
+
+
+async def _on_request_start(
+    session: ClientSession, trace_config_ctx: SimpleNamespace, params: Any
+) -> None:
+    context = _request_context.get()
+    if context is not None:
+        context.attempts += 1
+        context.attempt_start = context.stage_start = perf_counter()
+
+
+async def _on_request_headers_sent(
+    session: ClientSession, trace_config_ctx: SimpleNamespace, params: Any
+) -> None:
+    # Headers are sent as soon as a connection is available.
+    context = _request_context.get()
+    if context is not None:
+        now = perf_counter()
+        context.record("connection", now - context.stage_start)
+        context.stage_start = now
+
+
+async def _on_request_end(
+    session: ClientSession, trace_config_ctx: SimpleNamespace, params: Any
+) -> None:
+    context = _request_context.get()
+    if context is not None:
+        context.status_codes.append(params.response.status)
+        if context.throttle_gate is not None and params.response.status == 429:
+            context.throttle_gate.pause(_get_retry_after(params.response.headers))
+        _record_concurrency(context, params.response.status)
+        _record_circuit_breaker(
+            context, params.response.status in _CIRCUIT_BREAKER_STATUS_CODES
+        )
+
+
+async def _on_request_exception(
+    session: ClientSession, trace_config_ctx: SimpleNamespace, params: Any
+) -> None:
+    context = _request_context.get()
+    if context is not None:
+        _record_concurrency(context, None)
+        # Other exceptions, e.g. cancellations, are not an outcome.
+        failed = isinstance(params.exception, _CIRCUIT_BREAKER_EXCEPTIONS)
+        _record_circuit_breaker(context, True if failed else None)
+
+
+def _record_concurrency(context: _RequestContext, status: Optional[int]) -> None:
+    if context.concurrency is not None:
+        context.concurrency.record(status, start=context.attempt_start)
+
+
+def _record_circuit_breaker(context: _RequestContext, failed: Optional[bool]) -> None:
+    if (
+        context.circuit_breaker is not None
+        and context.circuit_breaker_probe is not None
+    ):
+        context.circuit_breaker.record(failed, probe=context.circuit_breaker_probe)
+        context.circuit_breaker_probe = None
+
+
+class _AttemptSession:
+    """Wraps *session* to await *wait* before every attempt to send a Zyte
+    API request through it, and to call *done* once the attempt is over,
+    even if *wait* fails.
+
+    Attempts are sent by :meth:`zyte_api.aio.client.AsyncClient.request_raw`
+    through the ``post`` method of its *session*, so that is where they are
+    controlled."""
+
+    def __init__(
+        self,
+        session: ClientSession,
+        *,
+        wait: Callable[[], Awaitable[None]],
+        done: Callable[[], None],
+    ):
+        self._session = session
+        self._wait = wait
+        self._done = done
+
+    def post(self, **kwargs) -> AsyncContextManager[ClientResponse]:
+        return self._post(**kwargs)
+
+    @asynccontextmanager
+    async def _post(self, **kwargs) -> AsyncIterator[ClientResponse]:
+        try:
+            await self._wait()
+            async with self._session.post(**kwargs) as response:
+                yield response
+        finally:
+            self._done()
+
+
+def _create_session(
+    connection_pool_size: int,
+    *,
+    keepalive_timeout: Optional[float] = None,
+    dns_cache_ttl: Optional[int] = None,
+    compression: bool = True,
+    **kwargs,
+) -> ClientSession:
+    """Create a session suited for Zyte API whose responses are aware of the
+    :class:`_RequestContext` of the request being sent, and that records the
+    attempts to send that request in that context.
+
+    *keepalive_timeout* is the number of seconds idle connections are kept
+    open, ``0`` meaning that connections are closed after every request.
+    *dns_cache_ttl* is the number of seconds DNS resolutions are cached,
+    ``0`` meaning that they are not cached. ``None`` means the aiohttp
+    default in both cases.
+
+    If *compression* is ``True``, compressed responses are accepted.
+    Responses are decompressed as they are read, instead of by aiohttp, to
+    count the bytes received before and after decompression."""
+    kwargs.setdefault("request_class", _ZyteAPIClientRequest)
+    kwargs.setdefault("response_class", _ZyteAPIClientResponse)
+    kwargs["auto_decompress"] = False
+    kwargs["headers"] = {
+        hdrs.ACCEPT_ENCODING: ACCEPT_ENCODING if compression else "identity",
+        **kwargs.get("headers", {}),
+    }
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)  # type: ignore[arg-type]
+    trace_config.on_request_headers_sent.append(_on_request_headers_sent)  # type: ignore[arg-type]
+    trace_config.on_request_end.append(_on_request_end)  # type: ignore[arg-type]
+    trace_config.on_request_exception.append(_on_request_exception)  # type: ignore[arg-type]
+    kwargs["trace_configs"] = [*kwargs.get("trace_configs", []), trace_config]
+    if "connector" not in kwargs:
+        connector_kwargs: Dict[str, Any] = {"limit": connection_pool_size}
+        if keepalive_timeout == 0:
+            connector_kwargs["force_close"] = True
+        elif keepalive_timeout is not None:
+            connector_kwargs["keepalive_timeout"] = keepalive_timeout
+        if dns_cache_ttl == 0:
+            connector_kwargs["use_dns_cache"] = False
+        elif dns_cache_ttl is not None:
+            connector_kwargs["ttl_dns_cache"] = dns_cache_ttl
+        kwargs["connector"] = TCPConnector(**connector_kwargs)
+    return create_session(connection_pool_size=connection_pool_size, **kwargs)
+
+
+class _SessionPool:
+    """Spreads Zyte API requests across *count* sessions in turns, splitting
+    *connection_pool_size* connections among them.
+
+    Each session has its own connection pool, so that many concurrent
+    requests do not all contend for the same one."""
+
+    def __init__(self, *, count: int, connection_pool_size: int, **kwargs):
+        if count < 1:
+            raise ValueError(f"The number of sessions ({count}) must be at least 1.")
+        shard_size = max(1, math.ceil(connection_pool_size / count))
+        self.sessions = [
+            _create_session(connection_pool_size=shard_size, **kwargs)
+            for _ in range(count)
+        ]
+        self._turns = itertools.cycle(self.sessions)
+
+    def get(self) -> ClientSession:
+        return next(self._turns)
+
+    async def close(self) -> None:
+        for session in self.sessions:
+            await session.close()
@@ -0,0 +1,45 @@
+import mmap
+from tempfile import TemporaryFile
+from threading import Lock
+from typing import IO
+
+from scrapy.statscollectors import StatsCollector
+
+
+class _Spiller:
+    """Moves response bodies of at least *threshold* bytes out of the Python
+    heap, into memory-mapped temporary files.
+
+    The temporary files are removed from the file system as soon as they are
+    created, so their disk space is reclaimed once their memory map is
+    garbage-collected or closed. Memory maps are never closed here, since
+    responses may still use them after the spider closes.
+
+    A *threshold* of ``0`` disables spilling.
+    """
+
+    def __init__(self, *, threshold: int, stats: StatsCollector):
+        self.threshold = threshold
+        self._stats = stats
+        # Bodies may be spilled from the threads of _Offloader.
+        self._lock = Lock()
+
+    def should_spill(self, size: int) -> bool:
+        return 0 < self.threshold <= size
+
+    def spill(self, body: bytes) -> mmap.mmap:
+        """Return a read-only memory map of a temporary file with *body* as
+        content."""
+        with TemporaryFile() as file:
+            file.write(body)
+            file.flush()
+            return self.map(file)
+
+    def map(self, file: IO[bytes]) -> mmap.mmap:
+        """Return a read-only memory map of the whole content of *file*, which
+        may be closed afterwards."""
+        body = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._lock:
+            self._stats.inc_value("scrapy-zyte-api/mmap/count")
+            self._stats.inc_value("scrapy-zyte-api/mmap/bytes", len(body))
+        return body
@@ -0,0 +1,137 @@
+import re
+from base64 import b64decode
+from tempfile import SpooledTemporaryFile
+from typing import IO, Optional, Tuple
+
+# Characters that change the parsing state outside JSON strings.
+_STRUCTURAL_RE = re.compile(rb'[{}\[\],:"]')
+_QUOTE, _BACKSLASH, _COLON, _COMMA = b'"', b"\\", ord(":"), ord(",")
+_OPENING, _CLOSING = b"{[", b"}]"
+
+
+def _ends_with_odd_backslashes(data: bytearray) -> bool:
+    count = 0
+    index = len(data) - 1
+    while index >= 0 and data[index] == 0x5C:
+        count += 1
+        index -= 1
+    return count % 2 == 1
+
+
+class _StreamingParser:
+    """Incremental parser of Zyte API JSON responses.
+
+    Feed it the response JSON document chunk by chunk. The value of the
+    *field* key of the top-level object, a base64 string, is decoded as it
+    arrives into a temporary file, kept in memory until it exceeds
+    *max_memory_size* bytes, instead of being kept as part of the document.
+
+    :meth:`close` returns the rest of the document, with an empty string as
+    the value of *field*, and the temporary file, if *field* was found.
+    """
+
+    def __init__(self, *, field: bytes = b"httpResponseBody", max_memory_size: int):
+        self._field = field
+        self._max_memory_size = max_memory_size
+        self._document = bytearray()
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        # Whether the string being parsed, or the next one, is a key of the
+        # top-level object.
+        self._string_is_key = False
+        self._key_expected = False
+        self._key: Optional[bytes] = None
+        # Whether the next value is the one of self._field.
+        self._value_expected = False
+        self._decoding = False
+        self._body: Optional[IO[bytes]] = None
+        # Trailing data of the last chunk that can only be handled together
+        # with the next chunk.
+        self._pending = b""
+        self._undecoded = b""
+
+    def feed(self, data: bytes) -> None:
+        if self._pending:
+            data, self._pending = self._pending + data, b""
+        index, size = 0, len(data)
+        while index < size:
+            if self._decoding:
+                index = self._feed_body(data, index)
+            elif self._in_string:
+                index = self._feed_string(data, index)
+            else:
+                index = self._feed_structure(data, index)
+
+    def _feed_body(self, data: bytes, index: int) -> int:
+        end = data.find(_QUOTE, index)
+        chunk = data[index : len(data) if end == -1 else end]
+        if end == -1 and chunk.endswith(_BACKSLASH):
+            # Escaped slash (\/) split between chunks.
+            self._pending, chunk = _BACKSLASH, chunk[:-1]
+        if _BACKSLASH in chunk:
+            chunk = chunk.replace(b"\\/", b"/")
+        chunk = self._undecoded + chunk
+        decodable = len(chunk) - len(chunk) % 4
+        assert self._body is not None
+        self._body.write(b64decode(chunk[:decodable]))
+        self._undecoded = chunk[decodable:]
+        if end == -1:
+            return len(data)
+        self._body.write(b64decode(self._undecoded))
+        self._undecoded = b""
+        self._decoding = False
+        self._document += b'""'
+        return end + 1
+
+    def _feed_string(self, data: bytes, index: int) -> int:
+        end = data.find(_QUOTE, index)
+        if end == -1:
+            self._document += data[index:]
+            return len(data)
+        self._document += data[index:end]
+        escaped = _ends_with_odd_backslashes(self._document)
+        self._document += _QUOTE
+        if not escaped:
+            self._in_string = False
+            if self._string_is_key:
+                self._key = bytes(self._document[self._string_start : -1])
+        return end + 1
+
+    def _feed_structure(self, data: bytes, index: int) -> int:
+        match = _STRUCTURAL_RE.search(data, index)
+        if match is None:
+            self._document += data[index:]
+            return len(data)
+        end = match.start()
+        char = data[end]
+        if char == _QUOTE[0] and self._value_expected:
+            self._document += data[index:end]
+            self._value_expected = False
+            self._decoding = True
+            self._body = SpooledTemporaryFile(max_size=self._max_memory_size)
+            return end + 1
+        self._document += data[index : end + 1]
+        self._value_expected = False
+        if char == _QUOTE[0]:
+            self._in_string = True
+            self._string_start = len(self._document)
+            self._string_is_key = self._key_expected
+            self._key_expected = False
+        elif char in _OPENING:
+            self._depth += 1
+            self._key_expected = self._depth == 1 and char == _OPENING[0]
+        elif char in _CLOSING:
+            self._depth -= 1
+        elif char == _COMMA:
+            self._key_expected = self._depth == 1
+        elif char == _COLON:
+            self._value_expected = self._depth == 1 and self._key == self._field
+        return end + 1
+
+    def close(self) -> Tuple[bytearray, Optional[IO[bytes]]]:
+        if self._decoding or self._in_string or self._pending:
+            raise ValueError("Truncated JSON document.")
+        if self._body is not None:
+            self._body.seek(0)
+        return self._document, self._body
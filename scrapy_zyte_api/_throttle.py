@@ -0,0 +1,87 @@
+import asyncio
+from time import perf_counter
+from typing import Mapping, Optional
+
+from scrapy.statscollectors import StatsCollector
+
+
+def _get_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Return the seconds of the ``Retry-After`` header in *headers*, or
+    ``None`` if missing or not a number of seconds."""
+    try:
+        return max(0.0, float((headers or {})["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+class _ThrottleGate:
+    """Makes attempts to send Zyte API requests wait while Zyte API is
+    throttling requests.
+
+    Every throttling response pauses all attempts for the seconds it asks
+    for, or *default_pause* seconds if it does not ask for any. Attempts that
+    waited for a pause to end are then released gradually, at
+    *release_rate* attempts per second, so that they are not throttled all
+    over again."""
+
+    def __init__(
+        self, *, release_rate: float, default_pause: float, stats: StatsCollector
+    ):
+        if release_rate <= 0:
+            raise ValueError(
+                f"The throttle gate release rate ({release_rate}) must be "
+                f"greater than 0."
+            )
+        self._interval = 1 / release_rate
+        self._default_pause = default_pause
+        # End of the current pause, and time at which the next waiting
+        # attempt is released. Attempts do not wait once it is in the past.
+        self._paused_until = 0.0
+        self._next_release = 0.0
+        # Incremented with every pause, so that attempts that were due to be
+        # released before it ends wait for it to end.
+        self._pauses = 0
+        self._stats = stats
+
+    def pause(self, seconds: Optional[float] = None) -> None:
+        """Pause attempts for *seconds*, or the default pause if ``None``,
+        unless they are already paused for longer."""
+        if seconds is None:
+            seconds = self._default_pause
+        until = perf_counter() + seconds
+        if until <= self._paused_until:
+            return
+        self._paused_until = self._next_release = until
+        self._pauses += 1
+        self._stats.inc_value("scrapy-zyte-api/throttle/paused")
+
+    def _reserve(self) -> float:
+        """Reserve a release, and return the seconds to wait for it."""
+        delay = self._next_release - perf_counter()
+        if delay <= 0:
+            return 0.0
+        self._next_release += self._interval
+        return delay
+
+    async def wait(self) -> None:
+        """Wait until an attempt can be sent."""
+        waited = 0.0
+        while True:
+            delay = self._reserve()
+            if not delay:
+                break
+            pauses = self._pauses
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                if pauses == self._pauses:
+                    # Give back the release.
+                    self._next_release -= self._interval
+                raise
+            waited += delay
+            if pauses == self._pauses or perf_counter() >= self._paused_until:
+                break
+        if waited:
+            self._stats.inc_value("scrapy-zyte-api/throttle/delayed")
+            self._stats.inc_value("scrapy-zyte-api/throttle/wait_time", waited)
+            self._stats.max_value("scrapy-zyte-api/throttle/max_wait_time", waited)
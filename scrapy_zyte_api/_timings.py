@@ -0,0 +1,74 @@
+import math
+from typing import Dict
+
+from scrapy.statscollectors import StatsCollector
+
+# Stages of a Zyte API request, in order.
+TIMING_STAGES = (
+    # Preparing the Zyte API request parameters.
+    "params",
+    # Waiting for a connection to Zyte API, either an idle one or a new one.
+    "connection",
+    # Sending the request and receiving the response, per attempt.
+    "api",
+    # Parsing the JSON response.
+    "json",
+    # Decoding httpResponseBody from base64.
+    "base64",
+    # Building the Scrapy response, base64 decoding included.
+    "response",
+)
+
+# Buckets grow exponentially by this factor, so that values are reported
+# with a relative error below 10%, regardless of their magnitude.
+_BUCKET_FACTOR = 2 ** (1 / 4)
+_MIN_BUCKET_BOUND = 1e-6
+
+
+def _bucket_bound(seconds: float) -> float:
+    """Return the upper bound of the histogram bucket of *seconds*."""
+    if seconds <= _MIN_BUCKET_BOUND:
+        return _MIN_BUCKET_BOUND
+    index = math.ceil(math.log(seconds / _MIN_BUCKET_BOUND, _BUCKET_FACTOR))
+    return float(f"{_MIN_BUCKET_BOUND * _BUCKET_FACTOR**index:.3g}")
+
+
+def _percentile(histogram: Dict[float, int], percent: float) -> float:
+    """Return the *percent* percentile of the values of *histogram*, as the
+    geometric middle of the bucket where it falls."""
+    rank = math.ceil(sum(histogram.values()) * percent / 100)
+    count = 0
+    for bound in sorted(histogram):
+        count += histogram[bound]
+        if count >= rank:
+            break
+    return bound / math.sqrt(_BUCKET_FACTOR)
+
+
+class _Timings:
+    """Records the time spent in each stage of Zyte API requests as
+    histograms in stats.
+
+    Each histogram is a dictionary that maps the upper bound of a bucket, in
+    seconds, to the number of values in it, and only has non-empty buckets.
+    """
+
+    def __init__(self, *, stats: StatsCollector):
+        self._stats = stats
+        self._histograms: Dict[str, Dict[float, int]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        histogram = self._histograms.setdefault(stage, {})
+        bound = _bucket_bound(seconds)
+        histogram[bound] = histogram.get(bound, 0) + 1
+        self._stats.set_value(f"scrapy-zyte-api/timing/{stage}/histogram", histogram)
+
+    def dump_percentiles(self) -> None:
+        """Store the 50th, 95th and 99th percentiles of each stage in
+        stats."""
+        for stage, histogram in self._histograms.items():
+            for percent in (50, 95, 99):
+                self._stats.set_value(
+                    f"scrapy-zyte-api/timing/{stage}/p{percent}",
+                    _percentile(histogram, percent),
+                )
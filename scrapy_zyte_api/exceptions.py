@@ -0,0 +1,34 @@
+from typing import Optional
+
+from scrapy.exceptions import IgnoreRequest
+
+
+class ZyteAPIError(IgnoreRequest):
+    """A Zyte API request failed.
+
+    It is a subclass of :exc:`~scrapy.exceptions.IgnoreRequest`, so failed
+    requests are dropped unless
+    :class:`~scrapy_zyte_api.ZyteAPIRetryMiddleware` retries them.
+
+    *status* is the HTTP status code of the Zyte API response, or ``None`` if
+    there was no response, e.g. because of a network error.
+
+    *retry_after* is the number of seconds to wait before retrying that Zyte
+    API asked for through the ``Retry-After`` header, if any.
+
+    *retryable* is ``True`` if the error is likely temporary, i.e. if
+    retrying the request later may succeed.
+    """
+
+    def __init__(
+        self,
+        message: str = "",
+        *,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        retryable: bool = False,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
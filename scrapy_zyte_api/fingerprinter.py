@@ -0,0 +1,120 @@
+from typing import Any, Dict, Optional
+from weakref import WeakKeyDictionary
+
+from scrapy import Request
+from scrapy.crawler import Crawler
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.settings import BaseSettings
+from scrapy.utils.job import job_dir
+from scrapy.utils.url import canonicalize_url
+
+from ._cache import _cache_key
+from ._params import _get_api_params
+
+try:
+    from scrapy.utils.request import fingerprint as _default_fingerprint
+except ImportError:  # Scrapy < 2.7
+    from scrapy.utils.request import request_fingerprint
+
+    def _default_fingerprint(request: Request) -> bytes:
+        return bytes.fromhex(request_fingerprint(request))
+
+
+# Values of Zyte API parameters that are the same as not setting them.
+_DEFAULT_PARAM_VALUES = {
+    "browserHtml": False,
+    "httpResponseBody": False,
+    "screenshot": False,
+}
+
+
+class ScrapyZyteAPIRequestFingerprinter:
+    """Request fingerprinter that, for Zyte API requests, takes into account
+    their Zyte API parameters, merged with ``ZYTE_API_DEFAULT_PARAMS``, so
+    that requests for the same URL with different Zyte API parameters are
+    not considered duplicates.
+
+    Other requests get the default fingerprint of Scrapy.
+    """
+
+    def __init__(self, settings: BaseSettings):
+        self._default_params = settings.getdict("ZYTE_API_DEFAULT_PARAMS")
+        self._cache: "WeakKeyDictionary[Request, bytes]" = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        return cls(crawler.settings)
+
+    def fingerprint(self, request: Request) -> bytes:
+        if request not in self._cache:
+            api_data = self._get_api_data(request)
+            if api_data is None:
+                self._cache[request] = _default_fingerprint(request)
+            else:
+                self._cache[request] = bytes.fromhex(_cache_key(api_data))
+        return self._cache[request]
+
+    def _get_api_data(self, request: Request) -> Optional[Dict[str, Any]]:
+        """Return the Zyte API request data of *request*, canonicalized, or
+        ``None`` if *request* is not a Zyte API request, i.e. if the download
+        handler does not send it through Zyte API."""
+        try:
+            api_params = _get_api_params(
+                request.meta.get("zyte_api"), self._default_params
+            )
+        except TypeError:
+            # The download handler drops the request.
+            return None
+        if api_params is None:
+            return None
+        api_data = {"url": request.url, **api_params}
+        api_data["url"] = canonicalize_url(api_data["url"])
+        return {
+            key: value
+            for key, value in api_data.items()
+            if key not in _DEFAULT_PARAM_VALUES or value != _DEFAULT_PARAM_VALUES[key]
+        }
+
+
+class ScrapyZyteAPIDupeFilter(RFPDupeFilter):
+    """Duplicate filter that uses :class:`ScrapyZyteAPIRequestFingerprinter`,
+    for Scrapy versions that do not support the ``REQUEST_FINGERPRINTER_CLASS``
+    setting (< 2.7)."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        debug: bool = False,
+        *,
+        settings: Optional[BaseSettings] = None,
+        fingerprinter: Any = None,
+    ):
+        if fingerprinter is None:
+            super().__init__(path, debug)
+        else:  # Scrapy 2.7+
+            super().__init__(path, debug, fingerprinter=fingerprinter)
+        if isinstance(fingerprinter, ScrapyZyteAPIRequestFingerprinter):
+            self._fingerprinter = fingerprinter
+        else:
+            self._fingerprinter = ScrapyZyteAPIRequestFingerprinter(
+                settings or BaseSettings()
+            )
+
+    @classmethod
+    def from_settings(cls, settings: BaseSettings, *, fingerprinter: Any = None):
+        return cls(
+            job_dir(settings),
+            settings.getbool("DUPEFILTER_DEBUG"),
+            settings=settings,
+            fingerprinter=fingerprinter,
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        return cls.from_settings(
+            crawler.settings,
+            fingerprinter=getattr(crawler, "request_fingerprinter", None),
+        )
+
+    def request_fingerprint(self, request: Request) -> str:
+        return self._fingerprinter.fingerprint(request).hex()
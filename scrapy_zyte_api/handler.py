@@ -1,31 +1,120 @@
-import json
+import asyncio
 import logging
-from typing import Any, Dict, Generator, Optional, Union
+from contextlib import contextmanager
+from functools import partial
+from time import perf_counter, time
+from types import MappingProxyType
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from scrapy import Spider
+from aiohttp import ClientError
+from scrapy import Spider, signals
 from scrapy.core.downloader.handlers.http import HTTPDownloadHandler
 from scrapy.crawler import Crawler
 from scrapy.exceptions import IgnoreRequest, NotConfigured
 from scrapy.http import Request
 from scrapy.settings import Settings
 from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
 from scrapy.utils.reactor import verify_installed_reactor
+from twisted.internet.base import DelayedCall
 from twisted.internet.defer import Deferred, inlineCallbacks
-from zyte_api.aio.client import AsyncClient, create_session
+from twisted.internet.error import TimeoutError
+from twisted.internet.task import LoopingCall
+from twisted.python.failure import Failure
+from zyte_api.aio.client import AsyncClient
 from zyte_api.aio.errors import RequestError
 from zyte_api.apikey import NoApiKey
 from zyte_api.constants import API_URL
 
-from .responses import ZyteAPIResponse, ZyteAPITextResponse, _process_response
+from ._cache import _cache_key, _dump_api_response, _ResponseCache
+from ._circuit_breaker import _CircuitBreaker, _CircuitOpen
+from ._coalesce import _Coalescer
+from ._concurrency import _AdaptiveConcurrency
+from ._json import _load_json_backend
+from ._keys import KEY_SELECTION_LEAST_IN_FLIGHT, _KeyPool, _PooledKey
+from ._offload import _Offloader
+from ._params import _get_api_params
+from ._rate_limit import _RateLimiter
+from ._session import (
+    _AttemptSession,
+    _MaxSizeExceeded,
+    _record_circuit_breaker,
+    _request_context,
+    _RequestContext,
+    _SessionPool,
+)
+from ._spill import _Spiller
+from ._throttle import _get_retry_after, _ThrottleGate
+from ._timings import _Timings
+from .exceptions import ZyteAPIError
+from .responses import (
+    _BODY_FIELDS,
+    _BROWSER_HTML,
+    _HTTP_RESPONSE_BODY,
+    RAW_API_RESPONSE_FULL,
+    RAW_API_RESPONSE_MODES,
+    ZyteAPIResponse,
+    ZyteAPITextResponse,
+    _DecodedBody,
+    _process_response,
+)
+from .signals import zyte_api_circuit_breaker_state_changed
 
 logger = logging.getLogger(__name__)
 
+# HTTP status codes of Zyte API errors that are likely temporary: rate
+# limiting, and errors of Zyte API or of the target website.
+_RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504, 520, 521)
+# Exceptions of Zyte API requests without a response that are likely
+# temporary, i.e. network errors.
+_RETRYABLE_EXCEPTIONS = (ClientError, asyncio.TimeoutError, OSError)
+
+# Seconds between checks of whether the spider is being closed, to cancel
+# the Zyte API requests in progress.
+_CLOSE_CHECK_INTERVAL = 1.0
+# Attributes of the Scrapy engine that may hold its slot, whose closing
+# attribute is set when the spider starts closing.
+_ENGINE_SLOT_ATTRIBUTES = ("_slot", "slot")
+
+# Seconds to which download timeouts are set while paused, longer than any
+# wait.
+_PAUSED_TIMEOUT = 365 * 24 * 3600.0
+
 
 class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
     def __init__(
         self, settings: Settings, crawler: Crawler, client: AsyncClient = None
     ):
         super().__init__(settings=settings, crawler=crawler)
+        api_keys = _get_api_keys(settings)
+        # Zyte API connections are not shared with plain HTTP requests, so
+        # their number can be tuned separately.
+        n_conn = settings.getint("ZYTE_API_CONNECTIONS") or settings.getint(
+            "CONCURRENT_REQUESTS"
+        )
+        clients: List[AsyncClient] = []
+        if not client and api_keys:
+            clients = [
+                AsyncClient(
+                    api_key=api_key,
+                    api_url=settings.get("ZYTE_API_URL") or API_URL,
+                    n_conn=n_conn,
+                )
+                for api_key in api_keys
+            ]
+            client = clients[0]
         if not client:
             try:
                 client = AsyncClient(
@@ -37,7 +126,7 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
                     # through settings.
                     api_key=settings.get("ZYTE_API_KEY") or None,
                     api_url=settings.get("ZYTE_API_URL") or API_URL,
-                    n_conn=settings.getint("CONCURRENT_REQUESTS"),
+                    n_conn=n_conn,
                 )
             except NoApiKey:
                 logger.warning(
@@ -46,74 +135,556 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
                 )
                 raise NotConfigured
         self._client: AsyncClient = client
-        logger.info(
-            "Using a Zyte Data API key starting with %r", self._client.api_key[:7]
-        )
+        if len(clients) > 1:
+            logger.info(
+                "Using %d Zyte Data API keys starting with %s",
+                len(clients),
+                ", ".join(repr(client.api_key[:7]) for client in clients),
+            )
+        else:
+            logger.info(
+                "Using a Zyte Data API key starting with %r", self._client.api_key[:7]
+            )
         verify_installed_reactor(
             "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
         )
         self._stats = crawler.stats
         self._job_id = crawler.settings.get("JOB")
-        self._zyte_api_default_params = settings.getdict("ZYTE_API_DEFAULT_PARAMS")
-        self._session = create_session(connection_pool_size=self._client.n_conn)
+        # Shared by all requests, so read-only.
+        self._zyte_api_default_params: Mapping[str, Any] = MappingProxyType(
+            settings.getdict("ZYTE_API_DEFAULT_PARAMS")
+        )
+        self._json = _load_json_backend(settings.get("ZYTE_API_JSON_BACKEND") or "json")
+        self._timings: Optional[_Timings] = None
+        if settings.getbool("ZYTE_API_TIMING_STATS"):
+            self._timings = _Timings(stats=self._stats)
+            crawler.signals.connect(self._spider_closed, signal=signals.spider_closed)
+        self._concurrency: Optional[_AdaptiveConcurrency] = None
+        if settings.getbool("ZYTE_API_ADAPTIVE_CONCURRENCY"):
+            self._concurrency = _AdaptiveConcurrency(
+                minimum=settings.getint("ZYTE_API_ADAPTIVE_CONCURRENCY_MIN", 1),
+                maximum=settings.getint(
+                    "ZYTE_API_ADAPTIVE_CONCURRENCY_MAX", self._client.n_conn
+                ),
+                stats=self._stats,
+            )
+        self._rate_limiter: Optional[_RateLimiter] = None
+        rate = settings.getfloat("ZYTE_API_RATE_LIMIT")
+        per_domain_rate = settings.getfloat("ZYTE_API_RATE_LIMIT_PER_DOMAIN")
+        if rate > 0 or per_domain_rate > 0:
+            self._rate_limiter = _RateLimiter(
+                rate=rate,
+                per_domain_rate=per_domain_rate,
+                stats=self._stats,
+            )
+        self._throttle_gate: Optional[_ThrottleGate] = None
+        if settings.getbool("ZYTE_API_THROTTLE_GATE_ENABLED"):
+            self._throttle_gate = _ThrottleGate(
+                release_rate=settings.getfloat(
+                    "ZYTE_API_THROTTLE_GATE_RELEASE_RATE", 10.0
+                ),
+                default_pause=settings.getfloat(
+                    "ZYTE_API_THROTTLE_GATE_DEFAULT_PAUSE", 5.0
+                ),
+                stats=self._stats,
+            )
+        self._circuit_breaker: Optional[_CircuitBreaker] = None
+        if settings.getbool("ZYTE_API_CIRCUIT_BREAKER_ENABLED"):
+            self._circuit_breaker = _CircuitBreaker(
+                window=settings.getint("ZYTE_API_CIRCUIT_BREAKER_WINDOW", 100),
+                failure_rate=settings.getfloat(
+                    "ZYTE_API_CIRCUIT_BREAKER_FAILURE_RATE", 0.5
+                ),
+                cooldown=settings.getfloat("ZYTE_API_CIRCUIT_BREAKER_COOLDOWN", 30.0),
+                probes=settings.getint("ZYTE_API_CIRCUIT_BREAKER_PROBES", 1),
+                stats=self._stats,
+                on_state_change=self._circuit_breaker_state_changed,
+            )
+        connection_pool_size = max(
+            self._client.n_conn,
+            self._concurrency.maximum if self._concurrency else 0,
+        )
+        self._request_compression_min_size = settings.getint(
+            "ZYTE_API_REQUEST_COMPRESSION_MIN_SIZE"
+        )
+        keepalive_timeout = settings.get("ZYTE_API_KEEPALIVE_TIMEOUT")
+        dns_cache_ttl = settings.get("ZYTE_API_DNS_CACHE_TTL")
+        session_pool_kwargs = dict(
+            count=settings.getint("ZYTE_API_SESSIONS", 1),
+            connection_pool_size=connection_pool_size,
+            keepalive_timeout=(
+                None if keepalive_timeout is None else float(keepalive_timeout)
+            ),
+            dns_cache_ttl=None if dns_cache_ttl is None else int(dns_cache_ttl),
+            compression=settings.getbool("ZYTE_API_COMPRESSION", True),
+            json_serialize=self._json.dumps,
+        )
+        self._sessions = _SessionPool(**session_pool_kwargs)
+        self._session = self._sessions.sessions[0]
+        self._key_pool: Optional[_KeyPool] = None
+        if len(clients) > 1:
+            self._key_pool = _KeyPool(
+                [_PooledKey(client=self._client, sessions=self._sessions)]
+                + [
+                    _PooledKey(
+                        client=client,
+                        sessions=_SessionPool(**session_pool_kwargs),
+                    )
+                    for client in clients[1:]
+                ],
+                selection=(
+                    settings.get("ZYTE_API_KEY_SELECTION")
+                    or KEY_SELECTION_LEAST_IN_FLIGHT
+                ),
+                ejection_errors=settings.getint("ZYTE_API_KEY_EJECTION_ERRORS", 3),
+                ejection_time=settings.getfloat("ZYTE_API_KEY_EJECTION_TIME", 60.0),
+                stats=self._stats,
+            )
         self._retry_policy = settings.get("ZYTE_API_RETRY_POLICY")
+        self._raw_api_response_mode = (
+            settings.get("ZYTE_API_RAW_RESPONSE") or RAW_API_RESPONSE_FULL
+        )
+        if self._raw_api_response_mode not in RAW_API_RESPONSE_MODES:
+            raise ValueError(
+                f"Invalid ZYTE_API_RAW_RESPONSE value: "
+                f"{self._raw_api_response_mode!r}. Valid values are: "
+                f"{', '.join(repr(mode) for mode in RAW_API_RESPONSE_MODES)}."
+            )
+        self._lazy_body = settings.getbool("ZYTE_API_LAZY_BODY")
+        self._domain_stats = settings.getbool("ZYTE_API_DOMAIN_STATS")
+        self._offloader = _Offloader(
+            threshold=settings.getint("ZYTE_API_OFFLOAD_THRESHOLD"),
+            max_workers=settings.getint("ZYTE_API_OFFLOAD_MAX_WORKERS", 4),
+            stats=self._stats,
+        )
+        self._streaming_max_memory_size: Optional[int] = None
+        if settings.getbool("ZYTE_API_STREAMING"):
+            self._streaming_max_memory_size = settings.getint(
+                "ZYTE_API_STREAMING_MAX_MEMORY_SIZE", 10 * 1024 * 1024
+            )
+        self._spiller = _Spiller(
+            threshold=settings.getint("ZYTE_API_MMAP_THRESHOLD"),
+            stats=self._stats,
+        )
+        self._coalescer: Optional[_Coalescer] = None
+        if settings.getbool("ZYTE_API_COALESCE"):
+            self._coalescer = _Coalescer(stats=self._stats)
+        self._cache: Optional[_ResponseCache] = None
+        if settings.getbool("ZYTE_API_CACHE_ENABLED"):
+            self._cache = _ResponseCache(
+                path=data_path(settings.get("ZYTE_API_CACHE_DIR") or "zyte-api-cache"),
+                expiration=settings.getint("ZYTE_API_CACHE_EXPIRATION_SECS"),
+                max_size=settings.getint("ZYTE_API_CACHE_MAX_SIZE"),
+                stats=self._stats,
+            )
+        self._default_timeout = settings.getfloat("DOWNLOAD_TIMEOUT")
+        # Tasks of the Zyte API requests in progress, and the delayed calls
+        # that enforce their download timeout.
+        self._tasks: Dict[asyncio.Future, Optional[DelayedCall]] = {}
+        self._cancelled_on_close = False
+        self._close_check: Optional[LoopingCall] = None
+        if settings.getbool("ZYTE_API_CANCEL_ON_CLOSE"):
+            self._close_check = LoopingCall(self._cancel_if_closing)
+            self._close_check.start(_CLOSE_CHECK_INTERVAL, now=False)
 
     def download_request(self, request: Request, spider: Spider) -> Deferred:
+        start = perf_counter()
         api_params = self._prepare_api_params(request)
         if api_params:
-            return deferred_from_coro(
-                self._download_request(api_params, request, spider)
+            if self._timings is not None:
+                self._timings.record("params", perf_counter() - start)
+            return self._start(
+                self._download_request(api_params, request, spider), request, spider
             )
         return super().download_request(request, spider)
 
-    def _prepare_api_params(self, request: Request) -> Optional[dict]:
-        meta_params = request.meta.get("zyte_api")
-        if not meta_params and meta_params != {}:
-            return None
+    def _start(self, coro, request: Request, spider: Spider) -> Deferred:
+        """Return a deferred with the result of *coro*, run in a task that is
+        cancelled if the deferred is cancelled, if it does not finish within
+        the download timeout of *request*, retries included, or if the spider
+        is closed."""
+        task = asyncio.ensure_future(coro)
+        self._tasks[task] = None
+        task.add_done_callback(self._forget_task)
+        deferred = Deferred.fromFuture(task)
+        timeout = request.meta.get(
+            "download_timeout",
+            getattr(spider, "download_timeout", self._default_timeout),
+        )
+        if timeout:
+            from twisted.internet import reactor
+
+            timeout_call = reactor.callLater(  # type: ignore[attr-defined]
+                timeout, deferred.cancel
+            )
+            if task in self._tasks:
+                self._tasks[task] = timeout_call
+            deferred.addBoth(self._cb_timeout, request, timeout, timeout_call)
+        deferred.addErrback(self._eb_cancelled)
+        return deferred
 
-        if meta_params is True:
-            meta_params = {}
+    def _forget_task(self, task: asyncio.Future) -> None:
+        self._tasks.pop(task, None)
 
-        api_params: Dict[str, Any] = self._zyte_api_default_params or {}
+    @contextmanager
+    def _timeout_paused(self) -> Iterator[None]:
+        """Stop the download timeout of the running request from running out
+        within the block, for waits that are not spent on Zyte API."""
+        task = asyncio.current_task()
+        timeout_call = self._tasks.get(task) if task is not None else None
+        if timeout_call is None or not timeout_call.active():
+            yield
+            return
+        remaining = timeout_call.getTime() - timeout_call.seconds()
+        timeout_call.reset(_PAUSED_TIMEOUT)
         try:
-            api_params.update(meta_params)
-        except TypeError:
-            logger.error(
-                f"zyte_api parameters in the request meta should be "
-                f"provided as dictionary, got {type(request.meta.get('zyte_api'))} "
-                f"instead ({request.url})."
+            yield
+        finally:
+            if timeout_call.active():
+                timeout_call.reset(remaining)
+
+    def _cb_timeout(
+        self, result: Any, request: Request, timeout: float, timeout_call: Any
+    ) -> Any:
+        if timeout_call.active():
+            timeout_call.cancel()
+            return result
+        self._stats.inc_value("scrapy-zyte-api/download_timeout_exceeded")
+        raise TimeoutError(f"Getting {request.url} took longer than {timeout} seconds.")
+
+    def _eb_cancelled(self, failure: Failure) -> Failure:
+        if failure.check(asyncio.CancelledError):
+            self._stats.inc_value("scrapy-zyte-api/cancelled")
+            if self._cancelled_on_close:
+                raise IgnoreRequest()
+        return failure
+
+    def _cancel_if_closing(self) -> None:
+        engine = self._crawler.engine if self._crawler else None
+        if engine is None:
+            return
+        # Scrapy does not signal that the spider is closing until the requests
+        # in progress are over, so the engine slot, renamed to _slot in later
+        # Scrapy versions, is checked instead.
+        for name in _ENGINE_SLOT_ATTRIBUTES:
+            if hasattr(engine, name):
+                slot = getattr(engine, name)
+                break
+        else:
+            assert self._close_check is not None
+            self._close_check.stop()
+            logger.warning(
+                "ZYTE_API_CANCEL_ON_CLOSE is not supported with this Scrapy "
+                "version, Zyte API requests in progress will not be cancelled "
+                "when the spider closes."
             )
+            return
+        if slot is not None and slot.closing is not None:
+            self._cancel_tasks()
+
+    def _cancel_tasks(self) -> None:
+        """Cancel the Zyte API requests in progress, whose deferreds fail
+        with :exc:`~scrapy.exceptions.IgnoreRequest`."""
+        self._cancelled_on_close = True
+        for task in self._tasks:
+            task.cancel()
+
+    def _prepare_api_params(self, request: Request) -> Optional[Mapping[str, Any]]:
+        """Return the Zyte API parameters of *request*, merged with the
+        default ones, or ``None`` if *request* is not a Zyte API request.
+
+        See :func:`_get_api_params`.
+        """
+        try:
+            return _get_api_params(
+                request.meta.get("zyte_api"), self._zyte_api_default_params
+            )
+        except TypeError as error:
+            logger.error(f"{error} ({request.url}).")
             raise IgnoreRequest()
-        return api_params
 
     async def _download_request(
-        self, api_params: dict, request: Request, spider: Spider
+        self, api_params: Mapping[str, Any], request: Request, spider: Spider
     ) -> Optional[Union[ZyteAPITextResponse, ZyteAPIResponse]]:
         # Define url by default
-        api_data = {**{"url": request.url}, **api_params}
+        api_data = {"url": request.url, **api_params}
         if self._job_id is not None:
             api_data["jobId"] = self._job_id
+        cache_key = None
+        if self._cache is not None and not request.meta.get("dont_cache"):
+            cache_key = _cache_key(api_data)
+            # SQLite is kept off the reactor thread.
+            cached_data = await self._offloader.run("cache", self._cache.get, cache_key)
+            if cached_data is not None:
+                api_response = self._json.loads(cached_data.decode())
+                self._check_size(api_response, request, spider)
+                response = await self._build_response(api_response, request)
+                if response is not None:
+                    response.flags.append("cached")
+                return response
+        if self._coalescer is not None:
+            api_response = await self._coalescer.run(
+                cache_key or _cache_key(api_data),
+                partial(self._get_api_response, api_data, request, spider, cache_key),
+                _share_api_response,
+            )
+            # Responses must not share their raw_api_response.
+            api_response = dict(api_response)
+        else:
+            api_response = await self._get_api_response(
+                api_data, request, spider, cache_key
+            )
+        self._check_size(api_response, request, spider)
+        return await self._build_response(api_response, request)
+
+    async def _get_api_response(
+        self,
+        api_data: Dict[str, Any],
+        request: Request,
+        spider: Spider,
+        cache_key: Optional[str],
+    ) -> Dict[str, Any]:
         retrying = request.meta.get("zyte_api_retry_policy") or self._retry_policy
+        context = _RequestContext(
+            offloader=self._offloader,
+            json_loads=self._json.loads,
+            streaming_max_memory_size=self._streaming_max_memory_size,
+            spiller=self._spiller,
+            request=request,
+            maxsize=self._get_maxsize(request, spider),
+            timings=[] if self._timings is not None else None,
+            concurrency=self._concurrency,
+            circuit_breaker=self._circuit_breaker,
+            throttle_gate=self._throttle_gate,
+            request_compression_min_size=self._request_compression_min_size,
+        )
+        client, sessions = self._client, self._sessions
+        key = None
+        if self._key_pool is not None:
+            key = self._key_pool.acquire()
+            client, sessions = key.client, key.sessions
+        # Outcome of the request for the key pool, which does not count
+        # cancellations as failures.
+        failed = False
+        status = None
+        context_token = _request_context.set(context)
         try:
-            api_response = await self._client.request_raw(
+            api_response = await client.request_raw(
                 api_data,
-                session=self._session,
+                session=_AttemptSession(
+                    sessions.get(),
+                    wait=partial(self._wait_to_attempt, context),
+                    done=partial(self._end_attempt, context),
+                ),
                 retrying=retrying,
             )
         except RequestError as er:
+            failed, status = True, er.status
+            self._stats.inc_value("scrapy-zyte-api/error_count")
+            self._stats.inc_value(f"scrapy-zyte-api/error/status/{er.status}")
             error_message = self._get_request_error_message(er)
             logger.error(
                 f"Got Zyte API error ({er.status}) while processing URL ({request.url}): {error_message}"
             )
+            raise ZyteAPIError(
+                error_message,
+                status=er.status,
+                retry_after=_get_retry_after(er.headers),
+                retryable=er.status in _RETRYABLE_STATUS_CODES,
+            ) from er
+        except _MaxSizeExceeded as er:
+            failed = True
+            self._stats.inc_value("scrapy-zyte-api/error_count")
+            self._stats.inc_value("scrapy-zyte-api/download_maxsize_exceeded")
+            if er.expected:
+                logger.warning(
+                    f"Cancelling download of {request.url}: expected Zyte API "
+                    f"response size ({er.size}) too large for download max "
+                    f"size ({er.maxsize})."
+                )
+            else:
+                logger.warning(
+                    f"Received ({er.size}) bytes, too large for download max "
+                    f"size ({er.maxsize}), in request {request}."
+                )
             raise IgnoreRequest()
+        except _CircuitOpen as er:
+            # Not an error of the request, which was not sent.
+            logger.debug(
+                f"Not sending Zyte API request ({request.url}), the circuit "
+                f"breaker is open."
+            )
+            raise ZyteAPIError(
+                "The Zyte API circuit breaker is open",
+                retry_after=er.retry_after,
+                retryable=True,
+            ) from er
+        except asyncio.CancelledError:
+            # Not an error of the request, but an Exception in Python 3.7.
+            raise
         except Exception as er:
+            failed = True
+            self._stats.inc_value("scrapy-zyte-api/error_count")
+            self._stats.inc_value(
+                f"scrapy-zyte-api/error/exception/{_get_class_path(er)}"
+            )
             logger.error(
                 f"Got an error when processing Zyte API request ({request.url}): {er}"
             )
-            raise IgnoreRequest()
+            raise ZyteAPIError(
+                str(er), retryable=isinstance(er, _RETRYABLE_EXCEPTIONS)
+            ) from er
+        finally:
+            _request_context.reset(context_token)
+            if key is not None:
+                assert self._key_pool is not None
+                self._key_pool.release(key, failed=failed, status=status)
+            self._record_timings(context.timings)
+            self._record_attempts(context)
 
         self._stats.inc_value("scrapy-zyte-api/request_count")
-        return _process_response(api_response, request)
+        self._record_response(api_response, request)
+        if cache_key is not None:
+            await self._offloader.run(
+                "cache", self._store_cached_response, cache_key, api_response
+            )
+        return api_response
+
+    def _store_cached_response(self, key: str, api_response: Dict[str, Any]) -> None:
+        assert self._cache is not None
+        self._cache.set(key, _dump_api_response(api_response, self._json.dumps))
+
+    def _get_maxsize(self, request: Request, spider: Spider) -> int:
+        return request.meta.get(
+            "download_maxsize",
+            getattr(spider, "download_maxsize", self._default_maxsize),
+        )
+
+    def _get_warnsize(self, request: Request, spider: Spider) -> int:
+        return request.meta.get(
+            "download_warnsize",
+            getattr(spider, "download_warnsize", self._default_warnsize),
+        )
+
+    def _check_size(
+        self, api_response: Dict[str, Any], request: Request, spider: Spider
+    ) -> None:
+        """Apply the download max and warn sizes of *request* to the size of
+        the response body of *api_response*, received or read from the
+        cache."""
+        size = _get_decoded_body_size(api_response)
+        maxsize = self._get_maxsize(request, spider)
+        if 0 < maxsize < size:
+            self._stats.inc_value("scrapy-zyte-api/download_maxsize_exceeded")
+            logger.warning(
+                f"Response body size ({size}) larger than download max size "
+                f"({maxsize}) in request {request}."
+            )
+            raise IgnoreRequest()
+        warnsize = self._get_warnsize(request, spider)
+        if 0 < warnsize < size:
+            self._stats.inc_value("scrapy-zyte-api/download_warnsize_exceeded")
+            logger.warning(
+                f"Response body size ({size}) larger than download warn size "
+                f"({warnsize}) in request {request}."
+            )
+
+    async def _wait_to_attempt(self, context: _RequestContext) -> None:
+        """Wait until an attempt to send the request of *context* can be
+        sent.
+
+        Attempts are controlled here, through :class:`_AttemptSession`,
+        rather than from aiohttp trace hooks, which only observe them, so
+        that waits do not count towards the aiohttp timeout."""
+        request = context.request
+        retry_at = request.meta.get("_zyte_api_retry_at") if request else None
+        if retry_at is not None:
+            # Retries from ZyteAPIRetryMiddleware wait for their backoff delay
+            # here, rather than before being scheduled, so that the errback
+            # of the request is only called once retries are over.
+            delay = retry_at - time()
+            if delay > 0:
+                with self._timeout_paused():
+                    await asyncio.sleep(delay)
+        if self._circuit_breaker is not None:
+            # Raises _CircuitOpen, which is not retried, if the circuit is
+            # open.
+            context.circuit_breaker_probe = self._circuit_breaker.check()
+        with self._timeout_paused():
+            if self._throttle_gate is not None:
+                await self._throttle_gate.wait()
+            if self._rate_limiter is not None:
+                domain = (urlparse_cached(request).hostname or "") if request else ""
+                await self._rate_limiter.wait(domain)
+        if self._concurrency is not None:
+            await self._concurrency.acquire()
+            context.concurrency_acquired = True
+
+    def _end_attempt(self, context: _RequestContext) -> None:
+        # The outcome of attempts that were not sent, e.g. cancelled while
+        # waiting, is unknown.
+        _record_circuit_breaker(context, None)
+        if context.concurrency_acquired:
+            assert self._concurrency is not None
+            context.concurrency_acquired = False
+            self._concurrency.release()
+
+    async def _build_response(
+        self, api_response: Dict[str, Any], request: Request
+    ) -> Optional[Union[ZyteAPITextResponse, ZyteAPIResponse]]:
+        timings: Dict[str, float] = {}
+        process_response = partial(
+            _process_response,
+            api_response,
+            request,
+            raw_api_response_mode=self._raw_api_response_mode,
+            lazy_body=self._lazy_body,
+            spiller=self._spiller,
+            timings=timings,
+        )
+        start = perf_counter()
+        if self._offloader.should_offload(_get_body_size(api_response)):
+            response = await self._offloader.run("response", process_response)
+        else:
+            response = process_response()
+        timings["response"] = perf_counter() - start
+        self._record_timings(timings.items())
+        return response
+
+    def _record_attempts(self, context: _RequestContext) -> None:
+        self._stats.inc_value("scrapy-zyte-api/attempts", context.attempts)
+        if context.attempts > 1:
+            self._stats.inc_value("scrapy-zyte-api/retries", context.attempts - 1)
+        for status in context.status_codes:
+            self._stats.inc_value(f"scrapy-zyte-api/status_codes/{status}")
+        self._stats.inc_value("scrapy-zyte-api/bytes/wire", context.wire_bytes)
+        self._stats.inc_value("scrapy-zyte-api/bytes/encoded", context.received_bytes)
+
+    def _record_response(self, api_response: Dict[str, Any], request: Request) -> None:
+        for field in _BODY_FIELDS:
+            if api_response.get(field) is not None:
+                self._stats.inc_value(f"scrapy-zyte-api/response_count/{field}")
+        self._stats.inc_value(
+            "scrapy-zyte-api/bytes/decoded", _get_decoded_body_size(api_response)
+        )
+        if self._domain_stats:
+            domain = urlparse_cached(request).hostname
+            self._stats.inc_value(f"scrapy-zyte-api/response_count/domain/{domain}")
+
+    def _record_timings(self, timings: Optional[Iterable[Tuple[str, float]]]) -> None:
+        if self._timings is not None and timings is not None:
+            for stage, seconds in timings:
+                self._timings.record(stage, seconds)
+
+    def _circuit_breaker_state_changed(self, state: str) -> None:
+        logger.info(f"The Zyte API circuit breaker is now {state}.")
+        self._crawler.signals.send_catch_log(
+            signal=zyte_api_circuit_breaker_state_changed, state=state
+        )
+
+    def _spider_closed(self, spider: Spider) -> None:
+        assert self._timings is not None
+        self._timings.dump_percentiles()
 
     @inlineCallbacks
     def close(self) -> Generator:
@@ -121,10 +692,18 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         yield deferred_from_coro(self._close())
 
     async def _close(self) -> None:  # NOQA
-        await self._session.close()
+        if self._close_check is not None and self._close_check.running:
+            self._close_check.stop()
+        self._cancel_tasks()
+        if self._key_pool is not None:
+            for key in self._key_pool.keys[1:]:
+                await key.sessions.close()
+        await self._sessions.close()
+        self._offloader.close()
+        if self._cache is not None:
+            self._cache.close()
 
-    @staticmethod
-    def _get_request_error_message(error: RequestError) -> str:
+    def _get_request_error_message(self, error: RequestError) -> str:
         if hasattr(error, "message"):
             base_message = error.message
         else:
@@ -132,9 +711,73 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         if not hasattr(error, "response_content"):
             return base_message
         try:
-            error_data = json.loads(error.response_content.decode("utf-8"))
+            error_data = self._json.loads(error.response_content.decode("utf-8"))
         except (AttributeError, TypeError, ValueError):
             return base_message
         if error_data.get("detail"):
             return error_data["detail"]
         return base_message
+
+
+def _get_api_keys(settings: Settings) -> List[str]:
+    """Return the API keys of the ``ZYTE_API_KEYS`` setting, without empty
+    ones, e.g. from a trailing comma.
+
+    Raise :exc:`~scrapy.exceptions.NotConfigured` if the setting is set, but
+    only to empty keys."""
+    api_keys = settings.getlist("ZYTE_API_KEYS")
+    if not api_keys:
+        return []
+    api_keys = [api_key.strip() for api_key in api_keys if api_key.strip()]
+    if not api_keys:
+        message = (
+            "'ZYTE_API_KEYS' must contain at least one non-empty API key in "
+            "order for ScrapyZyteAPIDownloadHandler to work."
+        )
+        logger.warning(message)
+        raise NotConfigured(message)
+    return api_keys
+
+
+def _get_body_size(api_response: Dict[str, Any]) -> int:
+    """Return the size of the response body fields of *api_response*, which
+    make most of its decoding cost. Fields already decoded while streaming
+    the response are not counted."""
+    return sum(
+        len(value)
+        for value in (api_response.get(field) for field in _BODY_FIELDS)
+        if isinstance(value, str)
+    )
+
+
+def _get_decoded_body_size(api_response: Dict[str, Any]) -> int:
+    """Return the size of the response body of *api_response* without decoding
+    it, with ``browserHtml`` counted in characters."""
+    size = len(api_response.get(_BROWSER_HTML) or "")
+    body = api_response.get(_HTTP_RESPONSE_BODY)
+    if isinstance(body, _DecodedBody):
+        size += body.size
+    elif body:
+        size += len(body) * 3 // 4 - body[-2:].count("=")
+    return size
+
+
+def _share_api_response(api_response: Dict[str, Any]) -> Dict[str, Any]:
+    """Return *api_response* with its response body, if decoded into a file
+    while it was received, read into memory, so that several responses can be
+    built from it."""
+    body = api_response.get(_HTTP_RESPONSE_BODY)
+    if isinstance(body, _DecodedBody) and not isinstance(body.value, bytes):
+        with body.value as body_file:
+            data = body_file.read()
+        api_response = {
+            **api_response,
+            _HTTP_RESPONSE_BODY: _DecodedBody(data, body.size),
+        }
+    return api_response
+
+
+def _get_class_path(obj: Any) -> str:
+    """Return the import path of the class of *obj*."""
+    cls = type(obj)
+    return f"{cls.__module__}.{cls.__qualname__}"
@@ -0,0 +1,90 @@
+import logging
+import random
+from time import time
+from typing import Optional
+
+from scrapy import Request, Spider
+from scrapy.crawler import Crawler
+
+from .exceptions import ZyteAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class ZyteAPIRetryMiddleware:
+    """Downloader middleware that retries Zyte API requests that failed with
+    a :exc:`~scrapy_zyte_api.ZyteAPIError` that is retryable, scheduling a
+    copy of them.
+
+    Retries are sent after an exponential backoff delay, or the delay that
+    Zyte API asked for, if longer. Retries are scheduled right away, with the
+    end of that delay in their ``_zyte_api_retry_at`` meta key, and the
+    download handler waits for it before sending them, without using a Zyte
+    API concurrency slot.
+    """
+
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        self._max_retry_times = settings.getint(
+            "ZYTE_API_RETRY_TIMES", settings.getint("RETRY_TIMES")
+        )
+        self._priority_adjust = settings.getint(
+            "ZYTE_API_RETRY_PRIORITY_ADJUST", settings.getint("RETRY_PRIORITY_ADJUST")
+        )
+        self._backoff_base = settings.getfloat("ZYTE_API_RETRY_BACKOFF_BASE", 1.0)
+        self._backoff_max = settings.getfloat("ZYTE_API_RETRY_BACKOFF_MAX", 60.0)
+        self._budget = settings.getint("ZYTE_API_RETRY_BUDGET")
+        self._retries = 0
+        self._stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        return cls(crawler)
+
+    def process_exception(
+        self, request: Request, exception: Exception, spider: Spider
+    ) -> Optional[Request]:
+        if (
+            not isinstance(exception, ZyteAPIError)
+            or not exception.retryable
+            or request.meta.get("dont_retry", False)
+        ):
+            return None
+        retry_times = request.meta.get("zyte_api_retry_times", 0) + 1
+        max_retry_times = request.meta.get(
+            "zyte_api_max_retry_times", self._max_retry_times
+        )
+        if retry_times > max_retry_times:
+            self._stats.inc_value("scrapy-zyte-api/retry/max_reached")
+            logger.error(
+                f"Gave up retrying {request} (failed {retry_times} times): "
+                f"{exception}"
+            )
+            return None
+        if 0 < self._budget <= self._retries:
+            self._stats.inc_value("scrapy-zyte-api/retry/budget_exhausted")
+            logger.error(
+                f"Not retrying {request}, the Zyte API retry budget "
+                f"({self._budget}) is exhausted: {exception}"
+            )
+            return None
+        self._retries += 1
+        delay = min(self._backoff_max, self._backoff_base * 2 ** (retry_times - 1))
+        # Jitter keeps requests that failed at the same time from being
+        # retried at the same time.
+        delay *= random.uniform(0.5, 1.0)
+        if exception.retry_after is not None:
+            delay = max(delay, exception.retry_after)
+        new_request = request.copy()
+        new_request.meta["zyte_api_retry_times"] = retry_times
+        new_request.meta["_zyte_api_retry_at"] = time() + delay
+        new_request.dont_filter = True
+        new_request.priority = request.priority + self._priority_adjust
+        reason = "exception" if exception.status is None else exception.status
+        self._stats.inc_value("scrapy-zyte-api/retry/count")
+        self._stats.inc_value(f"scrapy-zyte-api/retry/reason/{reason}")
+        logger.debug(
+            f"Retrying {request} (failed {retry_times} times) in {delay:.1f} "
+            f"seconds: {exception}"
+        )
+        return new_request
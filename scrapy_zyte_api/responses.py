@@ -1,12 +1,60 @@
-from base64 import b64decode
-from typing import Dict, List, Optional, Tuple, Union
+import math
+import mmap
+from base64 import b64decode, b64encode
+from time import perf_counter
+from typing import IO, Dict, List, Optional, Tuple, Type, Union
 
 from scrapy import Request
 from scrapy.http import Response, TextResponse
+from scrapy.http.common import obsolete_setter
 from scrapy.responsetypes import responsetypes
 
+from ._spill import _Spiller
+
 _DEFAULT_ENCODING = "utf-8"
 
+_BROWSER_HTML = "browserHtml"
+_HTTP_RESPONSE_BODY = "httpResponseBody"
+# Fields of the raw API response whose content is also the response body.
+_BODY_FIELDS = (_BROWSER_HTML, _HTTP_RESPONSE_BODY)
+
+# Values of the ZYTE_API_RAW_RESPONSE setting.
+RAW_API_RESPONSE_FULL = "full"
+RAW_API_RESPONSE_LAZY = "lazy"
+RAW_API_RESPONSE_METADATA_ONLY = "metadata-only"
+RAW_API_RESPONSE_MODES = (
+    RAW_API_RESPONSE_FULL,
+    RAW_API_RESPONSE_LAZY,
+    RAW_API_RESPONSE_METADATA_ONLY,
+)
+
+
+class _EncodedBody:
+    """Response body as found in a Zyte API response, decoded on demand."""
+
+    __slots__ = ("field", "value")
+
+    def __init__(self, field: str, value: str):
+        self.field = field
+        self.value = value
+
+    def decode(self) -> bytes:
+        if self.field == _BROWSER_HTML:
+            return self.value.encode(_DEFAULT_ENCODING)
+        return b64decode(self.value)
+
+
+class _DecodedBody:
+    """Response body field of a Zyte API response that was already decoded
+    while the response was being received, either into bytes or, if it may be
+    spilled (see _Spiller), into a file."""
+
+    __slots__ = ("value", "size")
+
+    def __init__(self, value: Union[bytes, IO[bytes]], size: int):
+        self.value = value
+        self.size = size
+
 
 class ZyteAPIMixin:
 
@@ -17,14 +65,73 @@ class ZyteAPIMixin:
         "content-encoding"
     }
 
+    # Whether the body is decoded from the Zyte API response on first access,
+    # instead of on initialization.
+    _lazy_body = False
+
     def __init__(self, *args, raw_api_response: Dict = None, **kwargs):
         super().__init__(*args, **kwargs)
         self._raw_api_response = raw_api_response
+        # Field of the raw API response that is left out of
+        # _raw_api_response and rebuilt on access from the body of
+        # _lazy_raw_api_response_source, or of this response if None.
+        self._lazy_raw_api_response_field: Optional[str] = None
+        self._lazy_raw_api_response_source: Optional[ZyteAPIMixin] = None
 
     def replace(self, *args, **kwargs):
         if kwargs.get("raw_api_response"):
             raise ValueError("Replacing the value of 'raw_api_response' isn't allowed.")
-        return super().replace(*args, **kwargs)
+        # Like Response.replace(), but without reading raw_api_response, nor
+        # the body if not decoded yet, which may encode or decode the whole
+        # body.
+        kwargs["raw_api_response"] = self._raw_api_response
+        cls = kwargs.pop("cls", type(self))
+        if self._body is None and issubclass(cls, ZyteAPIMixin):
+            kwargs.setdefault("body", self._encoded_body)
+            if "encoding" in self.attributes:
+                # Inferred from the same body and headers if None.
+                kwargs.setdefault("encoding", self._encoding)
+        for name in self.attributes:
+            if name not in kwargs:
+                kwargs[name] = getattr(self, name)
+        response = cls(*args, **kwargs)
+        if isinstance(response, ZyteAPIMixin):
+            response._lazy_raw_api_response_field = self._lazy_raw_api_response_field
+            if self._lazy_raw_api_response_field is not None:
+                # The raw API response has the body of the original response,
+                # even if the body is replaced.
+                response._lazy_raw_api_response_source = (
+                    self._lazy_raw_api_response_source or self
+                )
+        return response
+
+    def _set_body(self, body):
+        if isinstance(body, _EncodedBody):
+            self._body = None
+            self._encoded_body: Optional[_EncodedBody] = body
+            return
+        self._encoded_body = None
+        if isinstance(body, mmap.mmap):
+            # Bodies spilled to disk, see _Spiller.
+            self._body = body
+            return
+        super()._set_body(body)  # type: ignore[misc]
+
+    def _get_body(self) -> bytes:
+        if self._body is None:
+            assert self._encoded_body is not None
+            self._body = self._encoded_body.decode()
+            self._encoded_body = None
+        return self._body
+
+    body = property(_get_body, obsolete_setter(_set_body, "body"))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(state.get("_body"), mmap.mmap):
+            # Memory maps cannot be pickled.
+            state["_body"] = state["_body"][:]
+        return state
 
     @property
     def raw_api_response(self) -> Optional[Dict]:
@@ -33,7 +140,84 @@ class ZyteAPIMixin:
         To see the full list of parameters and their description, kindly refer to the
         `Zyte API Specification <https://docs.zyte.com/zyte-api/openapi.html#zyte-openapi-spec>`_.
         """
-        return self._raw_api_response
+        field = self._lazy_raw_api_response_field
+        if field is None or self._raw_api_response is None:
+            return self._raw_api_response
+        source = self._lazy_raw_api_response_source or self
+        return {**self._raw_api_response, field: source._encode_body_field(field)}
+
+    def _encode_body_field(self, field: str) -> str:
+        if self._encoded_body is not None and self._encoded_body.field == field:
+            return self._encoded_body.value
+        return b64encode(self.body).decode()
+
+    @classmethod
+    def _from_api_response(
+        cls,
+        api_response: Dict,
+        *,
+        body: Optional[Union[bytes, mmap.mmap]] = None,
+        request: Request = None,
+        raw_api_response_mode: str = RAW_API_RESPONSE_FULL,
+    ):
+        """Instantiate the response from the raw Zyte API response.
+
+        *body* is the already-decoded ``httpResponseBody``, if any, so that it
+        is never decoded twice.
+        """
+        return cls._from_api_response_body(
+            api_response,
+            body=(
+                body
+                if body is not None
+                else cls._prepare_body(api_response, _HTTP_RESPONSE_BODY)
+            ),
+            body_field=_HTTP_RESPONSE_BODY,
+            request=request,
+            raw_api_response_mode=raw_api_response_mode,
+        )
+
+    @classmethod
+    def _from_api_response_body(
+        cls,
+        api_response: Dict,
+        *,
+        body: Union[bytes, mmap.mmap, _EncodedBody],
+        body_field: str,
+        request: Optional[Request],
+        raw_api_response_mode: str,
+        **kwargs,
+    ):
+        raw_api_response = api_response
+        if raw_api_response_mode != RAW_API_RESPONSE_FULL:
+            raw_api_response = {
+                k: v for k, v in api_response.items() if k not in _BODY_FIELDS
+            }
+        response = cls(
+            url=api_response["url"],
+            status=200,
+            body=body,
+            request=request,
+            flags=["zyte-api"],
+            headers=cls._prepare_headers(api_response.get("httpResponseHeaders")),
+            raw_api_response=raw_api_response,
+            **kwargs,
+        )
+        if (
+            raw_api_response_mode == RAW_API_RESPONSE_LAZY
+            and body_field in api_response
+        ):
+            response._lazy_raw_api_response_field = body_field
+        return response
+
+    @classmethod
+    def _prepare_body(
+        cls, api_response: Dict, field: str
+    ) -> Union[bytes, _EncodedBody]:
+        body = _EncodedBody(field, api_response.get(field) or "")
+        if cls._lazy_body:
+            return body
+        return body.decode()
 
     @classmethod
     def _prepare_headers(cls, init_headers: Optional[List[Dict[str, str]]]):
@@ -55,26 +239,55 @@ class ZyteAPITextResponse(ZyteAPIMixin, TextResponse):
         """Alternative constructor to instantiate the response from the raw
         Zyte API response.
         """
-        body = None
-        encoding = None
-
-        if api_response.get("browserHtml"):
-            encoding = _DEFAULT_ENCODING  # Zyte API has "utf-8" by default
-            body = api_response["browserHtml"].encode(encoding)
-        elif api_response.get("httpResponseBody"):
-            body = b64decode(api_response["httpResponseBody"])
+        return cls._from_api_response(api_response, request=request)
 
-        return cls(
-            url=api_response["url"],
-            status=200,
-            body=body,
-            encoding=encoding,
+    @classmethod
+    def _from_api_response(
+        cls,
+        api_response: Dict,
+        *,
+        body: Optional[Union[bytes, mmap.mmap]] = None,
+        request: Request = None,
+        raw_api_response_mode: str = RAW_API_RESPONSE_FULL,
+    ):
+        if not api_response.get(_BROWSER_HTML):
+            return super()._from_api_response(
+                api_response,
+                body=body,
+                request=request,
+                raw_api_response_mode=raw_api_response_mode,
+            )
+        # The text from browserHtml is used as is for .text and selectors, and
+        # only encoded into bytes if .body is read.
+        return cls._from_api_response_body(
+            api_response,
+            body=_EncodedBody(_BROWSER_HTML, api_response[_BROWSER_HTML]),
+            body_field=_BROWSER_HTML,
             request=request,
-            flags=["zyte-api"],
-            headers=cls._prepare_headers(api_response.get("httpResponseHeaders")),
-            raw_api_response=api_response,
+            raw_api_response_mode=raw_api_response_mode,
+            # Zyte API has "utf-8" by default
+            encoding=_DEFAULT_ENCODING,
         )
 
+    def _set_body(self, body):
+        super()._set_body(body)
+        if isinstance(body, _EncodedBody) and body.field == _BROWSER_HTML:
+            self._cached_ubody = body.value
+
+    def _set_url(self, url):
+        # TextResponse._set_url() gets the response encoding, which may
+        # require the body, to decode bytes URLs, while URLs from Zyte API are
+        # always str.
+        if isinstance(url, str):
+            self._url = url
+        else:
+            super()._set_url(url)
+
+    def _encode_body_field(self, field: str) -> str:
+        if field == _BROWSER_HTML and self._encoded_body is None:
+            return self.text
+        return super()._encode_body_field(field)
+
 
 class ZyteAPIResponse(ZyteAPIMixin, Response):
 
@@ -85,23 +298,44 @@ class ZyteAPIResponse(ZyteAPIMixin, Response):
         """Alternative constructor to instantiate the response from the raw
         Zyte API response.
         """
-        return cls(
-            url=api_response["url"],
-            status=200,
-            body=b64decode(api_response.get("httpResponseBody") or ""),
-            request=request,
-            flags=["zyte-api"],
-            headers=cls._prepare_headers(api_response.get("httpResponseHeaders")),
-            raw_api_response=api_response,
-        )
+        return cls._from_api_response(api_response, request=request)
+
+
+class ZyteAPILazyTextResponse(ZyteAPITextResponse):
+    """:class:`ZyteAPITextResponse` that decodes its body from the Zyte API
+    response on first access."""
+
+    _lazy_body = True
+
+
+class ZyteAPILazyResponse(ZyteAPIResponse):
+    """:class:`ZyteAPIResponse` that decodes its body from the Zyte API
+    response on first access."""
+
+    _lazy_body = True
+
+
+# Number of bytes that responsetypes.from_body() inspects, and of base64
+# characters that encode them.
+_SNIFF_SIZE = 5000
+_SNIFF_BASE64_SIZE = 4 * math.ceil(_SNIFF_SIZE / 3)
 
 
 def _process_response(
-    api_response: Dict[str, Union[List[Dict], str]], request: Request
+    api_response: Dict[str, Union[List[Dict], str, _DecodedBody]],
+    request: Request,
+    *,
+    raw_api_response_mode: str = RAW_API_RESPONSE_FULL,
+    lazy_body: bool = False,
+    spiller: Optional[_Spiller] = None,
+    timings: Optional[Dict[str, float]] = None,
 ) -> Optional[Union[ZyteAPITextResponse, ZyteAPIResponse]]:
     """Given a Zyte API Response and the ``scrapy.Request`` that asked for it,
     this returns either a ``ZyteAPITextResponse`` or ``ZyteAPIResponse`` depending
     on which if it can properly decode the HTTP Body or have access to browserHtml.
+
+    If *timings* is a dictionary, the time it takes to decode the body from
+    base64 is stored in it, with the ``"base64"`` key.
     """
 
     # NOTES: Currently, Zyte API does NOT only allow both 'browserHtml' and
@@ -110,19 +344,74 @@ def _process_response(
     # - https://github.com/scrapy-plugins/scrapy-zyte-api/pull/10#issuecomment-1131406460
     # For now, at least one of them should be present.
 
+    text_cls: Type[ZyteAPITextResponse] = ZyteAPITextResponse
+    binary_cls: Type[ZyteAPIResponse] = ZyteAPIResponse
+    if lazy_body:
+        text_cls, binary_cls = ZyteAPILazyTextResponse, ZyteAPILazyResponse
+
     if api_response.get("browserHtml"):
         # Using TextResponse because browserHtml always returns a browser-rendered page
         # even when requesting files (like images)
-        return ZyteAPITextResponse.from_api_response(api_response, request=request)
+        return text_cls._from_api_response(
+            api_response,
+            request=request,
+            raw_api_response_mode=raw_api_response_mode,
+        )
 
-    if api_response.get("httpResponseHeaders") and api_response.get("httpResponseBody"):
-        response_cls = responsetypes.from_args(
+    # The body is decoded only once, both to guess the response class and to
+    # build the response, as it may be several megabytes long. Lazy responses
+    # only decode the beginning of the body, which is enough to guess the
+    # response class.
+    encoded_body: Union[str, _DecodedBody] = (
+        api_response.get("httpResponseBody") or ""  # type: ignore
+    )
+    body: Optional[Union[bytes, mmap.mmap]] = None
+    body_file: Optional[IO[bytes]] = None
+    if isinstance(encoded_body, _DecodedBody):
+        if isinstance(encoded_body.value, bytes):
+            sniffed_body = body = encoded_body.value
+        else:
+            body_file = encoded_body.value
+            sniffed_body = body_file.read(_SNIFF_SIZE)
+            body_file.seek(0)
+        # The base64 form of the body is not kept by streaming, so it can only
+        # be rebuilt on access.
+        if raw_api_response_mode == RAW_API_RESPONSE_FULL:
+            raw_api_response_mode = RAW_API_RESPONSE_LAZY
+    elif lazy_body:
+        sniffed_body = b64decode(encoded_body[:_SNIFF_BASE64_SIZE])
+    else:
+        start = perf_counter()
+        sniffed_body = body = b64decode(encoded_body)
+        if timings is not None:
+            timings["base64"] = perf_counter() - start
+    response_cls: Type[Union[ZyteAPITextResponse, ZyteAPIResponse]] = binary_cls
+    if api_response.get("httpResponseHeaders") and sniffed_body:
+        guessed_cls = responsetypes.from_args(
             headers=api_response["httpResponseHeaders"],
             url=api_response["url"],
-            # FIXME: update this when python-zyte-api supports base64 decoding
-            body=b64decode(api_response["httpResponseBody"]),  # type: ignore
+            body=sniffed_body,
         )
-        if issubclass(response_cls, TextResponse):
-            return ZyteAPITextResponse.from_api_response(api_response, request=request)
-
-    return ZyteAPIResponse.from_api_response(api_response, request=request)
+        if issubclass(guessed_cls, TextResponse):
+            response_cls = text_cls
+    # Only binary responses get their body memory-mapped, text responses need
+    # it decoded as a whole.
+    if body_file is not None:
+        with body_file:
+            if response_cls is binary_cls and spiller is not None:
+                body = spiller.map(body_file)
+            else:
+                body = body_file.read()
+    elif (
+        isinstance(body, bytes)
+        and response_cls is binary_cls
+        and spiller is not None
+        and spiller.should_spill(len(body))
+    ):
+        body = spiller.spill(body)
+    return response_cls._from_api_response(
+        api_response,
+        body=body,
+        request=request,
+        raw_api_response_mode=raw_api_response_mode,
+    )
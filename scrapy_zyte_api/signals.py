@@ -0,0 +1,3 @@
+# Sent when the state of the Zyte API circuit breaker changes, with the new
+# state, "open", "half-open" or "closed", as the state keyword argument.
+zyte_api_circuit_breaker_state_changed = object()
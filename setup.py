@@ -10,7 +10,13 @@ setuptools.setup(
     author_email="info@zyte.com",
     url="https://github.com/scrapy-plugins/scrapy-zyte-api",
     packages=["scrapy_zyte_api"],
-    install_requires=["zyte-api>=0.1.2", "scrapy>=2.6.0"],
+    install_requires=[
+        "zyte-api>=0.1.2",
+        "scrapy>=2.6.0",
+        # Private aiohttp internals are used to compress requests and to read
+        # responses, hence the upper bound.
+        "aiohttp>=3.8.0,<4",
+    ],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Developers",
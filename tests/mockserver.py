@@ -1,10 +1,13 @@
 import argparse
+import gzip
 import json
 import socket
 import sys
 import time
+import zlib
 from base64 import b64encode
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from importlib import import_module
 from subprocess import PIPE, Popen
 
@@ -105,6 +108,136 @@ class DelayedResource(LeafResource):
         request.finish()
 
 
+@lru_cache(maxsize=8)
+def _sized_html(size):
+    line = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n"
+    return "<html><body>" + line * (size // len(line)) + "</body></html>"
+
+
+@lru_cache(maxsize=8)
+def _sized_base64(size, *, binary):
+    body = b"\x01" * size if binary else _sized_html(size).encode()
+    return b64encode(body).decode()
+
+
+class SizedResource(LeafResource):
+    """Returns a body of the requested ``size``, in bytes, as
+    ``httpResponseBody`` or ``browserHtml``.
+
+    ``httpResponseBody`` is HTML, unless ``binary`` is true.
+
+    If ``chunked`` is true, the response has no Content-Length header.
+
+    If ``delay`` is set, the response is sent after that many seconds.
+
+    If ``status`` is set, an error response with that HTTP status code is sent
+    instead, with a ``Retry-After`` header if ``retry_after`` is set.
+
+    If ``max_concurrency`` is set, a 429 response is sent instead if more than
+    that many requests are being handled, simulating rate limiting.
+
+    If ``reject_keys`` is set, a 401 response is sent instead for requests
+    that use any of those API keys.
+
+    If ``encoding`` is set to ``"gzip"``, ``"deflate"`` or ``"br"``, and the
+    request accepts that encoding, the response is compressed with it. If
+    ``raw_deflate`` is true, deflate data has no zlib header.
+
+    Requests compressed with gzip are supported. If ``echo_content_encoding``
+    is true, the response includes the content encoding of the request as
+    ``requestContentEncoding``."""
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+
+    def render_POST(self, request):
+        content_encoding = (request.getHeader("Content-Encoding") or "").lower()
+        request_body = request.content.read()
+        if content_encoding == "gzip":
+            request_body = gzip.decompress(request_body)
+        request_data = json.loads(request_body)
+        request.responseHeaders.setRawHeaders(
+            b"Content-Type",
+            [b"application/json"],
+        )
+        max_concurrency = request_data.get("max_concurrency")
+        if max_concurrency and self.in_flight >= max_concurrency:
+            request_data["status"] = 429
+        if request.getUser().decode() in request_data.get("reject_keys", ()):
+            request_data["status"] = 401
+        self.in_flight += 1
+        request.notifyFinish().addBoth(self._finished)
+        if request_data.get("status"):
+            request.setResponseCode(request_data["status"])
+            if request_data.get("retry_after") is not None:
+                request.responseHeaders.setRawHeaders(
+                    b"Retry-After", [str(request_data["retry_after"]).encode()]
+                )
+            response_data = {
+                "type": "/download/error",
+                "title": "Error",
+                "status": request_data["status"],
+                "detail": "Mock error.",
+            }
+        else:
+            response_data = self._response_data(request_data)
+        if request_data.get("echo_content_encoding"):
+            response_data["requestContentEncoding"] = content_encoding
+        data = self._encode(request, json.dumps(response_data).encode(), request_data)
+        delay = request_data.get("delay", 0)
+        if delay:
+            self.deferRequest(request, delay, self._write, request, data)
+            return NOT_DONE_YET
+        if request_data.get("chunked"):
+            self._write(request, data)
+            return NOT_DONE_YET
+        return data
+
+    def _response_data(self, request_data):
+        size = request_data.get("size", 0)
+        response_data = {"url": request_data["url"]}
+        if "browserHtml" in request_data:
+            response_data["browserHtml"] = _sized_html(size)
+        elif request_data.get("binary"):
+            response_data["httpResponseBody"] = _sized_base64(size, binary=True)
+            response_data["httpResponseHeaders"] = [
+                {"name": "Content-Type", "value": "application/octet-stream"}
+            ]
+        else:
+            response_data["httpResponseBody"] = _sized_base64(size, binary=False)
+            response_data["httpResponseHeaders"] = [
+                {"name": "Content-Type", "value": "text/html; charset=utf-8"}
+            ]
+        return response_data
+
+    def _encode(self, request, data, request_data):
+        encoding = request_data.get("encoding")
+        accepted = (request.getHeader("Accept-Encoding") or "").replace(" ", "")
+        if not encoding or encoding not in accepted.split(","):
+            return data
+        request.responseHeaders.setRawHeaders(b"Content-Encoding", [encoding.encode()])
+        if encoding == "br":
+            import brotli
+
+            return brotli.compress(data)
+        if encoding == "deflate":
+            # Raw deflate data lacks the zlib header.
+            wbits = (
+                -zlib.MAX_WBITS if request_data.get("raw_deflate") else zlib.MAX_WBITS
+            )
+            compressor = zlib.compressobj(wbits=wbits)
+            return compressor.compress(data) + compressor.flush()
+        return gzip.compress(data)
+
+    def _write(self, request, data):
+        request.write(data)
+        request.finish()
+
+    def _finished(self, _):
+        self.in_flight -= 1
+
+
 class MockServer:
     def __init__(self, resource=None, port=None):
         resource = resource or DefaultResource
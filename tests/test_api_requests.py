@@ -1,5 +1,8 @@
+import json
+import mmap
 import sys
-from asyncio import iscoroutine
+import zlib
+from asyncio import CancelledError, iscoroutine, sleep
 from typing import Any, Dict
 from unittest import mock
 
@@ -11,10 +14,31 @@ from scrapy.exceptions import IgnoreRequest, NotSupported
 from scrapy.http import Response, TextResponse
 from scrapy.utils.defer import deferred_from_coro
 from scrapy.utils.test import get_crawler
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_fixed,
+)
+from twisted.internet import reactor
 from twisted.internet.defer import Deferred
+from twisted.internet.error import TimeoutError
+from twisted.internet.task import Clock
+from zyte_api.aio.errors import RequestError
+
+from scrapy_zyte_api import ZyteAPIError
+from scrapy_zyte_api._compression import _get_decompressor
+from scrapy_zyte_api.responses import ZyteAPITextResponse
+from scrapy_zyte_api.signals import zyte_api_circuit_breaker_state_changed
 
-from . import DEFAULT_CLIENT_CONCURRENCY, SETTINGS
-from .mockserver import DelayedResource, MockServer, produce_request_response
+from . import DEFAULT_CLIENT_CONCURRENCY, SETTINGS, make_handler
+from .mockserver import (
+    DelayedResource,
+    MockServer,
+    SizedResource,
+    get_ephemeral_port,
+    produce_request_response,
+)
 
 
 @ensureDeferred
@@ -89,6 +113,94 @@ async def test_http_response_headers_request(meta: Dict[str, Dict[str, Any]]):
     assert resp.headers == {b"Test_Header": [b"test_value"]}
 
 
+@ensureDeferred
+async def test_raw_api_response_lazy():
+    settings = {"ZYTE_API_RAW_RESPONSE": "lazy"}
+    req, resp = await produce_request_response(
+        {"zyte_api": {"browserHtml": True}}, settings
+    )
+    assert "browserHtml" not in resp._raw_api_response
+    assert resp.raw_api_response == {
+        "url": req.url,
+        "browserHtml": "<html><body>Hello<h1>World!</h1></body></html>",
+    }
+
+
+@pytest.mark.parametrize(
+    "meta",
+    [
+        {"zyte_api": {"browserHtml": True}},
+        {"zyte_api": {"httpResponseBody": True, "httpResponseHeaders": True}},
+    ],
+)
+@ensureDeferred
+async def test_lazy_body(meta: Dict[str, Dict[str, Any]]):
+    settings = {"ZYTE_API_LAZY_BODY": True}
+    req, resp = await produce_request_response(meta, settings)
+    assert isinstance(resp, ZyteAPITextResponse)
+    assert resp._body is None
+    assert resp.text == "<html><body>Hello<h1>World!</h1></body></html>"
+    assert resp.css("h1 ::text").get() == "World!"
+
+
+@pytest.mark.parametrize(
+    "meta",
+    [
+        {"zyte_api": {"browserHtml": True}},
+        {"zyte_api": {"httpResponseBody": True}},
+    ],
+)
+@pytest.mark.parametrize(
+    "threshold,offloaded",
+    [
+        (0, False),
+        (1, True),
+        (10**6, False),
+    ],
+)
+@ensureDeferred
+async def test_offload(meta: Dict[str, Dict[str, Any]], threshold, offloaded):
+    settings = {"ZYTE_API_OFFLOAD_THRESHOLD": threshold}
+    with MockServer() as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            resp = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert resp.request is req
+    assert resp.body == b"<html><body>Hello<h1>World!</h1></body></html>"
+    for stage in ("json", "response"):
+        prefix = f"scrapy-zyte-api/offload/{stage}"
+        if offloaded:
+            assert stats[f"{prefix}/count"] == 1
+            assert stats[f"{prefix}/time"] > 0
+            assert stats[f"{prefix}/max_time"] == stats[f"{prefix}/time"]
+        else:
+            assert f"{prefix}/count" not in stats
+
+
+@pytest.mark.parametrize("backend", ["json", "orjson", "ujson"])
+@pytest.mark.parametrize("threshold", [0, 1])
+@ensureDeferred
+async def test_json_backend(backend, threshold):
+    if backend != "json":
+        pytest.importorskip(backend)
+    settings = {
+        "ZYTE_API_JSON_BACKEND": backend,
+        "ZYTE_API_OFFLOAD_THRESHOLD": threshold,
+    }
+    meta = {"zyte_api": {"browserHtml": True, "echoData": "ä/"}}
+    with MockServer() as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            loads = mock.Mock(wraps=handler._json.loads)
+            handler._json = handler._json._replace(loads=loads)
+            resp = await handler.download_request(req, None)
+
+    assert loads.call_count == 1
+    assert resp.text == "<html><body>Hello<h1>World!</h1></body></html>"
+
+
 @ensureDeferred
 @pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
 @pytest.mark.parametrize(
@@ -168,6 +280,35 @@ async def test_zyte_api_request_meta(
             assert args_used == expected
 
 
+@ensureDeferred
+async def test_default_params_not_modified():
+    settings = {"ZYTE_API_DEFAULT_PARAMS": {"browserHtml": True}}
+    async with make_handler(settings) as handler:
+        meta_params = {"geolocation": "US"}
+        req = Request("https://example.com", meta={"zyte_api": meta_params})
+        assert handler._prepare_api_params(req) == {
+            "browserHtml": True,
+            "geolocation": "US",
+        }
+        assert meta_params == {"geolocation": "US"}
+
+        # Parameters of a request do not leak into the next one.
+        req = Request("https://example.com", meta={"zyte_api": True})
+        assert handler._prepare_api_params(req) == {"browserHtml": True}
+        assert dict(handler._zyte_api_default_params) == {"browserHtml": True}
+        with pytest.raises(TypeError):
+            handler._zyte_api_default_params["geolocation"] = "US"
+
+
+@ensureDeferred
+async def test_invalid_params(caplog):
+    async with make_handler({}) as handler:
+        req = Request("https://example.com", meta={"zyte_api": ["browserHtml"]})
+        with pytest.raises(IgnoreRequest):
+            handler._prepare_api_params(req)
+    assert "should be provided as dictionary" in caplog.text
+
+
 @pytest.mark.parametrize(
     "meta",
     [
@@ -309,3 +450,1013 @@ async def test_higher_concurrency():
     assert (
         set(response_indexes[: len(expected_first_indexes)]) == expected_first_indexes
     )
+
+
+@pytest.mark.parametrize(
+    "meta",
+    [
+        {"zyte_api": {"httpResponseBody": True, "size": 1024 * 1024}},
+        {"zyte_api": {"browserHtml": True, "size": 1024 * 1024}},
+    ],
+)
+@pytest.mark.parametrize("raw_api_response_mode", ["full", "lazy", "metadata-only"])
+@pytest.mark.parametrize("max_memory_size", [1024, 10 * 1024 * 1024])
+@ensureDeferred
+async def test_streaming(meta, raw_api_response_mode, max_memory_size):
+    settings = {
+        "ZYTE_API_RAW_RESPONSE": raw_api_response_mode,
+        "ZYTE_API_STREAMING": True,
+        "ZYTE_API_STREAMING_MAX_MEMORY_SIZE": max_memory_size,
+    }
+    with MockServer(SizedResource) as server:
+        req = Request(server.urljoin("/"), meta=meta)
+        async with server.make_handler(
+            {"ZYTE_API_RAW_RESPONSE": raw_api_response_mode}
+        ) as handler:
+            expected = await handler.download_request(req, None)
+        async with server.make_handler(settings) as handler:
+            resp = await handler.download_request(req, None)
+
+    assert type(resp) is type(expected)
+    assert len(resp.body) > 1024 * 1024
+    assert resp.body == expected.body
+    assert resp.raw_api_response == expected.raw_api_response
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize(
+    "meta,spilled",
+    [
+        ({"zyte_api": {"httpResponseBody": True, "binary": True}}, True),
+        ({"zyte_api": {"httpResponseBody": True}}, False),
+        ({"zyte_api": {"browserHtml": True}}, False),
+    ],
+)
+@ensureDeferred
+async def test_mmap(meta, spilled, streaming):
+    size = 1024 * 1024
+    meta["zyte_api"]["size"] = size
+    settings = {
+        "ZYTE_API_MMAP_THRESHOLD": size,
+        "ZYTE_API_STREAMING": streaming,
+        "ZYTE_API_STREAMING_MAX_MEMORY_SIZE": 1024,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            resp = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+            assert len(resp.body) >= size
+            assert isinstance(resp.body, mmap.mmap) == spilled
+            if spilled:
+                assert resp.body[:] == b"\x01" * size
+                assert stats["scrapy-zyte-api/mmap/count"] == 1
+                assert stats["scrapy-zyte-api/mmap/bytes"] == size
+            else:
+                assert "scrapy-zyte-api/mmap/count" not in stats
+
+    if spilled:
+        # Memory maps outlive the handler.
+        assert not resp.body.closed
+        assert resp.body[:] == b"\x01" * size
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("chunked", [False, True])
+@pytest.mark.parametrize(
+    "settings,spider_kwargs,meta,exceeded",
+    [
+        ({}, {}, {}, False),
+        ({"DOWNLOAD_MAXSIZE": 100000}, {}, {}, True),
+        ({"DOWNLOAD_MAXSIZE": 100000}, {"download_maxsize": 0}, {}, False),
+        ({}, {"download_maxsize": 100000}, {}, True),
+        ({"DOWNLOAD_MAXSIZE": 100000}, {}, {"download_maxsize": 0}, False),
+        ({}, {"download_maxsize": 0}, {"download_maxsize": 100000}, True),
+    ],
+)
+@ensureDeferred
+async def test_download_maxsize(
+    settings, spider_kwargs, meta, exceeded, chunked, streaming, caplog
+):
+    settings = {**settings, "ZYTE_API_STREAMING": streaming}
+    meta = {
+        **meta,
+        "zyte_api": {"httpResponseBody": True, "size": 200000, "chunked": chunked},
+    }
+    spider = Spider("test", **spider_kwargs)
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            if exceeded:
+                with pytest.raises(IgnoreRequest):
+                    await handler.download_request(req, spider)
+            else:
+                resp = await handler.download_request(req, spider)
+                assert len(resp.body) > 100000
+            stats = handler._stats.get_stats()
+
+    if exceeded:
+        assert stats["scrapy-zyte-api/download_maxsize_exceeded"] == 1
+        assert "scrapy-zyte-api/request_count" not in stats
+        if chunked:
+            assert "Received (" in caplog.text
+        else:
+            assert "Cancelling download of " in caplog.text
+    else:
+        assert "scrapy-zyte-api/download_maxsize_exceeded" not in stats
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("size,exceeded", [(90000, False), (110000, True)])
+@ensureDeferred
+async def test_download_maxsize_body(size, exceeded, streaming, caplog):
+    settings = {"DOWNLOAD_MAXSIZE": 100000, "ZYTE_API_STREAMING": streaming}
+    # In both cases, the Zyte API response, with the body in base64, is
+    # larger than the maximum size.
+    meta = {"zyte_api": {"httpResponseBody": True, "binary": True, "size": size}}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            if exceeded:
+                with pytest.raises(IgnoreRequest):
+                    await handler.download_request(req, None)
+            else:
+                resp = await handler.download_request(req, None)
+                assert len(resp.body) == size
+            stats = handler._stats.get_stats()
+
+    # The maximum size applies to the response body.
+    assert stats["scrapy-zyte-api/request_count"] == 1
+    if exceeded:
+        assert stats["scrapy-zyte-api/download_maxsize_exceeded"] == 1
+        assert f"Response body size ({size})" in caplog.text
+    else:
+        assert "scrapy-zyte-api/download_maxsize_exceeded" not in stats
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("chunked", [False, True])
+@pytest.mark.parametrize(
+    "settings,meta,exceeded",
+    [
+        ({}, {}, False),
+        ({"DOWNLOAD_WARNSIZE": 100000}, {}, True),
+        ({"DOWNLOAD_WARNSIZE": 100000}, {"download_warnsize": 0}, False),
+        ({}, {"download_warnsize": 100000}, True),
+    ],
+)
+@ensureDeferred
+async def test_download_warnsize(settings, meta, exceeded, chunked, streaming, caplog):
+    settings = {**settings, "ZYTE_API_STREAMING": streaming}
+    meta = {
+        **meta,
+        "zyte_api": {"httpResponseBody": True, "size": 200000, "chunked": chunked},
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            resp = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert len(resp.body) > 100000
+    if exceeded:
+        assert stats["scrapy-zyte-api/download_warnsize_exceeded"] == 1
+        assert caplog.text.count("download warn size (100000)") == 1
+    else:
+        assert "scrapy-zyte-api/download_warnsize_exceeded" not in stats
+        assert "download warn size" not in caplog.text
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize(
+    "meta,stages",
+    [
+        (
+            {"zyte_api": {"httpResponseBody": True}},
+            {"params", "connection", "api", "json", "base64", "response"},
+        ),
+        (
+            {"zyte_api": {"browserHtml": True}},
+            {"params", "connection", "api", "json", "response"},
+        ),
+    ],
+)
+@ensureDeferred
+async def test_timing_stats(meta, stages, streaming):
+    settings = {"ZYTE_API_TIMING_STATS": True, "ZYTE_API_STREAMING": streaming}
+    with MockServer() as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta=meta)
+            await handler.download_request(req, None)
+            await handler.download_request(req, None)
+            handler._spider_closed(None)
+            stats = handler._stats.get_stats()
+
+    recorded = {key.split("/")[2] for key in stats if key.endswith("/histogram")}
+    assert recorded == stages
+    for stage in stages:
+        prefix = f"scrapy-zyte-api/timing/{stage}"
+        assert sum(stats[f"{prefix}/histogram"].values()) == 2
+        assert 0 < stats[f"{prefix}/p50"] <= stats[f"{prefix}/p99"]
+
+
+@ensureDeferred
+async def test_timing_stats_disabled():
+    with MockServer() as server:
+        async with server.make_handler() as handler:
+            req = Request(server.urljoin("/"), meta={"zyte_api": {"browserHtml": True}})
+            await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert not any(key.startswith("scrapy-zyte-api/timing/") for key in stats)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize(
+    "params,field",
+    [
+        ({"httpResponseBody": True, "size": 1000}, "httpResponseBody"),
+        ({"browserHtml": True, "size": 1000}, "browserHtml"),
+        ({"httpResponseBody": True, "size": 10, "binary": True}, "httpResponseBody"),
+    ],
+)
+@ensureDeferred
+async def test_outcome_stats(params, field, streaming):
+    settings = {"ZYTE_API_STREAMING": streaming}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request("https://example.com/a", meta={"zyte_api": params})
+            resp = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/attempts"] == 1
+    assert "scrapy-zyte-api/retries" not in stats
+    assert stats["scrapy-zyte-api/status_codes/200"] == 1
+    assert stats["scrapy-zyte-api/bytes/encoded"] == len(
+        json.dumps(resp.raw_api_response)
+    )
+    assert stats["scrapy-zyte-api/bytes/decoded"] == len(resp.body)
+    assert stats[f"scrapy-zyte-api/response_count/{field}"] == 1
+    assert "scrapy-zyte-api/error_count" not in stats
+    assert not any("/domain/" in key for key in stats)
+
+
+@ensureDeferred
+async def test_outcome_stats_domain():
+    settings = {"ZYTE_API_DOMAIN_STATS": True}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            for url in (
+                "https://a.example",
+                "https://a.example/b",
+                "https://b.example",
+            ):
+                req = Request(url, meta={"zyte_api": {"browserHtml": True}})
+                await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/response_count/domain/a.example"] == 2
+    assert stats["scrapy-zyte-api/response_count/domain/b.example"] == 1
+
+
+@ensureDeferred
+async def test_outcome_stats_error_status():
+    retry_policy = AsyncRetrying(
+        retry=retry_if_exception_type(RequestError),
+        stop=stop_after_attempt(3),
+        reraise=True,
+    )
+    meta = {
+        "zyte_api": {"browserHtml": True, "status": 500},
+        "zyte_api_retry_policy": retry_policy,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler() as handler:
+            req = Request("https://example.com", meta=meta)
+            with pytest.raises(IgnoreRequest):
+                await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/attempts"] == 3
+    assert stats["scrapy-zyte-api/retries"] == 2
+    assert stats["scrapy-zyte-api/status_codes/500"] == 3
+    assert stats["scrapy-zyte-api/error_count"] == 1
+    assert stats["scrapy-zyte-api/error/status/500"] == 1
+    assert stats["scrapy-zyte-api/bytes/encoded"] > 0
+    assert "scrapy-zyte-api/request_count" not in stats
+
+
+@ensureDeferred
+async def test_outcome_stats_error_exception():
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    meta = {"zyte_api": {"browserHtml": True}, "zyte_api_retry_policy": retry_policy}
+    async with make_handler({}, f"http://127.0.0.1:{get_ephemeral_port()}/") as handler:
+        req = Request("https://example.com", meta=meta)
+        with pytest.raises(IgnoreRequest):
+            await handler.download_request(req, None)
+        stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/attempts"] == 1
+    assert stats["scrapy-zyte-api/error_count"] == 1
+    assert (
+        stats[
+            "scrapy-zyte-api/error/exception/"
+            "aiohttp.client_exceptions.ClientConnectorError"
+        ]
+        == 1
+    )
+    assert not any("/status_codes/" in key for key in stats)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("maxsize", [0, 10**9])
+@pytest.mark.parametrize(
+    "encoding,raw_deflate",
+    [("gzip", False), ("deflate", False), ("deflate", True), ("br", False)],
+)
+@ensureDeferred
+async def test_compression(encoding, raw_deflate, maxsize, streaming):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    settings = {"ZYTE_API_STREAMING": streaming, "DOWNLOAD_MAXSIZE": maxsize}
+    params = {
+        "httpResponseBody": True,
+        "size": 100000,
+        "encoding": encoding,
+        "raw_deflate": raw_deflate,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta={"zyte_api": params})
+            resp = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert resp.body.startswith(b"<html><body><p>Lorem ipsum")
+    assert resp.body.endswith(b"</body></html>")
+    encoded_size = len(json.dumps(resp.raw_api_response))
+    assert stats["scrapy-zyte-api/bytes/encoded"] == encoded_size
+    assert 0 < stats["scrapy-zyte-api/bytes/wire"] < encoded_size / 10
+    assert stats["scrapy-zyte-api/bytes/decoded"] == len(resp.body)
+
+
+@pytest.mark.parametrize("wbits", [zlib.MAX_WBITS, -zlib.MAX_WBITS])
+def test_deflate_chunks(wbits):
+    compressor = zlib.compressobj(wbits=wbits)
+    data = compressor.compress(b"a" * 1000) + compressor.flush()
+    decompressor = _get_decompressor("deflate")
+    # The first chunk is too short to tell raw deflate data from zlib data.
+    output = b"".join(
+        decompressor.decompress(chunk) for chunk in (data[:1], data[1:3], data[3:])
+    )
+    assert output == b"a" * 1000
+
+
+@ensureDeferred
+async def test_compression_disabled():
+    settings = {"ZYTE_API_COMPRESSION": False}
+    params = {"httpResponseBody": True, "size": 100000, "encoding": "gzip"}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta={"zyte_api": params})
+            await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/bytes/wire"] == stats["scrapy-zyte-api/bytes/encoded"]
+
+
+@pytest.mark.parametrize(
+    "min_size,expected",
+    [
+        (0, ""),
+        (1, "gzip"),
+        (10**6, ""),
+    ],
+)
+@ensureDeferred
+async def test_request_compression(min_size, expected):
+    settings = {"ZYTE_API_REQUEST_COMPRESSION_MIN_SIZE": min_size}
+    params = {"browserHtml": True, "echo_content_encoding": True}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(server.urljoin("/"), meta={"zyte_api": params})
+            resp = await handler.download_request(req, None)
+
+    assert resp.raw_api_response["requestContentEncoding"] == expected
+
+
+@pytest.mark.parametrize(
+    "params,status,retry_after,retryable",
+    [
+        ({"status": 503, "retry_after": 7}, 503, 7.0, True),
+        ({"status": 429}, 429, None, True),
+        ({"status": 400, "retry_after": 7}, 400, 7.0, False),
+        (
+            {"status": 520, "retry_after": "Wed, 21 Oct 2015 07:28:00 GMT"},
+            520,
+            None,
+            True,
+        ),
+    ],
+)
+@ensureDeferred
+async def test_error_details(params, status, retry_after, retryable):
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    meta = {
+        "zyte_api": {"browserHtml": True, **params},
+        "zyte_api_retry_policy": retry_policy,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler() as handler:
+            req = Request("https://example.com", meta=meta)
+            with pytest.raises(ZyteAPIError) as exc_info:
+                await handler.download_request(req, None)
+
+    error = exc_info.value
+    assert isinstance(error, IgnoreRequest)
+    assert error.status == status
+    assert error.retry_after == retry_after
+    assert error.retryable is retryable
+    assert isinstance(error.__cause__, RequestError)
+
+
+@ensureDeferred
+async def test_error_details_exception():
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    meta = {"zyte_api": {"browserHtml": True}, "zyte_api_retry_policy": retry_policy}
+    async with make_handler({}, f"http://127.0.0.1:{get_ephemeral_port()}/") as handler:
+        req = Request("https://example.com", meta=meta)
+        with pytest.raises(ZyteAPIError) as exc_info:
+            await handler.download_request(req, None)
+
+    error = exc_info.value
+    assert error.status is None
+    assert error.retry_after is None
+    assert error.retryable is True
+
+
+@ensureDeferred
+async def test_circuit_breaker():
+    settings = {
+        "ZYTE_API_CIRCUIT_BREAKER_ENABLED": True,
+        "ZYTE_API_CIRCUIT_BREAKER_WINDOW": 2,
+        "ZYTE_API_CIRCUIT_BREAKER_FAILURE_RATE": 1,
+        "ZYTE_API_CIRCUIT_BREAKER_COOLDOWN": 0.2,
+    }
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    states = []
+
+    def state_changed(state):
+        states.append(state)
+
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            handler._crawler.signals.connect(
+                state_changed, signal=zyte_api_circuit_breaker_state_changed
+            )
+
+            async def download(params):
+                meta = {"zyte_api": params, "zyte_api_retry_policy": retry_policy}
+                request = Request("https://example.com", meta=meta)
+                return await handler.download_request(request, None)
+
+            for _ in range(2):
+                with pytest.raises(ZyteAPIError) as exc_info:
+                    await download({"browserHtml": True, "status": 503})
+                assert exc_info.value.status == 503
+            assert states == ["open"]
+
+            # Requests fail fast while the circuit is open.
+            with pytest.raises(ZyteAPIError) as exc_info:
+                await download({"browserHtml": True})
+            error = exc_info.value
+            assert error.status is None
+            assert 0 < error.retry_after <= 0.2
+            assert error.retryable is True
+            assert handler._stats.get_value("scrapy-zyte-api/attempts") == 2
+
+            await deferred_from_coro(sleep(0.2))
+            response = await download({"browserHtml": True})
+            assert isinstance(response, ZyteAPITextResponse)
+            assert states == ["open", "half-open", "closed"]
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/attempts"] == 3
+    assert stats["scrapy-zyte-api/error_count"] == 2
+    assert stats["scrapy-zyte-api/circuit_breaker/open"] == 1
+    assert stats["scrapy-zyte-api/circuit_breaker/rejected"] == 1
+
+
+@ensureDeferred
+async def test_circuit_breaker_cancelled_probe():
+    settings = {
+        "ZYTE_API_CIRCUIT_BREAKER_ENABLED": True,
+        "ZYTE_API_CIRCUIT_BREAKER_WINDOW": 1,
+        "ZYTE_API_CIRCUIT_BREAKER_FAILURE_RATE": 1,
+        "ZYTE_API_CIRCUIT_BREAKER_COOLDOWN": 0.1,
+        "ZYTE_API_RATE_LIMIT": 0.1,
+    }
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            meta = {
+                "zyte_api": {"browserHtml": True, "status": 503},
+                "zyte_api_retry_policy": retry_policy,
+            }
+            request = Request("https://example.com", meta=meta)
+            with pytest.raises(ZyteAPIError):
+                await handler.download_request(request, None)
+            await deferred_from_coro(sleep(0.1))
+
+            # The circuit breaker allows a probe before the rate limit is
+            # waited for, and gets it back if the wait is cancelled.
+            deferred = handler.download_request(request, None)
+            await deferred_from_coro(sleep(0.1))
+            assert handler._circuit_breaker._probes_in_flight == 1
+            deferred.cancel()
+            with pytest.raises(CancelledError):
+                await deferred
+            assert handler._circuit_breaker._probes_in_flight == 0
+            assert handler._stats.get_value("scrapy-zyte-api/attempts") == 1
+
+
+async def _download_concurrently(handler, count, params, retry_policy):
+    meta = {"zyte_api": params, "zyte_api_retry_policy": retry_policy}
+    deferreds = [
+        handler.download_request(
+            Request(f"https://example.com/{index}", meta=meta), None
+        )
+        for index in range(count)
+    ]
+    return [await deferred for deferred in deferreds]
+
+
+@ensureDeferred
+async def test_throttle_gate():
+    settings = {
+        "ZYTE_API_THROTTLE_GATE_ENABLED": True,
+        "ZYTE_API_THROTTLE_GATE_RELEASE_RATE": 10,
+    }
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            meta = {
+                "zyte_api": {"browserHtml": True, "status": 429, "retry_after": 0.3},
+                "zyte_api_retry_policy": retry_policy,
+            }
+            with pytest.raises(ZyteAPIError):
+                await handler.download_request(
+                    Request("https://example.com", meta=meta), None
+                )
+            responses = await _download_concurrently(
+                handler, 3, {"browserHtml": True}, retry_policy
+            )
+            stats = handler._stats.get_stats()
+
+    assert all(isinstance(response, ZyteAPITextResponse) for response in responses)
+    assert stats["scrapy-zyte-api/throttle/paused"] == 1
+    assert stats["scrapy-zyte-api/throttle/delayed"] == 3
+    # Requests wait for the end of the pause, and are then released one
+    # every 0.1 seconds, i.e. they wait for d, d + 0.1 and d + 0.2 seconds.
+    total = stats["scrapy-zyte-api/throttle/wait_time"]
+    longest = stats["scrapy-zyte-api/throttle/max_wait_time"]
+    assert longest <= 0.5
+    assert longest - total / 3 == pytest.approx(0.1, abs=0.01)
+
+
+@ensureDeferred
+async def test_adaptive_concurrency_rate_limited():
+    retry_policy = AsyncRetrying(
+        retry=retry_if_exception_type(RequestError),
+        wait=wait_fixed(0.01),
+        stop=stop_after_attempt(100),
+        reraise=True,
+    )
+    params = {"browserHtml": True, "delay": 0.05, "max_concurrency": 4}
+    settings = {
+        "ZYTE_API_ADAPTIVE_CONCURRENCY": True,
+        "ZYTE_API_ADAPTIVE_CONCURRENCY_MAX": 16,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            responses = await _download_concurrently(handler, 40, params, retry_policy)
+            stats = handler._stats.get_stats()
+
+    assert len(responses) == 40
+    assert stats["scrapy-zyte-api/request_count"] == 40
+    assert stats["scrapy-zyte-api/concurrency/decreases"] >= 1
+    assert 1 <= stats["scrapy-zyte-api/concurrency/limit"] <= 16
+    assert stats["scrapy-zyte-api/concurrency/max_limit"] > 4
+    # Without adaptive concurrency, thousands of requests are rate-limited.
+    assert stats["scrapy-zyte-api/status_codes/429"] < 80
+
+
+@ensureDeferred
+async def test_adaptive_concurrency_ceiling():
+    params = {"browserHtml": True, "delay": 0.05}
+    settings = {
+        "ZYTE_API_ADAPTIVE_CONCURRENCY": True,
+        "ZYTE_API_ADAPTIVE_CONCURRENCY_MIN": 2,
+        "ZYTE_API_ADAPTIVE_CONCURRENCY_MAX": 3,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            await _download_concurrently(handler, 10, params, None)
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/concurrency/limit"] == 3
+    assert stats["scrapy-zyte-api/concurrency/max_limit"] == 3
+    assert "scrapy-zyte-api/concurrency/decreases" not in stats
+
+
+@ensureDeferred
+async def test_adaptive_concurrency_retry_wait():
+    """Attempts do not hold a concurrency slot while they wait to be
+    retried."""
+    retry_policy = AsyncRetrying(
+        retry=retry_if_exception_type(RequestError),
+        wait=wait_fixed(60),
+        reraise=True,
+    )
+    settings = {
+        "ZYTE_API_ADAPTIVE_CONCURRENCY": True,
+        "ZYTE_API_ADAPTIVE_CONCURRENCY_MAX": 1,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            meta = {
+                "zyte_api": {"browserHtml": True, "status": 500},
+                "zyte_api_retry_policy": retry_policy,
+            }
+            retried = handler.download_request(
+                Request("https://example.com/retried", meta=meta), None
+            )
+            meta = {"zyte_api": {"browserHtml": True}}
+            response = await handler.download_request(
+                Request("https://example.com", meta=meta), None
+            )
+            assert response.status == 200
+            assert not retried.called
+            assert handler._concurrency.in_flight == 0
+            retried.cancel()
+            with pytest.raises(CancelledError):
+                await retried
+
+
+@ensureDeferred
+async def test_rate_limit():
+    settings = {"ZYTE_API_RATE_LIMIT": 20, "ZYTE_API_RATE_LIMIT_PER_DOMAIN": 10}
+    params = {"browserHtml": True}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            meta = {"zyte_api": params}
+            deferreds = [
+                handler.download_request(
+                    Request(f"https://{domain}.example/{index}", meta=meta), None
+                )
+                for domain in "abc"
+                for index in range(12)
+            ]
+            for deferred in deferreds:
+                await deferred
+            stats = handler._stats.get_stats()
+
+    # 10 requests per domain fit in the per-domain bursts, and 20 of those in
+    # the global burst.
+    assert stats["scrapy-zyte-api/request_count"] == 36
+    assert stats["scrapy-zyte-api/rate_limit/delayed"] == 16
+    assert stats["scrapy-zyte-api/rate_limit/max_wait_time"] > 0.5
+
+
+@ensureDeferred
+async def test_rate_limit_download_timeout():
+    settings = {"ZYTE_API_RATE_LIMIT": 4}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            meta = {"zyte_api": {"browserHtml": True}, "download_timeout": 0.5}
+            deferreds = [
+                handler.download_request(
+                    Request(f"https://example.com/{index}", meta=meta), None
+                )
+                for index in range(8)
+            ]
+            for deferred in deferreds:
+                await deferred
+            stats = handler._stats.get_stats()
+
+    # Waiting for the rate limit does not count towards the download timeout.
+    assert stats["scrapy-zyte-api/rate_limit/max_wait_time"] > 0.5
+    assert "scrapy-zyte-api/download_timeout_exceeded" not in stats
+
+
+@ensureDeferred
+async def test_retry_delay():
+    with MockServer(SizedResource) as server:
+        async with server.make_handler() as handler:
+            meta = {
+                "zyte_api": {"browserHtml": True},
+                "download_timeout": 0.2,
+                "_zyte_api_retry_at": 1000.5,
+            }
+            with mock.patch(
+                "scrapy_zyte_api.handler.time", return_value=1000.0
+            ), mock.patch(
+                "scrapy_zyte_api.handler.asyncio.sleep", wraps=sleep
+            ) as sleep_mock:
+                response = await handler.download_request(
+                    Request("https://example.com", meta=meta), None
+                )
+            stats = handler._stats.get_stats()
+
+    # Retries wait for their delay before being sent, which does not count
+    # towards the download timeout.
+    assert response.status == 200
+    sleep_mock.assert_any_call(0.5)
+    assert "scrapy-zyte-api/download_timeout_exceeded" not in stats
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "params,settings",
+    [
+        ({"browserHtml": True}, {}),
+        ({"httpResponseBody": True}, {}),
+        ({"httpResponseBody": True, "binary": True}, {"ZYTE_API_STREAMING": True}),
+    ],
+)
+async def test_cache(params, settings, tmp_path):
+    settings = {
+        **settings,
+        "ZYTE_API_CACHE_ENABLED": True,
+        "ZYTE_API_CACHE_DIR": str(tmp_path),
+    }
+    params = {**params, "size": 1000}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request("https://example.com", meta={"zyte_api": params})
+            resp1 = await handler.download_request(req, None)
+            resp2 = await handler.download_request(req, None)
+            req = Request(
+                "https://example.com", meta={"zyte_api": params, "dont_cache": True}
+            )
+            resp3 = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    assert "cached" not in resp1.flags
+    assert "cached" in resp2.flags
+    assert "cached" not in resp3.flags
+    assert type(resp2) is type(resp1)
+    assert resp2.body == resp1.body
+    assert resp2.headers == resp1.headers
+    assert resp2.raw_api_response == resp1.raw_api_response
+    assert stats["scrapy-zyte-api/request_count"] == 2
+    assert stats["scrapy-zyte-api/cache/miss"] == 1
+    assert stats["scrapy-zyte-api/cache/hit"] == 1
+    assert stats["scrapy-zyte-api/cache/store"] == 1
+    assert stats["scrapy-zyte-api/offload/cache/count"] == 3
+
+
+@ensureDeferred
+async def test_cache_size_limits(tmp_path):
+    settings = {"ZYTE_API_CACHE_ENABLED": True, "ZYTE_API_CACHE_DIR": str(tmp_path)}
+    params = {"httpResponseBody": True, "size": 1000}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request("https://example.com", meta={"zyte_api": params})
+            await handler.download_request(req, None)
+            req = Request(
+                "https://example.com",
+                meta={"zyte_api": params, "download_maxsize": 500},
+            )
+            with pytest.raises(IgnoreRequest):
+                await handler.download_request(req, None)
+            req = Request(
+                "https://example.com",
+                meta={"zyte_api": params, "download_warnsize": 500},
+            )
+            response = await handler.download_request(req, None)
+            stats = handler._stats.get_stats()
+
+    # Cached responses are subject to download size limits as well.
+    assert "cached" in response.flags
+    assert stats["scrapy-zyte-api/request_count"] == 1
+    assert stats["scrapy-zyte-api/cache/hit"] == 2
+    assert stats["scrapy-zyte-api/download_maxsize_exceeded"] == 1
+    assert stats["scrapy-zyte-api/download_warnsize_exceeded"] == 1
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "params,settings",
+    [
+        ({"browserHtml": True}, {}),
+        ({"httpResponseBody": True}, {}),
+        (
+            {"httpResponseBody": True, "binary": True},
+            {
+                "ZYTE_API_STREAMING": True,
+                "ZYTE_API_STREAMING_MAX_MEMORY_SIZE": 100,
+                "ZYTE_API_MMAP_THRESHOLD": 100,
+            },
+        ),
+    ],
+)
+async def test_coalesce(params, settings):
+    settings = {**settings, "ZYTE_API_COALESCE": True}
+    params = {**params, "size": 1000, "delay": 0.1}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            requests = [
+                Request("https://example.com", meta={"zyte_api": params}),
+                Request("https://example.com", meta={"zyte_api": params}),
+                Request("https://example.com/other", meta={"zyte_api": params}),
+            ]
+            deferreds = [handler.download_request(req, None) for req in requests]
+            responses = [await deferred for deferred in deferreds]
+            # Memory-mapped bodies are closed with the handler.
+            bodies = [response.body[:] for response in responses]
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/request_count"] == 2
+    assert stats["scrapy-zyte-api/coalesced"] == 1
+    for request, response in zip(requests, responses):
+        assert response.request is request
+    assert responses[0] is not responses[1]
+    assert len(bodies[0]) > 900
+    assert bodies[0] == bodies[1]
+    assert responses[0]._raw_api_response is not responses[1]._raw_api_response
+
+
+@ensureDeferred
+async def test_coalesce_disabled():
+    params = {"browserHtml": True, "delay": 0.1}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler() as handler:
+            deferreds = [
+                handler.download_request(
+                    Request("https://example.com", meta={"zyte_api": params}), None
+                )
+                for _ in range(2)
+            ]
+            for deferred in deferreds:
+                await deferred
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/request_count"] == 2
+    assert "scrapy-zyte-api/coalesced" not in stats
+
+
+@ensureDeferred
+async def test_api_keys():
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    settings = {
+        "ZYTE_API_KEYS": ["key-a", "key-b", "key-c"],
+        "ZYTE_API_KEY_EJECTION_ERRORS": 2,
+    }
+    meta = {
+        "zyte_api": {"browserHtml": True, "reject_keys": ["key-b"]},
+        "zyte_api_retry_policy": retry_policy,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            failures = 0
+            for index in range(12):
+                req = Request(f"https://example.com/{index}", meta=meta)
+                try:
+                    await handler.download_request(req, None)
+                except IgnoreRequest:
+                    failures += 1
+            stats = handler._stats.get_stats()
+            prefixes = {
+                key.client.api_key[-1]: f"scrapy-zyte-api/keys/{key.label}"
+                for key in handler._key_pool.keys
+            }
+
+    assert failures == 2
+    assert stats[f"{prefixes['b']}/requests"] == 2
+    assert stats[f"{prefixes['b']}/errors"] == 2
+    assert stats[f"{prefixes['b']}/ejections"] == 1
+    assert stats[f"{prefixes['a']}/requests"] == 5
+    assert stats[f"{prefixes['c']}/requests"] == 5
+    assert f"{prefixes['a']}/errors" not in stats
+
+
+@ensureDeferred
+async def test_cancel():
+    settings = {
+        "ZYTE_API_ADAPTIVE_CONCURRENCY": True,
+        "ZYTE_API_ADAPTIVE_CONCURRENCY_MAX": 1,
+    }
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request(
+                "https://example.com/slow",
+                meta={"zyte_api": {"browserHtml": True, "delay": 10}},
+            )
+            deferred = handler.download_request(req, None)
+            await deferred_from_coro(sleep(0.5))
+            assert handler._concurrency.in_flight == 1
+            deferred.cancel()
+            with pytest.raises(CancelledError):
+                await deferred
+            assert not handler._tasks
+            # The concurrency slot of the cancelled request is free, so the
+            # next request does not wait for the slow one to finish.
+            assert handler._concurrency.in_flight == 0
+            req = Request(
+                "https://example.com",
+                meta={"zyte_api": {"browserHtml": True}, "download_timeout": 5},
+            )
+            response = await handler.download_request(req, None)
+            assert response.status == 200
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/cancelled"] == 1
+    assert stats["scrapy-zyte-api/request_count"] == 1
+
+
+@pytest.mark.parametrize(
+    "settings,spider_kwargs,meta",
+    [
+        ({"DOWNLOAD_TIMEOUT": 1}, {}, {}),
+        ({}, {"download_timeout": 1}, {}),
+        ({"DOWNLOAD_TIMEOUT": 60}, {}, {"download_timeout": 1}),
+    ],
+)
+@ensureDeferred
+async def test_download_timeout(settings, spider_kwargs, meta):
+    # Retries never stop, but the download timeout applies to all of them.
+    failed_attempts = []
+    retry_policy = AsyncRetrying(
+        retry=retry_if_exception_type(RequestError),
+        wait=wait_fixed(0.1),
+        after=failed_attempts.append,
+        reraise=True,
+    )
+    meta = {
+        **meta,
+        "zyte_api": {"browserHtml": True, "status": 503},
+        "zyte_api_retry_policy": retry_policy,
+    }
+    spider = Spider("test", **spider_kwargs)
+    clock = Clock()
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            with mock.patch.object(reactor, "callLater", clock.callLater):
+                req = Request("https://example.com", meta=meta)
+                deferred = handler.download_request(req, spider)
+            while len(failed_attempts) < 2:
+                await deferred_from_coro(sleep(0.1))
+            clock.advance(0.999)
+            assert not deferred.called
+            clock.advance(0.001)
+            with pytest.raises(TimeoutError):
+                await deferred
+            assert not handler._tasks
+            stats = handler._stats.get_stats()
+
+    assert stats["scrapy-zyte-api/attempts"] > 1
+    assert stats["scrapy-zyte-api/download_timeout_exceeded"] == 1
+
+
+@pytest.mark.parametrize(
+    "enabled,slot_attribute", [(True, "slot"), (True, "_slot"), (False, "slot")]
+)
+@ensureDeferred
+async def test_cancel_on_close(enabled, slot_attribute):
+    settings = {"ZYTE_API_CANCEL_ON_CLOSE": enabled}
+    params = {"browserHtml": True, "delay": 3}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            req = Request("https://example.com", meta={"zyte_api": params})
+            deferred = handler.download_request(req, None)
+            # Simulate the engine starting to close the spider.
+            engine = mock.Mock(spec=[slot_attribute])
+            setattr(engine, slot_attribute, mock.Mock(closing=Deferred()))
+            handler._crawler.engine = engine
+            if enabled:
+                # The request is cancelled before the server responds.
+                with pytest.raises(IgnoreRequest):
+                    await deferred
+            else:
+                response = await deferred
+                assert response.status == 200
+            stats = handler._stats.get_stats()
+
+    if enabled:
+        assert stats["scrapy-zyte-api/cancelled"] == 1
+        assert "scrapy-zyte-api/request_count" not in stats
+    else:
+        assert "scrapy-zyte-api/cancelled" not in stats
+        assert stats["scrapy-zyte-api/request_count"] == 1
+
+
+@ensureDeferred
+async def test_cancel_on_close_unsupported(caplog):
+    settings = {"ZYTE_API_CANCEL_ON_CLOSE": True}
+    with MockServer(SizedResource) as server:
+        async with server.make_handler(settings) as handler:
+            # An engine without a known slot attribute.
+            handler._crawler.engine = mock.Mock(spec=[])
+            handler._cancel_if_closing()
+            assert not handler._close_check.running
+    assert "ZYTE_API_CANCEL_ON_CLOSE is not supported" in caplog.text
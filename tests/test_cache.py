@@ -0,0 +1,124 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from unittest import mock
+
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._cache import _cache_key, _dump_api_response, _ResponseCache
+from scrapy_zyte_api.responses import _DecodedBody
+
+
+def test_cache_key():
+    key = _cache_key({"url": "https://example.com", "browserHtml": True})
+    assert key == _cache_key({"browserHtml": True, "url": "https://example.com"})
+    assert key == _cache_key(
+        {"url": "https://example.com", "browserHtml": True, "jobId": "1/2/3"}
+    )
+    assert key != _cache_key({"url": "https://example.com", "httpResponseBody": True})
+    assert key != _cache_key(
+        {"url": "https://example.com", "browserHtml": True, "geolocation": "US"}
+    )
+
+
+def test_dump_api_response():
+    api_response = {"url": "https://example.com", "httpResponseBody": "SGVsbG8="}
+    assert json.loads(_dump_api_response(api_response, json.dumps)) == api_response
+
+    for value in (b"Hello", BytesIO(b"Hello")):
+        decoded_response = {
+            "url": "https://example.com",
+            "httpResponseBody": _DecodedBody(value, 5),
+        }
+        data = _dump_api_response(decoded_response, json.dumps)
+        assert json.loads(data) == api_response
+    assert value.read() == b"Hello"
+
+
+def test_get_set(tmp_path):
+    stats = MemoryStatsCollector(get_crawler())
+    cache = _ResponseCache(
+        path=str(tmp_path),
+        expiration=0,
+        max_size=0,
+        stats=stats,
+    )
+    assert cache.get("a") is None
+    cache.set("a", b"1")
+    assert cache.get("a") == b"1"
+    cache.set("a", b"22")
+    assert cache.get("a") == b"22"
+    cache.close()
+    assert stats.get_value("scrapy-zyte-api/cache/miss") == 1
+    assert stats.get_value("scrapy-zyte-api/cache/hit") == 2
+    assert stats.get_value("scrapy-zyte-api/cache/store") == 2
+
+    cache = _ResponseCache(
+        path=str(tmp_path),
+        expiration=0,
+        max_size=0,
+        stats=stats,
+    )
+    # Responses can be read from other threads.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(cache.get, "a").result() == b"22"
+    assert cache._size == 2
+    assert cache._db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    cache.close()
+
+
+def test_expiration(tmp_path):
+    stats = MemoryStatsCollector(get_crawler())
+    cache = _ResponseCache(
+        path=str(tmp_path),
+        expiration=60,
+        max_size=0,
+        stats=stats,
+    )
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1000.0):
+        cache.set("a", b"1")
+        cache.set("b", b"2")
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1059.0):
+        assert cache.get("a") == b"1"
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1061.0):
+        assert cache.get("a") is None
+    assert stats.get_value("scrapy-zyte-api/cache/expired") == 1
+    assert cache._size == 1
+    cache.close()
+
+    # Expired responses are removed on startup.
+    stats = MemoryStatsCollector(get_crawler())
+    cache = _ResponseCache(
+        path=str(tmp_path),
+        expiration=60,
+        max_size=0,
+        stats=stats,
+    )
+    assert stats.get_value("scrapy-zyte-api/cache/expired") == 1
+    assert cache._size == 0
+    cache.close()
+
+
+def test_eviction(tmp_path):
+    stats = MemoryStatsCollector(get_crawler())
+    cache = _ResponseCache(
+        path=str(tmp_path),
+        expiration=0,
+        max_size=10,
+        stats=stats,
+    )
+    with mock.patch("scrapy_zyte_api._cache.time", side_effect=range(100)):
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        assert cache.get("a") == b"1234"
+        cache.set("c", b"1234")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"1234"
+        assert cache.get("c") == b"1234"
+        # Responses larger than the maximum size are not stored.
+        cache.set("d", b"12345678901")
+        assert cache.get("d") is None
+    assert cache._size == 8
+    assert stats.get_value("scrapy-zyte-api/cache/evicted") == 1
+    cache.close()
@@ -0,0 +1,123 @@
+from unittest import mock
+
+import pytest
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._circuit_breaker import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    _CircuitBreaker,
+    _CircuitOpen,
+)
+
+
+def _record(circuit_breaker, outcomes):
+    for failed in outcomes:
+        circuit_breaker.record(failed, probe=circuit_breaker.check())
+
+
+def test_window():
+    stats = MemoryStatsCollector(get_crawler())
+    states = []
+    circuit_breaker = _CircuitBreaker(
+        window=4,
+        failure_rate=0.5,
+        cooldown=10,
+        probes=1,
+        stats=stats,
+        on_state_change=states.append,
+    )
+    # The failure rate is only evaluated once the window is full, and
+    # cancellations do not count.
+    _record(circuit_breaker, [True, None, True])
+    assert circuit_breaker.state == CIRCUIT_CLOSED
+    _record(circuit_breaker, [False, False])
+    assert circuit_breaker.state == CIRCUIT_OPEN
+    stats = MemoryStatsCollector(get_crawler())
+    states = []
+    circuit_breaker = _CircuitBreaker(
+        window=4,
+        failure_rate=0.5,
+        cooldown=10,
+        probes=1,
+        stats=stats,
+        on_state_change=states.append,
+    )
+    # Old outcomes leave the window.
+    _record(circuit_breaker, [True, False, False, False, True])
+    assert circuit_breaker.state == CIRCUIT_CLOSED
+    with mock.patch("scrapy_zyte_api._circuit_breaker.perf_counter", return_value=0):
+        _record(circuit_breaker, [True])
+    assert circuit_breaker.state == CIRCUIT_OPEN
+    assert states == [CIRCUIT_OPEN]
+    assert stats.get_value("scrapy-zyte-api/circuit_breaker/open") == 1
+
+    with mock.patch("scrapy_zyte_api._circuit_breaker.perf_counter", return_value=4):
+        with pytest.raises(_CircuitOpen) as exc_info:
+            circuit_breaker.check()
+    assert exc_info.value.retry_after == 6
+    assert stats.get_value("scrapy-zyte-api/circuit_breaker/rejected") == 1
+
+
+def test_half_open():
+    stats = MemoryStatsCollector(get_crawler())
+    states = []
+    circuit_breaker = _CircuitBreaker(
+        window=1,
+        failure_rate=0.5,
+        cooldown=10,
+        probes=2,
+        stats=stats,
+        on_state_change=states.append,
+    )
+    with mock.patch("scrapy_zyte_api._circuit_breaker.perf_counter", return_value=0):
+        _record(circuit_breaker, [True])
+    # Attempts sent before the circuit opened do not count.
+    circuit_breaker.record(False, probe=False)
+    assert circuit_breaker.state == CIRCUIT_OPEN
+
+    with mock.patch("scrapy_zyte_api._circuit_breaker.perf_counter", return_value=10):
+        assert circuit_breaker.check() is True
+        assert circuit_breaker.state == CIRCUIT_HALF_OPEN
+        assert circuit_breaker.check() is True
+        with pytest.raises(_CircuitOpen):
+            circuit_breaker.check()
+        # A cancelled probe lets another probe through.
+        circuit_breaker.record(None, probe=True)
+        assert circuit_breaker.check() is True
+        # A failed probe opens the circuit again.
+        circuit_breaker.record(True, probe=True)
+    assert circuit_breaker.state == CIRCUIT_OPEN
+    # The outcome of the other probe does not count anymore.
+    circuit_breaker.record(False, probe=True)
+    assert circuit_breaker.state == CIRCUIT_OPEN
+
+    with mock.patch("scrapy_zyte_api._circuit_breaker.perf_counter", return_value=20):
+        assert circuit_breaker.check() is True
+        circuit_breaker.record(False, probe=True)
+    assert circuit_breaker.state == CIRCUIT_CLOSED
+    assert circuit_breaker.check() is False
+    assert states == [
+        CIRCUIT_OPEN,
+        CIRCUIT_HALF_OPEN,
+        CIRCUIT_OPEN,
+        CIRCUIT_HALF_OPEN,
+        CIRCUIT_CLOSED,
+    ]
+    assert stats.get_value("scrapy-zyte-api/circuit_breaker/half-open") == 2
+    assert stats.get_value("scrapy-zyte-api/circuit_breaker/closed") == 1
+
+
+@pytest.mark.parametrize("window,probes", [(0, 1), (4, 0)])
+def test_invalid(window, probes):
+    stats = MemoryStatsCollector(get_crawler())
+    with pytest.raises(ValueError):
+        _CircuitBreaker(
+            window=window,
+            failure_rate=0.5,
+            cooldown=10,
+            probes=probes,
+            stats=stats,
+        )
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy.exceptions import IgnoreRequest
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._coalesce import _Coalescer
+from scrapy_zyte_api.exceptions import ZyteAPIError
+
+
+@ensureDeferred
+async def test_coalesce():
+    async def run():
+        stats = MemoryStatsCollector(get_crawler())
+        coalescer = _Coalescer(stats=stats)
+        calls = []
+
+        async def func(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return [value]
+
+        results = await asyncio.gather(
+            coalescer.run("a", lambda: func(1), lambda result: result + ["shared"]),
+            coalescer.run("a", lambda: func(2), lambda result: result),
+            coalescer.run("b", lambda: func(3), lambda result: result),
+        )
+        assert calls == [1, 3]
+        assert results == [[1, "shared"], [1, "shared"], [3]]
+        assert stats.get_value("scrapy-zyte-api/coalesced") == 1
+        assert not coalescer._pending
+
+        # Once a call is over, calls with the same key are made again.
+        assert await coalescer.run("a", lambda: func(4), lambda result: result) == [4]
+
+    await deferred_from_coro(run())
+
+
+@ensureDeferred
+async def test_coalesce_error():
+    async def run():
+        stats = MemoryStatsCollector(get_crawler())
+        coalescer = _Coalescer(stats=stats)
+
+        async def func():
+            await asyncio.sleep(0.01)
+            raise IgnoreRequest()
+
+        results = await asyncio.gather(
+            coalescer.run("a", func, lambda result: result),
+            coalescer.run("a", func, lambda result: result),
+            return_exceptions=True,
+        )
+        assert [type(result) for result in results] == [IgnoreRequest] * 2
+        assert results[0] is not results[1]
+        assert stats.get_value("scrapy-zyte-api/coalesced") == 1
+
+    await deferred_from_coro(run())
+
+
+@ensureDeferred
+async def test_coalesce_error_details():
+    async def run():
+        stats = MemoryStatsCollector(get_crawler())
+        coalescer = _Coalescer(stats=stats)
+
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ZyteAPIError("error", status=503, retry_after=5, retryable=True)
+
+        results = await asyncio.gather(
+            coalescer.run("a", func, lambda result: result),
+            coalescer.run("a", func, lambda result: result),
+            return_exceptions=True,
+        )
+        assert results[0] is not results[1]
+        for result in results:
+            assert isinstance(result, ZyteAPIError)
+            assert (result.status, result.retry_after, result.retryable) == (
+                503,
+                5,
+                True,
+            )
+
+    await deferred_from_coro(run())
+
+
+@ensureDeferred
+async def test_coalesce_cancel():
+    async def run():
+        stats = MemoryStatsCollector(get_crawler())
+        coalescer = _Coalescer(stats=stats)
+        calls = []
+
+        async def func(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        first = asyncio.ensure_future(
+            coalescer.run("a", lambda: func(1), lambda result: result)
+        )
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(
+            coalescer.run("a", lambda: func(2), lambda result: result)
+        )
+        await asyncio.sleep(0)
+        first.cancel()
+        # The cancellation of the first call does not cancel the second one,
+        # which is made instead.
+        assert await second == 2
+        assert calls == [1, 2]
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    await deferred_from_coro(run())
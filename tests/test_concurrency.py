@@ -0,0 +1,137 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._concurrency import _AdaptiveConcurrency
+
+
+@pytest.mark.parametrize("minimum,maximum", [(0, 1), (2, 1)])
+def test_invalid_range(minimum, maximum):
+    stats = MemoryStatsCollector(get_crawler())
+    with pytest.raises(ValueError):
+        _AdaptiveConcurrency(minimum=minimum, maximum=maximum, stats=stats)
+
+
+def test_slow_start():
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=2, maximum=8, stats=stats)
+    assert concurrency.limit == 2
+    for _ in range(3):
+        concurrency.record(200, start=perf_counter())
+    assert concurrency.limit == 5
+    for _ in range(10):
+        concurrency.record(200, start=perf_counter())
+    assert concurrency.limit == 8
+    assert stats.get_value("scrapy-zyte-api/concurrency/limit") == 8
+    assert stats.get_value("scrapy-zyte-api/concurrency/max_limit") == 8
+
+
+def test_decrease():
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=1, maximum=16, stats=stats)
+    for _ in range(7):
+        concurrency.record(200, start=perf_counter())
+    assert concurrency.limit == 8
+
+    start = perf_counter()
+    concurrency.record(429, start=start)
+    assert concurrency.limit == 4
+    # Throttling responses to attempts started before the decrease are
+    # ignored.
+    concurrency.record(503, start=start)
+    assert concurrency.limit == 4
+    concurrency.record(503, start=perf_counter())
+    assert concurrency.limit == 2
+    assert stats.get_value("scrapy-zyte-api/concurrency/decreases") == 2
+    assert stats.get_value("scrapy-zyte-api/concurrency/limit") == 2
+    assert stats.get_value("scrapy-zyte-api/concurrency/max_limit") == 8
+
+    # After a decrease, the limit grows by 1 every round trip.
+    for _ in range(2):
+        concurrency.record(200, start=perf_counter())
+    assert concurrency.limit == 2
+    concurrency.record(200, start=perf_counter())
+    assert concurrency.limit == 3
+
+    for _ in range(5):
+        concurrency.record(429, start=perf_counter())
+    assert concurrency.limit == 1
+
+
+@pytest.mark.parametrize("status", [None, 500, 520])
+def test_errors_hold(status):
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=1, maximum=8, stats=stats)
+    concurrency.record(status, start=perf_counter())
+    assert concurrency.limit == 1
+    assert stats.get_value("scrapy-zyte-api/concurrency/holds") == 1
+
+
+def test_client_errors_ignored():
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=1, maximum=8, stats=stats)
+    concurrency.record(400, start=perf_counter())
+    assert concurrency.limit == 1
+    assert stats.get_value("scrapy-zyte-api/concurrency/holds") is None
+
+
+def test_latency_hold():
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=1, maximum=100, stats=stats)
+    now = perf_counter()
+    for _ in range(10):
+        concurrency.record(200, start=now - 0.01)
+    assert concurrency.limit == 11
+    for _ in range(5):
+        concurrency.record(200, start=now - 1.0)
+    assert concurrency.limit < 16
+    assert stats.get_value("scrapy-zyte-api/concurrency/holds") > 0
+
+
+@ensureDeferred
+async def test_acquire():
+    await deferred_from_coro(_test_acquire())
+
+
+async def _test_acquire():
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=2, maximum=8, stats=stats)
+    await concurrency.acquire()
+    await concurrency.acquire()
+    waiter = asyncio.ensure_future(concurrency.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    assert concurrency.in_flight == 2
+
+    concurrency.release()
+    await waiter
+    assert concurrency.in_flight == 2
+
+    waiter = asyncio.ensure_future(concurrency.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    concurrency.record(200, start=perf_counter())
+    await waiter
+    assert concurrency.in_flight == 3
+
+
+@ensureDeferred
+async def test_acquire_cancel():
+    await deferred_from_coro(_test_acquire_cancel())
+
+
+async def _test_acquire_cancel():
+    stats = MemoryStatsCollector(get_crawler())
+    concurrency = _AdaptiveConcurrency(minimum=1, maximum=8, stats=stats)
+    await concurrency.acquire()
+    waiter = asyncio.ensure_future(concurrency.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    concurrency.release()
+    assert concurrency.in_flight == 0
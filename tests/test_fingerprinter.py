@@ -0,0 +1,135 @@
+import pytest
+from scrapy import Request
+from scrapy.settings import Settings
+from scrapy.utils import request as request_utils
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api import ScrapyZyteAPIDupeFilter, ScrapyZyteAPIRequestFingerprinter
+
+# scrapy.utils.request.fingerprint was added with fingerprinter support.
+SCRAPY_2_7 = hasattr(request_utils, "fingerprint")
+
+
+def _fingerprinter(settings=None):
+    crawler = get_crawler(settings_dict=settings or {})
+    return ScrapyZyteAPIRequestFingerprinter.from_crawler(crawler)
+
+
+def test_not_zyte_api():
+    fingerprinter = _fingerprinter()
+    request = Request("https://example.com")
+    assert fingerprinter.fingerprint(request).hex() == request_fingerprint(request)
+    request = Request("https://example.com", meta={"zyte_api": False})
+    assert fingerprinter.fingerprint(request).hex() == request_fingerprint(request)
+
+
+@pytest.mark.parametrize("meta_params", [True, {}, ["browserHtml"]])
+def test_not_zyte_api_no_params(meta_params):
+    # Without default parameters, the download handler sends these requests
+    # as plain HTTP requests, or drops them.
+    fingerprinter = _fingerprinter()
+    request = Request("https://example.com", meta={"zyte_api": meta_params})
+    assert fingerprinter.fingerprint(request).hex() == request_fingerprint(request)
+
+
+def test_params():
+    fingerprinter = _fingerprinter()
+    fingerprints = {
+        fingerprinter.fingerprint(Request("https://example.com", meta=meta))
+        for meta in (
+            {},
+            {"zyte_api": {"browserHtml": True}},
+            {"zyte_api": {"httpResponseBody": True}},
+            {"zyte_api": {"browserHtml": True, "geolocation": "US"}},
+        )
+    }
+    assert len(fingerprints) == 4
+
+
+@pytest.mark.parametrize(
+    "meta1,meta2",
+    [
+        # Parameter order
+        (
+            {"zyte_api": {"browserHtml": True, "geolocation": "US"}},
+            {"zyte_api": {"geolocation": "US", "browserHtml": True}},
+        ),
+        # Default values
+        (
+            {"zyte_api": {"browserHtml": True}},
+            {"zyte_api": {"browserHtml": True, "screenshot": False}},
+        ),
+        ({"zyte_api": True}, {"zyte_api": {}}),
+        # URL parameter
+        (
+            {"zyte_api": {"browserHtml": True}},
+            {"zyte_api": {"browserHtml": True, "url": "https://example.com?a=1&b=2"}},
+        ),
+    ],
+)
+def test_canonical(meta1, meta2):
+    fingerprinter = _fingerprinter()
+    request1 = Request("https://example.com?b=2&a=1", meta=meta1)
+    request2 = Request("https://example.com?a=1&b=2", meta=meta2)
+    assert fingerprinter.fingerprint(request1) == fingerprinter.fingerprint(request2)
+
+
+def test_default_params():
+    fingerprinter = _fingerprinter(
+        {"ZYTE_API_DEFAULT_PARAMS": {"browserHtml": True, "geolocation": "US"}}
+    )
+    request1 = Request("https://example.com", meta={"zyte_api": {}})
+    request2 = Request(
+        "https://example.com",
+        meta={"zyte_api": {"browserHtml": True, "geolocation": "US"}},
+    )
+    request3 = Request("https://example.com", meta={"zyte_api": {"geolocation": "IE"}})
+    assert fingerprinter.fingerprint(request1) == fingerprinter.fingerprint(request2)
+    assert fingerprinter.fingerprint(request1) != fingerprinter.fingerprint(request3)
+
+
+def test_memoized():
+    fingerprinter = _fingerprinter()
+    request = Request("https://example.com", meta={"zyte_api": {"browserHtml": True}})
+    fingerprint = fingerprinter.fingerprint(request)
+    request.meta["zyte_api"]["geolocation"] = "US"
+    assert fingerprinter.fingerprint(request) is fingerprint
+    assert len(fingerprinter._cache) == 1
+    del request
+    assert len(fingerprinter._cache) == 0
+
+
+def test_dupe_filter():
+    settings = Settings({"ZYTE_API_DEFAULT_PARAMS": {"browserHtml": True}})
+    dupe_filter = ScrapyZyteAPIDupeFilter.from_settings(settings)
+    assert not dupe_filter.request_seen(
+        Request("https://example.com", meta={"zyte_api": {}})
+    )
+    assert not dupe_filter.request_seen(
+        Request("https://example.com", meta={"zyte_api": {"geolocation": "US"}})
+    )
+    assert dupe_filter.request_seen(
+        Request("https://example.com", meta={"zyte_api": {"browserHtml": True}})
+    )
+    assert not dupe_filter.request_seen(Request("https://example.com"))
+
+
+def test_dupe_filter_from_crawler():
+    crawler = get_crawler(
+        settings_dict={"ZYTE_API_DEFAULT_PARAMS": {"browserHtml": True}}
+    )
+    dupe_filter = ScrapyZyteAPIDupeFilter.from_crawler(crawler)
+    assert not dupe_filter.request_seen(
+        Request("https://example.com", meta={"zyte_api": {}})
+    )
+    assert dupe_filter.request_seen(
+        Request("https://example.com", meta={"zyte_api": {"browserHtml": True}})
+    )
+
+
+@pytest.mark.skipif(not SCRAPY_2_7, reason="fingerprinter requires Scrapy 2.7+")
+def test_dupe_filter_fingerprinter():
+    fingerprinter = _fingerprinter()
+    dupe_filter = ScrapyZyteAPIDupeFilter(fingerprinter=fingerprinter)
+    assert dupe_filter._fingerprinter is fingerprinter
@@ -39,6 +39,47 @@ def test_concurrency_configuration(concurrency):
     assert handler._session.connector.limit == concurrency
 
 
+def test_connection_pool_configuration():
+    settings = {
+        **SETTINGS,
+        "CONCURRENT_REQUESTS": 32,
+        "ZYTE_API_CONNECTIONS": 500,
+        "ZYTE_API_KEEPALIVE_TIMEOUT": 60,
+        "ZYTE_API_DNS_CACHE_TTL": 300,
+        "ZYTE_API_SESSIONS": 4,
+    }
+    crawler = get_crawler(settings_dict=settings)
+    handler = ScrapyZyteAPIDownloadHandler(
+        settings=crawler.settings,
+        crawler=crawler,
+    )
+    assert handler._client.n_conn == 500
+    sessions = handler._sessions.sessions
+    assert len(sessions) == 4
+    assert len({id(session.connector) for session in sessions}) == 4
+    for session in sessions:
+        assert session.connector.limit == 125
+        assert session.connector._keepalive_timeout == 60
+        assert session.connector.use_dns_cache
+        assert session.connector._cached_hosts._ttl == 300
+    assert [handler._sessions.get() for _ in range(5)] == sessions + sessions[:1]
+
+
+def test_connection_pool_disabled_features():
+    settings = {
+        **SETTINGS,
+        "ZYTE_API_KEEPALIVE_TIMEOUT": 0,
+        "ZYTE_API_DNS_CACHE_TTL": 0,
+    }
+    crawler = get_crawler(settings_dict=settings)
+    handler = ScrapyZyteAPIDownloadHandler(
+        settings=crawler.settings,
+        crawler=crawler,
+    )
+    assert handler._session.connector.force_close
+    assert not handler._session.connector.use_dns_cache
+
+
 @pytest.mark.parametrize(
     "env_var,setting,expected",
     (
@@ -129,6 +170,53 @@ def test_api_key(env_var, setting, expected):
             assert handler._client.api_key == expected
 
 
+@pytest.mark.parametrize(
+    "setting,expected",
+    (
+        (
+            "a,b",
+            ["a", "b"],
+        ),
+        (
+            " a , b ,",
+            ["a", "b"],
+        ),
+        (
+            ["a", "", " "],
+            ["a"],
+        ),
+        (
+            ",",
+            NotConfigured,
+        ),
+        (
+            [" "],
+            NotConfigured,
+        ),
+    ),
+)
+def test_api_keys(setting, expected):
+    crawler = get_crawler(settings_dict={"ZYTE_API_KEYS": setting})
+
+    def build_hander():
+        return create_instance(
+            ScrapyZyteAPIDownloadHandler,
+            settings=None,
+            crawler=crawler,
+        )
+
+    if isclass(expected) and issubclass(expected, Exception):
+        with pytest.raises(expected):
+            build_hander()
+    else:
+        handler = build_hander()
+        if len(expected) > 1:
+            keys = [key.client.api_key for key in handler._key_pool.keys]
+        else:
+            keys = [handler._client.api_key]
+        assert keys == expected
+
+
 @pytest.mark.parametrize(
     "setting,expected",
     (
@@ -167,6 +255,88 @@ def test_api_url(setting, expected):
     assert handler._client.api_url == expected
 
 
+@pytest.mark.parametrize(
+    "setting,expected",
+    (
+        (UNSET, "full"),
+        (None, "full"),
+        ("full", "full"),
+        ("lazy", "lazy"),
+        ("metadata-only", "metadata-only"),
+        ("foo", ValueError),
+    ),
+)
+def test_raw_api_response_mode(setting, expected):
+    settings = {"ZYTE_API_KEY": "a"}
+    if setting is not UNSET:
+        settings["ZYTE_API_RAW_RESPONSE"] = setting
+    crawler = get_crawler(settings_dict=settings)
+
+    def build_handler():
+        return create_instance(
+            ScrapyZyteAPIDownloadHandler,
+            settings=None,
+            crawler=crawler,
+        )
+
+    if isclass(expected) and issubclass(expected, Exception):
+        with pytest.raises(expected):
+            build_handler()
+    else:
+        assert build_handler()._raw_api_response_mode == expected
+
+
+@pytest.mark.parametrize(
+    "setting,expected",
+    (
+        (UNSET, "json"),
+        (None, "json"),
+        ("json", "json"),
+        ("orjson", "orjson"),
+        ("ujson", "ujson"),
+        ("foo", ValueError),
+    ),
+)
+def test_json_backend(setting, expected):
+    if expected in ("orjson", "ujson"):
+        pytest.importorskip(expected)
+    settings = {"ZYTE_API_KEY": "a"}
+    if setting is not UNSET:
+        settings["ZYTE_API_JSON_BACKEND"] = setting
+    crawler = get_crawler(settings_dict=settings)
+
+    def build_handler():
+        return create_instance(
+            ScrapyZyteAPIDownloadHandler,
+            settings=None,
+            crawler=crawler,
+        )
+
+    if isclass(expected) and issubclass(expected, Exception):
+        with pytest.raises(expected):
+            build_handler()
+        return
+    handler = build_handler()
+    assert handler._json.name == expected
+    assert handler._session._json_serialize is handler._json.dumps
+    data = {"url": "https://example.com/ä", "browserHtml": True}
+    assert handler._json.loads(handler._json.dumps(data)) == data
+
+
+def test_json_backend_missing(caplog):
+    crawler = get_crawler(
+        settings_dict={"ZYTE_API_KEY": "a", "ZYTE_API_JSON_BACKEND": "ujson"}
+    )
+    with mock.patch.dict(sys.modules, {"ujson": None}):
+        handler = create_instance(
+            ScrapyZyteAPIDownloadHandler,
+            settings=None,
+            crawler=crawler,
+        )
+    assert handler._json.name == "json"
+    assert "ujson is not installed" in caplog.text
+
+
 def test_custom_client():
     client = AsyncClient(api_key="a", api_url="b")
     crawler = get_crawler()
@@ -0,0 +1,142 @@
+from hashlib import sha1
+from unittest import mock
+
+import pytest
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._keys import _KeyPool, _PooledKey
+
+
+def _keys(labels):
+    return [
+        _PooledKey(client=mock.Mock(api_key=f"{label}1234567890"), sessions=None)
+        for label in labels
+    ]
+
+
+def _labels(keys):
+    return "".join(key.client.api_key[0] for key in keys)
+
+
+def _stat(label, name):
+    key_label = sha1(f"{label}1234567890".encode()).hexdigest()[:8]
+    return f"scrapy-zyte-api/keys/{key_label}/{name}"
+
+
+def test_invalid_selection():
+    stats = MemoryStatsCollector(get_crawler())
+    with pytest.raises(ValueError):
+        _KeyPool(
+            _keys("abc"),
+            selection="random",
+            ejection_errors=2,
+            ejection_time=60,
+            stats=stats,
+        )
+
+
+def test_label():
+    stats = MemoryStatsCollector(get_crawler())
+    pool = _KeyPool(
+        _keys("ab"),
+        selection="least-in-flight",
+        ejection_errors=2,
+        ejection_time=60,
+        stats=stats,
+    )
+    assert pool.keys[0].label == "c84fae98"
+    # Keys that share a prefix get different labels.
+    assert pool.keys[0].label != pool.keys[1].label
+
+
+def test_round_robin():
+    stats = MemoryStatsCollector(get_crawler())
+    pool = _KeyPool(
+        _keys("abc"),
+        selection="round-robin",
+        ejection_errors=2,
+        ejection_time=60,
+        stats=stats,
+    )
+    keys = [pool.acquire() for _ in range(5)]
+    assert _labels(keys) == "abcab"
+    assert stats.get_value(_stat("a", "requests")) == 2
+    assert stats.get_value(_stat("c", "requests")) == 1
+
+
+def test_least_in_flight():
+    stats = MemoryStatsCollector(get_crawler())
+    pool = _KeyPool(
+        _keys("abc"),
+        selection="least-in-flight",
+        ejection_errors=2,
+        ejection_time=60,
+        stats=stats,
+    )
+    a, b, c = (pool.acquire() for _ in range(3))
+    assert _labels([a, b, c]) == "abc"
+    pool.release(b)
+    assert _labels([pool.acquire()]) == "b"
+    pool.release(a)
+    pool.release(c)
+    assert _labels([pool.acquire(), pool.acquire()]) in ("ac", "ca")
+    assert [key.in_flight for key in pool.keys] == [1, 1, 1]
+
+
+def test_ejection():
+    stats = MemoryStatsCollector(get_crawler())
+    pool = _KeyPool(
+        _keys("abc"),
+        selection="round-robin",
+        ejection_errors=2,
+        ejection_time=60,
+        stats=stats,
+    )
+    for status in (401, 500, 403):
+        key = pool.acquire()
+        while key.client.api_key[0] != "b":
+            pool.release(key)
+            key = pool.acquire()
+        pool.release(key, failed=True, status=status)
+    assert stats.get_value(_stat("b", "errors")) == 3
+    assert stats.get_value(_stat("b", "ejections")) == 1
+    keys = [pool.acquire() for _ in range(4)]
+    assert "b" not in _labels(keys)
+
+    with mock.patch("scrapy_zyte_api._keys.perf_counter", return_value=1e9):
+        keys = [pool.acquire() for _ in range(3)]
+    assert "b" in _labels(keys)
+
+
+def test_ejection_reset():
+    stats = MemoryStatsCollector(get_crawler())
+    pool = _KeyPool(
+        _keys("a"),
+        selection="least-in-flight",
+        ejection_errors=2,
+        ejection_time=60,
+        stats=stats,
+    )
+    key = pool.acquire()
+    pool.release(key, failed=True, status=429)
+    key = pool.acquire()
+    pool.release(key)
+    key = pool.acquire()
+    pool.release(key, failed=True, status=429)
+    assert stats.get_value(_stat("a", "ejections")) is None
+
+
+def test_all_ejected():
+    stats = MemoryStatsCollector(get_crawler())
+    pool = _KeyPool(
+        _keys("ab"),
+        selection="least-in-flight",
+        ejection_errors=1,
+        ejection_time=60,
+        stats=stats,
+    )
+    pool.release(pool.acquire(), failed=True, status=401)
+    pool.release(pool.acquire(), failed=True, status=401)
+    # The key ejected first is used.
+    assert _labels([pool.acquire()]) == "a"
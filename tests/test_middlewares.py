@@ -0,0 +1,158 @@
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request, Spider
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.test import get_crawler
+from tenacity import AsyncRetrying, stop_after_attempt
+
+from scrapy_zyte_api import ZyteAPIError, ZyteAPIRetryMiddleware
+
+from . import SETTINGS
+from .mockserver import MockServer, SizedResource
+
+
+def _middleware(settings=None):
+    crawler = get_crawler(settings_dict=settings or {})
+    return ZyteAPIRetryMiddleware.from_crawler(crawler), crawler.stats
+
+
+def _error(**kwargs):
+    kwargs.setdefault("retryable", True)
+    return ZyteAPIError("error", **kwargs)
+
+
+def _retry(middleware, request, exception):
+    """Return the retry of *request* that *middleware* schedules because of
+    *exception*, and the seconds after which it is to be sent, or ``None``
+    and ``None``."""
+    with mock.patch("scrapy_zyte_api.middlewares.time", return_value=1000.0):
+        retry = middleware.process_exception(request, exception, Spider("test"))
+    if retry is None:
+        return None, None
+    return retry, retry.meta["_zyte_api_retry_at"] - 1000.0
+
+
+def test_retry():
+    middleware, stats = _middleware({"ZYTE_API_RETRY_BACKOFF_BASE": 10})
+    request = Request("https://example.com", priority=5, meta={"zyte_api": True})
+
+    retry, delay = _retry(middleware, request, _error(status=503))
+    assert isinstance(retry, Request)
+    assert retry is not request
+    assert retry.url == request.url
+    assert retry.priority == 4
+    assert retry.dont_filter
+    assert retry.meta["zyte_api"] is True
+    assert retry.meta["zyte_api_retry_times"] == 1
+    assert 5 <= delay <= 10
+    assert "zyte_api_retry_times" not in request.meta
+
+    # The backoff delay doubles with every retry.
+    retry, delay = _retry(middleware, retry, _error())
+    assert retry.meta["zyte_api_retry_times"] == 2
+    assert 10 <= delay <= 20
+
+    # RETRY_TIMES is 2 by default.
+    assert _retry(middleware, retry, _error()) == (None, None)
+
+    assert stats.get_value("scrapy-zyte-api/retry/count") == 2
+    assert stats.get_value("scrapy-zyte-api/retry/reason/503") == 1
+    assert stats.get_value("scrapy-zyte-api/retry/reason/exception") == 1
+    assert stats.get_value("scrapy-zyte-api/retry/max_reached") == 1
+
+
+@pytest.mark.parametrize(
+    "meta,exception",
+    [
+        ({}, _error(retryable=False)),
+        ({}, IgnoreRequest()),
+        ({}, ValueError()),
+        ({"dont_retry": True}, _error()),
+        ({"zyte_api_max_retry_times": 0}, _error()),
+    ],
+)
+def test_no_retry(meta, exception):
+    middleware, _ = _middleware()
+    request = Request("https://example.com", meta=meta)
+    assert _retry(middleware, request, exception) == (None, None)
+
+
+def test_retry_after():
+    middleware, _ = _middleware({"ZYTE_API_RETRY_BACKOFF_BASE": 0.1})
+    request = Request("https://example.com")
+    _, delay = _retry(middleware, request, _error(status=429, retry_after=30))
+    assert delay == 30
+
+
+def test_backoff_max():
+    middleware, _ = _middleware(
+        {"ZYTE_API_RETRY_TIMES": 20, "ZYTE_API_RETRY_BACKOFF_MAX": 5}
+    )
+    request = Request("https://example.com", meta={"zyte_api_retry_times": 10})
+    _, delay = _retry(middleware, request, _error())
+    assert delay <= 5
+
+
+def test_budget():
+    middleware, stats = _middleware({"ZYTE_API_RETRY_BUDGET": 2})
+    results = [
+        _retry(middleware, Request(f"https://example.com/{index}"), _error())[0]
+        for index in range(3)
+    ]
+    assert [result is None for result in results] == [False, False, True]
+    assert stats.get_value("scrapy-zyte-api/retry/budget_exhausted") == 1
+
+
+@ensureDeferred
+async def test_retry_crawl():
+    retry_policy = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+    events = []
+
+    class TestSpider(Spider):
+        name = "test"
+
+        def start_requests(self):
+            meta = {
+                "zyte_api": {"browserHtml": True, "status": 503, "retry_after": 0.5},
+                "zyte_api_retry_policy": retry_policy,
+            }
+            yield Request(
+                "https://example.com/failing",
+                meta=meta,
+                priority=1,
+                errback=self.errback,
+                dont_filter=True,
+            )
+            yield Request(
+                "https://example.com/ok",
+                meta={"zyte_api": {"browserHtml": True}},
+                dont_filter=True,
+            )
+
+        def parse(self, response):
+            events.append("ok")
+
+        def errback(self, failure):
+            events.append(failure.request.meta.get("zyte_api_retry_times", 0))
+
+    with MockServer(SizedResource) as server:
+        crawler = get_crawler(
+            TestSpider,
+            {
+                **SETTINGS,
+                "CONCURRENT_REQUESTS": 1,
+                "DOWNLOADER_MIDDLEWARES": {
+                    "scrapy_zyte_api.ZyteAPIRetryMiddleware": 525,
+                },
+                "ZYTE_API_RETRY_TIMES": 1,
+                "ZYTE_API_URL": server.urljoin("/"),
+            },
+        )
+        await crawler.crawl()
+
+    # The errback is only called once retries are over.
+    assert sorted(events, key=str) == [1, "ok"]
+    assert crawler.stats.get_value("scrapy-zyte-api/retry/count") == 1
+    assert crawler.stats.get_value("scrapy-zyte-api/retry/max_reached") == 1
@@ -0,0 +1,115 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._rate_limit import _RateLimiter, _TokenBucket
+
+
+def test_token_bucket():
+    with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=0.0):
+        bucket = _TokenBucket(rate=10, capacity=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() == pytest.approx(0.2)
+        bucket.cancel()
+        assert bucket.reserve() == pytest.approx(0.2)
+        assert not bucket.is_full()
+
+
+def test_token_bucket_refill():
+    with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=0.0):
+        bucket = _TokenBucket(rate=10, capacity=2)
+        bucket.reserve()
+        bucket.reserve()
+    with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=0.15):
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.05)
+    with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=10.0):
+        assert bucket.is_full()
+
+
+async def _wait_all(rate_limiter, domains):
+    """Return the waits of the attempts for *domains* that had to wait, with
+    the clock frozen, so that waits only depend on the reserved tokens."""
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=0.0):
+        with mock.patch("scrapy_zyte_api._rate_limit.asyncio.sleep", sleep):
+            for domain in domains:
+                await rate_limiter.wait(domain)
+    return delays
+
+
+@ensureDeferred
+async def test_rate_limit():
+    # The global bucket is created right away, so it must use the frozen
+    # clock as well.
+    with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=0.0):
+        stats = MemoryStatsCollector(get_crawler())
+        rate_limiter = _RateLimiter(rate=20, per_domain_rate=0, stats=stats)
+    delays = await deferred_from_coro(_wait_all(rate_limiter, ["a"] * 25))
+    # The first second worth of attempts is sent right away.
+    assert delays == pytest.approx([0.05, 0.1, 0.15, 0.2, 0.25])
+    assert stats.get_value("scrapy-zyte-api/rate_limit/delayed") == 5
+    assert stats.get_value("scrapy-zyte-api/rate_limit/max_wait_time") == (
+        pytest.approx(0.25)
+    )
+    assert stats.get_value("scrapy-zyte-api/rate_limit/wait_time") == (
+        pytest.approx(0.75)
+    )
+
+
+@ensureDeferred
+async def test_rate_limit_per_domain():
+    stats = MemoryStatsCollector(get_crawler())
+    rate_limiter = _RateLimiter(rate=0, per_domain_rate=10, stats=stats)
+    delays = await deferred_from_coro(_wait_all(rate_limiter, ["a"] * 12 + ["b"] * 12))
+    assert delays == pytest.approx([0.1, 0.2, 0.1, 0.2])
+    assert stats.get_value("scrapy-zyte-api/rate_limit/delayed") == 4
+
+
+@ensureDeferred
+async def test_rate_limit_cancel():
+    async def run():
+        with mock.patch("scrapy_zyte_api._rate_limit.perf_counter", return_value=0.0):
+            stats = MemoryStatsCollector(get_crawler())
+            rate_limiter = _RateLimiter(rate=1, per_domain_rate=0, stats=stats)
+            await rate_limiter.wait("a")
+            with mock.patch(
+                "scrapy_zyte_api._rate_limit.asyncio.sleep",
+                side_effect=asyncio.CancelledError,
+            ):
+                with pytest.raises(asyncio.CancelledError):
+                    await rate_limiter.wait("a")
+            # The token of the cancelled attempt is given back.
+            assert rate_limiter._bucket.reserve() == pytest.approx(1)
+        assert stats.get_value("scrapy-zyte-api/rate_limit/delayed") is None
+
+    await deferred_from_coro(run())
+
+
+def test_domain_buckets_pruned():
+    stats = MemoryStatsCollector(get_crawler())
+    rate_limiter = _RateLimiter(rate=0, per_domain_rate=10, stats=stats)
+    with mock.patch("scrapy_zyte_api._rate_limit._MAX_IDLE_DOMAIN_BUCKETS", 3):
+        for domain in "abc":
+            rate_limiter._domain_bucket(domain)
+        rate_limiter._domain_bucket("a").reserve()
+        rate_limiter._domain_bucket("d")
+    assert set(rate_limiter._domain_buckets) == {"a", "d"}
+
+
+def test_no_limit():
+    stats = MemoryStatsCollector(get_crawler())
+    rate_limiter = _RateLimiter(rate=0, per_domain_rate=0, stats=stats)
+    assert rate_limiter._bucket is None
+    assert rate_limiter._domain_bucket("a") is None
@@ -1,13 +1,26 @@
-from base64 import b64encode
+import mmap
+import pickle
+from base64 import b64decode, b64encode
+from io import BytesIO
+from unittest import mock
 
 import pytest
 from scrapy import Request
 from scrapy.exceptions import NotSupported
 from scrapy.http import Response, TextResponse
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
 
+from scrapy_zyte_api._spill import _Spiller
 from scrapy_zyte_api.responses import (
+    RAW_API_RESPONSE_FULL,
+    RAW_API_RESPONSE_LAZY,
+    RAW_API_RESPONSE_METADATA_ONLY,
+    ZyteAPILazyResponse,
+    ZyteAPILazyTextResponse,
     ZyteAPIResponse,
     ZyteAPITextResponse,
+    _DecodedBody,
     _process_response,
 )
 
@@ -118,6 +131,20 @@ def test_response_replace(api_response, cls):
         orig_response.replace(raw_api_response=new_raw_api_response)
 
 
+def test_browser_html_text():
+    """The text from browserHtml is reused as is, and only encoded when the
+    body is read."""
+    api_response = raw_api_response_browser()
+    response = ZyteAPITextResponse.from_api_response(api_response)
+
+    assert response.text is api_response["browserHtml"]
+    assert response.css("body ::text").get() == "The cake is a lie!"
+    assert response._body is None
+
+    assert response.body == EXPECTED_BODY
+    assert response.text is api_response["browserHtml"]
+
+
 def test_non_utf8_response():
     content = "<html><body>Some non-ASCII ✨ chars</body></html>"
     sample_raw_api_response = {
@@ -337,6 +364,25 @@ def test__process_response_body_and_headers_mismatch():
     assert resp.encoding == "gb18030"
 
 
+def test__process_response_body_decoded_once():
+    """The body is only decoded once, even when it is needed to guess the
+    response class."""
+    api_response = {
+        "url": "https://example.com",
+        "httpResponseBody": format_to_httpResponseBody(BODY),
+        "httpResponseHeaders": [{"name": "X-Value", "value": "some_value"}],
+    }
+
+    with mock.patch(
+        "scrapy_zyte_api.responses.b64decode", side_effect=b64decode
+    ) as decode:
+        resp = _process_response(api_response, Request(api_response["url"]))
+
+    assert decode.call_count == 1
+    assert isinstance(resp, TextResponse)
+    assert resp.body == BODY.encode("utf-8")
+
+
 def test__process_response_non_text():
     """Non-textual responses like images, files, etc. won't have access to the
     css/xpath selectors.
@@ -383,3 +429,201 @@ def test__process_response_browserhtml(api_response):
     assert resp.css("h1 ::text").get() == "World!✨"
     assert resp.xpath("//body/text()").getall() == ["Hello"]
     assert resp.encoding == "utf-8"  # Zyte API is consistent with this on browserHtml
+
+
+def raw_api_response_body_str():
+    return {
+        **raw_api_response_body(),
+        "httpResponseBody": format_to_httpResponseBody(PAGE_CONTENT),
+    }
+
+
+@pytest.mark.parametrize(
+    "api_response,body_field",
+    [
+        (raw_api_response_browser, "browserHtml"),
+        (raw_api_response_body_str, "httpResponseBody"),
+    ],
+)
+@pytest.mark.parametrize(
+    "mode,stores_body_field,exposes_body_field",
+    [
+        (RAW_API_RESPONSE_FULL, True, True),
+        (RAW_API_RESPONSE_LAZY, False, True),
+        (RAW_API_RESPONSE_METADATA_ONLY, False, False),
+    ],
+)
+def test__process_response_raw_api_response_mode(
+    api_response, body_field, mode, stores_body_field, exposes_body_field
+):
+    resp = _process_response(api_response(), Request(URL), raw_api_response_mode=mode)
+
+    assert resp.body == EXPECTED_BODY
+    assert (body_field in resp._raw_api_response) == stores_body_field
+    if exposes_body_field:
+        assert resp.raw_api_response == api_response()
+    else:
+        expected = api_response()
+        del expected[body_field]
+        assert resp.raw_api_response == expected
+
+    # replace() keeps the mode.
+    new_resp = resp.replace(status=404)
+    assert (body_field in new_resp._raw_api_response) == stores_body_field
+    assert new_resp.raw_api_response == resp.raw_api_response
+
+
+@pytest.mark.parametrize(
+    "api_response,cls",
+    [
+        (raw_api_response_browser, ZyteAPILazyTextResponse),
+        (raw_api_response_body_str, ZyteAPILazyTextResponse),
+        (raw_api_response_body_str, ZyteAPILazyResponse),
+    ],
+)
+def test_lazy_body(api_response, cls):
+    with mock.patch(
+        "scrapy_zyte_api.responses.b64decode", side_effect=b64decode
+    ) as decode:
+        response = cls.from_api_response(api_response())
+
+        assert response._body is None
+        assert response.url == URL
+        assert response.status == 200
+        assert response.headers == EXPECTED_HEADERS
+        assert response.raw_api_response == api_response()
+        assert response._body is None
+        assert decode.call_count == 0
+
+        assert response.body == EXPECTED_BODY
+        assert response.body is response.body
+        assert response._encoded_body is None
+        assert decode.call_count == (0 if "browserHtml" in api_response() else 1)
+
+
+@pytest.mark.parametrize(
+    "api_response,body_field,cls",
+    [
+        (raw_api_response_browser, "browserHtml", ZyteAPILazyTextResponse),
+        (raw_api_response_body_str, "httpResponseBody", ZyteAPILazyTextResponse),
+    ],
+)
+def test__process_response_lazy_body(api_response, body_field, cls):
+    resp = _process_response(
+        api_response(),
+        Request(URL),
+        raw_api_response_mode=RAW_API_RESPONSE_LAZY,
+        lazy_body=True,
+    )
+
+    assert type(resp) is cls
+    assert resp._body is None
+    # The lazy raw API response does not need the decoded body.
+    assert resp.raw_api_response == api_response()
+    assert resp._body is None
+    assert resp.text == PAGE_CONTENT
+    assert resp.raw_api_response == api_response()
+
+
+@pytest.mark.parametrize(
+    "api_response,body_field",
+    [
+        (raw_api_response_browser, "browserHtml"),
+        (raw_api_response_body_str, "httpResponseBody"),
+    ],
+)
+@pytest.mark.parametrize("lazy_body", [False, True])
+def test__process_response_lazy_replace(api_response, body_field, lazy_body):
+    resp = _process_response(
+        api_response(),
+        Request(URL),
+        raw_api_response_mode=RAW_API_RESPONSE_LAZY,
+        lazy_body=lazy_body,
+    )
+    with mock.patch.object(
+        type(resp), "_encode_body_field", side_effect=AssertionError
+    ):
+        new_resp = resp.replace(status=404)
+    assert new_resp.status == 404
+    assert new_resp._body is resp._body
+    if lazy_body:
+        assert new_resp._body is None
+
+    # The raw API response keeps the original body.
+    new_resp = resp.replace(body=b"foo")
+    assert new_resp.body == b"foo"
+    assert new_resp.raw_api_response == api_response()
+    assert new_resp.replace(status=404).raw_api_response == api_response()
+
+
+def test__process_response_lazy_body_class():
+    """Lazy responses only decode the beginning of the body to guess the
+    response class."""
+    text = "<html><body>" + "a" * 10000 + "</body></html>"
+    binary = b"\x01" * 10000 + text.encode()
+    headers = [{"name": "X-Value", "value": "some_value"}]
+    for body, cls in (
+        (text.encode(), ZyteAPILazyTextResponse),
+        (binary, ZyteAPILazyResponse),
+    ):
+        api_response = {
+            "url": "https://example.com",
+            "httpResponseBody": b64encode(body).decode(),
+            "httpResponseHeaders": headers,
+        }
+        resp = _process_response(api_response, Request(URL), lazy_body=True)
+        assert type(resp) is cls
+        assert resp._body is None
+        assert resp.body == body
+
+
+@pytest.mark.parametrize(
+    "threshold,spilled", [(0, False), (10000, True), (10001, False)]
+)
+def test__process_response_spill(threshold, spilled):
+    body = b"\x01" * 10000
+    api_response = {
+        "url": URL,
+        "httpResponseBody": b64encode(body).decode(),
+        "httpResponseHeaders": [
+            {"name": "Content-Type", "value": "application/octet-stream"}
+        ],
+    }
+    stats = StatsCollector(get_crawler())
+    spiller = _Spiller(threshold=threshold, stats=stats)
+    resp = _process_response(api_response, Request(URL), spiller=spiller)
+    assert type(resp) is ZyteAPIResponse
+    assert isinstance(resp.body, mmap.mmap) == spilled
+    assert resp.body[:] == body
+    assert resp.replace().body is resp.body
+    assert resp.raw_api_response == api_response
+    if spilled:
+        assert stats.get_value("scrapy-zyte-api/mmap/count") == 1
+        assert stats.get_value("scrapy-zyte-api/mmap/bytes") == len(body)
+        # Pickling turns memory-mapped bodies into bytes.
+        unpickled = pickle.loads(pickle.dumps(resp))
+        assert unpickled.body == body
+        assert isinstance(unpickled.body, bytes)
+    else:
+        assert stats.get_value("scrapy-zyte-api/mmap/count") is None
+    with pytest.raises(AttributeError, match="not modifiable"):
+        resp.body = b""
+
+
+def test__process_response_spill_text():
+    """Text responses are never spilled."""
+    body = PAGE_CONTENT.encode()
+    stats = StatsCollector(get_crawler())
+    spiller = _Spiller(threshold=1, stats=stats)
+    api_response = raw_api_response_body()
+    resp = _process_response(api_response, Request(URL), spiller=spiller)
+    assert type(resp) is ZyteAPITextResponse
+    assert resp.body == body
+
+    body_file = BytesIO(body)
+    api_response["httpResponseBody"] = _DecodedBody(body_file, len(body))
+    resp = _process_response(api_response, Request(URL), spiller=spiller)
+    assert type(resp) is ZyteAPITextResponse
+    assert resp.body == body
+    assert body_file.closed
+    assert stats.get_value("scrapy-zyte-api/mmap/count") is None
@@ -0,0 +1,101 @@
+import json
+from base64 import b64encode
+
+import pytest
+
+from scrapy_zyte_api._streaming import _StreamingParser
+
+BODY = bytes(range(256)) * 40
+
+
+def parse(document: bytes, chunk_size: int, max_memory_size: int = 1024 * 1024):
+    parser = _StreamingParser(max_memory_size=max_memory_size)
+    for index in range(0, len(document), chunk_size):
+        parser.feed(document[index : index + chunk_size])
+    rest, body_file = parser.close()
+    body = None
+    if body_file is not None:
+        with body_file:
+            body = body_file.read()
+    return json.loads(rest), body
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64, 100000])
+@pytest.mark.parametrize(
+    "document,expected_rest",
+    [
+        (
+            b'{"url": "https://example.com", "httpResponseBody": "%s", '
+            b'"echoData": "a\\\\"}',
+            {"url": "https://example.com", "httpResponseBody": "", "echoData": "a\\"},
+        ),
+        # Quotes and structural characters within strings.
+        (
+            b'{"url": "https://example.com/\\"httpResponseBody\\":{", '
+            b'"httpResponseBody":"%s"}',
+            {"url": 'https://example.com/"httpResponseBody":{', "httpResponseBody": ""},
+        ),
+        # Nested httpResponseBody keys are not streamed.
+        (
+            b'{"echoData": {"httpResponseBody": "AA==", "a": ["httpResponseBody"]},'
+            b' "httpResponseBody" :\n"%s"}',
+            {
+                "echoData": {"httpResponseBody": "AA==", "a": ["httpResponseBody"]},
+                "httpResponseBody": "",
+            },
+        ),
+    ],
+)
+def test_parser(document, expected_rest, chunk_size):
+    # Slashes may be escaped in JSON strings.
+    encoded_body = b64encode(BODY).replace(b"/", b"\\/")
+    assert b"\\/" in encoded_body
+    rest, body = parse(document % encoded_body, chunk_size)
+    assert rest == expected_rest
+    assert body == BODY
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        b'{"url": "https://example.com"}',
+        b'{"url": "https://example.com", "httpResponseBody": null}',
+        b'{"echoData": {"httpResponseBody": "AA=="}}',
+    ],
+)
+def test_parser_no_body(document):
+    rest, body = parse(document, 3)
+    assert rest == json.loads(document)
+    assert body is None
+
+
+def test_parser_empty_body():
+    rest, body = parse(b'{"httpResponseBody": ""}', 3)
+    assert rest == {"httpResponseBody": ""}
+    assert body == b""
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        b'{"httpResponseBody": "AAAA',
+        b'{"httpResponseBody": "AAAA\\',
+        b'{"url": "https://example.com',
+    ],
+)
+def test_parser_truncated(document):
+    parser = _StreamingParser(max_memory_size=1024)
+    parser.feed(document)
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+@pytest.mark.parametrize("max_memory_size,rolled", [(len(BODY), False), (1024, True)])
+def test_parser_max_memory_size(max_memory_size, rolled):
+    parser = _StreamingParser(max_memory_size=max_memory_size)
+    parser.feed(b'{"httpResponseBody": "%s"}' % b64encode(BODY))
+    _, body_file = parser.close()
+    assert body_file is not None
+    assert body_file._rolled == rolled  # type: ignore[attr-defined]
+    assert body_file.read() == BODY
+    body_file.close()
@@ -0,0 +1,110 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._throttle import _get_retry_after, _ThrottleGate
+
+
+async def _wait_all(throttle_gate, count):
+    """Return the seconds after which each of *count* attempts was
+    released."""
+    start = perf_counter()
+
+    async def wait():
+        await throttle_gate.wait()
+        return perf_counter() - start
+
+    return await asyncio.gather(*(wait() for _ in range(count)))
+
+
+@pytest.mark.parametrize(
+    "headers,expected",
+    [
+        (None, None),
+        ({}, None),
+        ({"Retry-After": "5"}, 5.0),
+        ({"Retry-After": "-1"}, 0.0),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+    ],
+)
+def test_get_retry_after(headers, expected):
+    assert _get_retry_after(headers) == expected
+
+
+@ensureDeferred
+async def test_pause():
+    stats = MemoryStatsCollector(get_crawler())
+    throttle_gate = _ThrottleGate(release_rate=20, default_pause=0.2, stats=stats)
+    assert await deferred_from_coro(_wait_all(throttle_gate, 1)) == [
+        pytest.approx(0, abs=0.05)
+    ]
+    throttle_gate.pause(0.1)
+    # A shorter pause does not shorten the current one.
+    throttle_gate.pause(0.05)
+    released = await deferred_from_coro(_wait_all(throttle_gate, 3))
+    # Attempts are released gradually after the pause.
+    assert released == [
+        pytest.approx(0.1, abs=0.05),
+        pytest.approx(0.15, abs=0.05),
+        pytest.approx(0.2, abs=0.05),
+    ]
+    assert released[0] < released[1] < released[2]
+    assert stats.get_value("scrapy-zyte-api/throttle/paused") == 1
+    assert stats.get_value("scrapy-zyte-api/throttle/delayed") == 3
+    assert stats.get_value("scrapy-zyte-api/throttle/max_wait_time") == (
+        pytest.approx(0.2, abs=0.05)
+    )
+
+    # The default pause applies to throttling responses without Retry-After.
+    throttle_gate.pause()
+    released = await deferred_from_coro(_wait_all(throttle_gate, 1))
+    assert released == [pytest.approx(0.2, abs=0.05)]
+
+
+@ensureDeferred
+async def test_pause_during_release():
+    async def run():
+        stats = MemoryStatsCollector(get_crawler())
+        throttle_gate = _ThrottleGate(release_rate=10, default_pause=0.2, stats=stats)
+        throttle_gate.pause(0.05)
+        task = asyncio.ensure_future(_wait_all(throttle_gate, 3))
+        await asyncio.sleep(0.1)
+        # Attempts not released yet wait for the new pause.
+        throttle_gate.pause(0.2)
+        released = await task
+        assert released == [
+            pytest.approx(0.05, abs=0.04),
+            pytest.approx(0.3, abs=0.05),
+            pytest.approx(0.4, abs=0.05),
+        ]
+        assert stats.get_value("scrapy-zyte-api/throttle/paused") == 2
+
+    await deferred_from_coro(run())
+
+
+@ensureDeferred
+async def test_cancel():
+    async def run():
+        stats = MemoryStatsCollector(get_crawler())
+        throttle_gate = _ThrottleGate(release_rate=1, default_pause=0.2, stats=stats)
+        throttle_gate.pause(0.1)
+        task = asyncio.ensure_future(throttle_gate.wait())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.sleep(0)
+        # The release of the cancelled attempt is given back.
+        assert throttle_gate._reserve() == pytest.approx(0.1, abs=0.05)
+        assert stats.get_value("scrapy-zyte-api/throttle/delayed") is None
+
+    await deferred_from_coro(run())
+
+
+def test_invalid_release_rate():
+    stats = MemoryStatsCollector(get_crawler())
+    with pytest.raises(ValueError):
+        _ThrottleGate(release_rate=0, default_pause=0.2, stats=stats)
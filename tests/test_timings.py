@@ -0,0 +1,41 @@
+import pytest
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._timings import _bucket_bound, _percentile, _Timings
+
+
+@pytest.mark.parametrize("seconds", [0.0, 1e-7, 1e-6, 3.3e-5, 0.01, 0.5, 1.0, 120.0])
+def test_bucket_bound(seconds):
+    bound = _bucket_bound(seconds)
+    assert bound >= seconds
+    assert bound <= max(seconds * 2 ** (1 / 4) * 1.01, 1e-6)
+
+
+def test_percentile():
+    histogram = {}
+    for value in [0.001] * 50 + [0.01] * 45 + [0.1] * 4 + [1.0]:
+        bound = _bucket_bound(value)
+        histogram[bound] = histogram.get(bound, 0) + 1
+    for percent, expected in ((50, 0.001), (95, 0.01), (99, 0.1), (100, 1.0)):
+        assert _percentile(histogram, percent) == pytest.approx(expected, rel=0.1)
+
+
+def test_timings():
+    stats = MemoryStatsCollector(get_crawler())
+    timings = _Timings(stats=stats)
+    for seconds in (0.001, 0.002, 0.002):
+        timings.record("api", seconds)
+    histogram = stats.get_value("scrapy-zyte-api/timing/api/histogram")
+    assert sum(histogram.values()) == 3
+    assert len(histogram) == 2
+    assert stats.get_value("scrapy-zyte-api/timing/api/p50") is None
+
+    timings.dump_percentiles()
+    assert stats.get_value("scrapy-zyte-api/timing/api/p50") == pytest.approx(
+        0.002, rel=0.1
+    )
+    assert stats.get_value("scrapy-zyte-api/timing/api/p99") == pytest.approx(
+        0.002, rel=0.1
+    )
+    assert stats.get_value("scrapy-zyte-api/timing/json/p50") is None